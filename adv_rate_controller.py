@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Adaptive BLE advertising rate per tag
+Well-covered tags reach MAX_LINES long before weak ones when every tag
+advertises at the same interval. The controller estimates, per tag, how many
+positions arrive per second at a given adv_interval, and on each trigger
+assigns each tag the slowest interval that still lets it reach the cap by
+the time the slowest tag (at the fastest interval) does. Tags sharing an
+interval are sent in one trigger request. Only intervals faster than the
+payload's default can speed weak tags up; without them the controller just
+slows well-covered tags down, and the ETA can never drop below the slowest
+tag's time at the fastest interval.
+"""
+
+from typing import Dict, Any, Callable, Iterable, List, Optional
+import math, threading, time
+
+class AdvRateController:
+    """Per-tag yield estimates and adv_interval assignment
+
+    yield = positions per second x adv_interval (ms), i.e. the rate a tag
+    would reach at a 1 ms interval, so estimates carry over between intervals.
+    """
+
+    def __init__(self, tags: Iterable[str], quota: int, progress: Callable[[str], int], base_interval: int,
+                 intervals: Iterable[int] = (20, 40, 80, 160), window: float = 300.0, min_sample: float = 10.0,
+                 margin: float = 1.1, clock: Callable[[], float] = time.monotonic):
+        self.tags = list(tags)
+        self.quota = quota
+        self.progress = progress  # Rows collected so far for a tag
+        self.base_interval = base_interval
+        self.intervals = sorted(set(intervals) | {base_interval})
+        self.window = window  # Seconds of history the yield estimate roughly spans (EWMA)
+        self.min_sample = min_sample  # Shortest period worth turning into a rate sample
+        self.margin = margin  # Ask for this much more rate than strictly needed
+        self.clock = clock
+        self.received: Dict[str, int] = {tag_mac: 0 for tag_mac in self.tags}
+        self.sampled_received = dict(self.received)
+        self.sampled_at = clock()
+        self.yields: Dict[str, float] = {}
+        self.assigned: Dict[str, int] = {tag_mac: base_interval for tag_mac in self.tags}
+        self.lock = threading.Lock()
+
+    def note_position(self, tag_mac: str):
+        """Count one received position (hot path)"""
+        if tag_mac in self.received:
+            self.received[tag_mac] += 1
+
+    def update(self):
+        """Fold the arrivals since the last update into the per-tag yield estimates"""
+        now = self.clock()
+        elapsed = now - self.sampled_at
+        if elapsed < self.min_sample:
+            return
+        alpha = 1 - math.exp(-elapsed / self.window)
+        for tag_mac in self.tags:
+            count = self.received[tag_mac]
+            sample = (count - self.sampled_received[tag_mac]) / elapsed * self.assigned[tag_mac]
+            self.sampled_received[tag_mac] = count
+            previous = self.yields.get(tag_mac)
+            self.yields[tag_mac] = sample if previous is None else previous + alpha * (sample - previous)
+        self.sampled_at = now
+
+    def remaining(self, tag_mac: str) -> int:
+        return max(0, self.quota - self.progress(tag_mac))
+
+    def target_seconds(self) -> Optional[float]:
+        """Time the slowest unfinished tag needs at the fastest interval"""
+        fastest = self.intervals[0]
+        times = [self.remaining(tag_mac) / (self.yields[tag_mac] / fastest)
+                 for tag_mac in self.tags if self.remaining(tag_mac) and self.yields.get(tag_mac)]
+        return max(times) if times else None
+
+    def choose_interval(self, tag_mac: str, target: Optional[float]) -> int:
+        remaining = self.remaining(tag_mac)
+        if remaining == 0:
+            return self.intervals[-1]  # Done: advertise as rarely as allowed
+        tag_yield = self.yields.get(tag_mac)
+        if not tag_yield or target is None:
+            return self.base_interval  # No estimate yet (or never heard)
+        needed = remaining / target * self.margin
+        suitable = [interval for interval in self.intervals if tag_yield / interval >= needed]
+        return max(suitable) if suitable else self.intervals[0]
+
+    def split(self, payload: Dict[str, Any], devices: List[str]) -> List[Dict[str, Any]]:
+        """Trigger bodies for `devices`, one per adv_interval"""
+        with self.lock:
+            self.update()
+            target = self.target_seconds()
+            groups: Dict[int, List[str]] = {}
+            for tag_mac in devices:
+                interval = self.choose_interval(tag_mac, target) if tag_mac in self.received else self.base_interval
+                self.assigned[tag_mac] = interval
+                groups.setdefault(interval, []).append(tag_mac)
+        return [dict(payload, devices=group, ble_settings=dict(payload["ble_settings"], adv_interval=interval))
+                for interval, group in sorted(groups.items())]
+
+    def unheard(self) -> List[str]:
+        """Unfinished tags without a yield estimate (not heard yet, or silent); left out of the ETA"""
+        return [tag_mac for tag_mac in self.tags if self.remaining(tag_mac) and not self.yields.get(tag_mac)]
+
+    def eta_seconds(self) -> Optional[float]:
+        """Seconds until every heard tag reaches the quota at its current interval, None before any estimate"""
+        etas = [self.remaining(tag_mac) / (self.yields[tag_mac] / self.assigned[tag_mac])
+                for tag_mac in self.tags if self.remaining(tag_mac) and self.yields.get(tag_mac)]
+        if etas:
+            return max(etas)
+        return 0.0 if not any(self.remaining(tag_mac) for tag_mac in self.tags) else None
+
+    def print_status(self):
+        with self.lock:
+            eta = self.eta_seconds()
+            floor = self.target_seconds()
+            unheard = len(self.unheard())
+            counts: Dict[int, int] = {}
+            for interval in self.assigned.values():
+                counts[interval] = counts.get(interval, 0) + 1
+        eta_text = "unknown (collecting rates)" if eta is None else f"{eta / 60:.1f} min"
+        if floor is not None:
+            eta_text += f", not below {floor / 60:.1f} min (slowest tag at {self.intervals[0]} ms)"
+        per_interval = ", ".join(f"{interval}: {count}" for interval, count in sorted(counts.items()))
+        print(f"Adv-rate control - ETA to cap all tags: {eta_text}{f' ({unheard} unheard tags excluded)' if unheard and eta is not None else ''} | "
+              f"Tags per adv_interval: {per_interval}")
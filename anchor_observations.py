@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Compact per-position anchor observations
+The anchors heard in one position are kept as one plain tuple per anchor
+(keyed by MAC, so a repeated MAC overwrites like the old dict did) instead
+of a 7-key dict per anchor, with the map ID interned to a small integer
+code. Tuples of numbers and strings are a fraction of a dict's size and
+drop out of the cyclic GC's tracking, and the per-map statistics index a
+list by code instead of hashing map ID strings.
+"""
+
+from typing import Dict, Any, Iterable, Iterator, List, Sequence, Tuple
+import threading
+
+from row_layout import ANCHOR_WIDTH
+from rssi_stats import MapStats
+
+# Record layout: ANCHOR_FIELDS order, with the map code in place of the map ID
+RSSI, USED, X, Y, MAP_CODE, DISTANCE, SIGNAL_QUALITY = range(ANCHOR_WIDTH)
+
+class MapCodes:
+    """Interning table between map IDs and small integer codes (codes are never reused)"""
+
+    def __init__(self, map_ids: Iterable[str] = ()):
+        self.names: List[Any] = []
+        self.codes: Dict[Any, int] = {}
+        self.lock = threading.Lock()
+        for map_id in map_ids:
+            self.code(map_id)
+
+    def code(self, map_id: Any) -> int:
+        code = self.codes.get(map_id)
+        if code is None:
+            with self.lock:  # Only new map IDs take the lock
+                code = self.codes.get(map_id)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(map_id)
+                    self.codes[map_id] = code
+        return code
+
+class AnchorObservations:
+    """The anchors of one position message: MAC -> (rssi, used, x, y, map code, distance, signal quality)"""
+
+    __slots__ = ("map_codes", "records")
+
+    def __init__(self, map_codes: MapCodes):
+        self.map_codes = map_codes
+        self.records: Dict[str, Tuple[Any, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, anchor_mac: str, rssi: Any, used: int, x: Any, y: Any, map_id: Any, distance: Any, signal_quality: Any):
+        """Record one heard anchor; a MAC seen before keeps its position and takes the new values"""
+        code = self.map_codes.codes.get(map_id)
+        if code is None:
+            code = self.map_codes.code(map_id)
+        self.records[anchor_mac] = (rssi, used, x, y, code, distance, signal_quality)
+
+    def macs(self) -> Iterable[str]:
+        return self.records.keys()
+
+    def entries(self) -> Iterator[Tuple[Any, ...]]:
+        """(mac, rssi, used, x, y, map_id, distance, signal_quality) per anchor, in the order first heard"""
+        names = self.map_codes.names
+        for anchor_mac, (rssi, used, x, y, code, distance, quality) in self.records.items():
+            yield anchor_mac, rssi, used, x, y, names[code], distance, quality
+
+    def scatter(self, row: List[Any], anchor_offsets: Dict[str, int]):
+        """Write the 7 cells of every heard anchor into a wide row; anchors outside the header are skipped"""
+        names = self.map_codes.names
+        for anchor_mac, (rssi, used, x, y, code, distance, quality) in self.records.items():
+            offset = anchor_offsets.get(anchor_mac)
+            if offset is not None:
+                row[offset:offset + ANCHOR_WIDTH] = (rssi, used, x, y, names[code], distance, quality)
+
+    def map_stats(self, map_ids: Sequence[str]) -> Dict[str, MapStats]:
+        """Per-map statistics in one pass (anchors on other maps are ignored)"""
+        stats = {map_id: MapStats() for map_id in map_ids}
+        by_code = [stats.get(name) for name in self.map_codes.names]
+        for record in self.records.values():
+            map_stats = by_code[record[MAP_CODE]]
+            if map_stats is not None:
+                map_stats.add(record[RSSI], record[USED])
+        return stats
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        """The equivalent all_anchors dict of 7-key dicts (for tests and the benchmark)"""
+        return {anchor_mac: {"rssi": rssi, "used": used, "x": x, "y": y, "map_id": map_id,
+                             "distance": distance, "signal_quality": quality}
+                for anchor_mac, rssi, used, x, y, map_id, distance, quality in self.entries()}
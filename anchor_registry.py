@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Persistent anchor registry
+Anchor positions keyed by MAC (x, y, map_id, first/last seen, confidence),
+kept up to date from the coordinates live messages already carry and saved
+as a small JSON file, so startup does not have to rescan the CSV files.
+"""
+
+from typing import Dict, Any, Optional
+import json, math, os, threading, time
+
+POSITION_TOLERANCE = 0.01  # Metres; a larger change means the anchor was moved/re-surveyed
+SIGHTING_SAVE_INTERVAL = 300.0  # Seconds; sightings alone (last_seen, observations) are written at most this often
+
+class AnchorRegistry:
+    """Anchor MAC -> {"x", "y", "map_id", "first_seen", "last_seen", "observations", "confidence"}
+
+    entries can be used directly as the generator's ANCHOR_DATABASE. Confidence
+    is observations / (observations + 1), where observations counts sightings
+    agreeing with the stored position since it last changed; it is brought
+    up to date when the file is written.
+    """
+
+    def __init__(self, path: str, sighting_interval: float = SIGHTING_SAVE_INTERVAL):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.dirty = False  # An anchor was added or moved since the last save
+        self.moved = 0  # Position changes seen this session
+        self.version = 0  # Bumped whenever an anchor is added or moved (default coordinates changed)
+        self.sightings = 0  # Sightings of known anchors since the last save
+        self.sighting_interval = sighting_interval
+        self.saved_at = time.monotonic()
+
+    def load(self) -> "AnchorRegistry":
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"⚠️ Could not read anchor registry {self.path}: {e}")
+                self.entries = {}
+        return self
+
+    def bootstrap(self, anchor_db: Dict[str, Dict[str, Any]]):
+        """Seed anchors not yet in the registry from a CSV-scanned anchor database (one-time)"""
+        with self.lock:
+            for anchor_mac, data in anchor_db.items():
+                if anchor_mac not in self.entries:
+                    self.entries[anchor_mac] = {
+                        "x": data["x"], "y": data["y"], "map_id": data["map_id"],
+                        "first_seen": None, "last_seen": None, "observations": 1, "confidence": 0.5
+                    }
+                    self.dirty = True
+                    self.version += 1
+
+    def observe(self, anchor_mac: str, x: float, y: float, map_id: str, timestamp: Optional[int] = None):
+        """Record a sighting with coordinates from a live message"""
+        entry = self.entries.get(anchor_mac)
+        if (entry is not None and entry["x"] == x and entry["y"] == y and (not map_id or entry["map_id"] == map_id)
+                and entry["first_seen"] is not None):
+            # Known anchor at its stored position, the common case: no lock, nothing to rewrite now
+            # (a sighting counted by two workers at once may be lost, it only feeds confidence)
+            entry["last_seen"] = timestamp
+            entry["observations"] += 1
+            self.sightings += 1
+            return
+        with self.lock:
+            entry = self.entries.get(anchor_mac)
+            if entry is None:
+                entry = self.entries[anchor_mac] = {
+                    "x": x, "y": y, "map_id": map_id,
+                    "first_seen": timestamp, "last_seen": timestamp, "observations": 0, "confidence": 0.0
+                }
+            elif math.hypot(entry["x"] - x, entry["y"] - y) > POSITION_TOLERANCE or (map_id and entry["map_id"] != map_id):
+                # Anchor was moved: trust the new position, but start its confidence over
+                entry["x"], entry["y"] = x, y
+                entry["map_id"] = map_id or entry["map_id"]
+                entry["observations"] = 0
+                self.moved += 1
+            else:
+                # Within the tolerance of the stored position, or the first sighting of a bootstrapped anchor
+                if entry["first_seen"] is None:
+                    entry["first_seen"] = timestamp
+                entry["last_seen"] = timestamp
+                entry["observations"] += 1
+                self.sightings += 1
+                return
+            if entry["first_seen"] is None:
+                entry["first_seen"] = timestamp
+            entry["last_seen"] = timestamp
+            entry["observations"] += 1
+            self.dirty = True
+            self.version += 1
+
+    def save(self, final: bool = False):
+        """Atomically rewrite the registry file if an anchor was added or moved
+        
+        Sightings alone are written once sighting_interval has passed since
+        the last write, or on the final save.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not self.dirty and not (self.sightings and (final or now - self.saved_at >= self.sighting_interval)):
+                return
+            for entry in self.entries.values():
+                entry["confidence"] = round(entry["observations"] / (entry["observations"] + 1), 4)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+            self.sightings = 0
+            self.saved_at = now
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Micro-batched feature extraction for the wide CSV rows
+Decoded positions are queued as flat per-anchor cell tuples (one entry per
+heard anchor, tagged with its row). At flush the entries are transposed into
+columns, the per-map RSSI statistics are computed for the whole batch with
+NumPy, and all rows are assembled at once in a 2-D array prefilled with the
+layout template. For CSV output the cells are rendered
+to text in the same pass, so the writers only append finished lines instead
+of formatting every column of every row. Rows are the scalar path's, cell
+for cell: per-map statistics follow MapStats exactly (integer sums for int
+RSSI, the same Welford steps for float RSSI).
+"""
+
+from itertools import chain, compress
+from typing import Dict, Any, Callable, List, Optional, Sequence, Set, Tuple
+import math, threading, time
+import numpy as np
+
+from row_layout import RowLayout, ANCHOR_FIELDS, ANCHOR_WIDTH, BASE_WIDTH, MAP_STAT_WIDTH
+from rssi_stats import MapStats, exact_mean, exact_stdev
+from anchor_observations import AnchorObservations
+
+DISTANCE_CELL = ANCHOR_FIELDS.index("distance")
+CSV_SPECIAL = (",", '"', "\r", "\n")  # Characters csv.writer (excel dialect) quotes
+
+def render_cells(values: Sequence[Any]) -> List[str]:
+    """Text csv.writer (excel dialect) writes for each value; the values are plain Python scalars"""
+    rendered = list(map(str, values))
+    text = "".join(rendered)
+    if "None" in text or any(char in text for char in CSV_SPECIAL):
+        # Rare: quote the odd string and write None as empty, one value at a time
+        rendered = [render_cell(value) for value in values]
+    return rendered
+
+def render_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    text = str(value)
+    if any(char in text for char in CSV_SPECIAL):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+def welford(keys: np.ndarray, values: np.ndarray, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and sum of squared deviations per key, with MapStats.add's float steps in entry order
+    
+    Step n updates the n-th value of every key at once, so each key sees the
+    same operations as the scalar accumulator.
+    """
+    mean = np.zeros(size)
+    m2 = np.zeros(size)
+    if not len(keys):
+        return mean, m2
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys)) - np.searchsorted(sorted_keys, sorted_keys)
+    for step in range(int(rank.max()) + 1):
+        at = rank == step
+        step_keys, step_values = keys[at], values[at]
+        delta = step_values - mean[step_keys]
+        mean[step_keys] += delta / (step + 1)
+        m2[step_keys] += delta * (step_values - mean[step_keys])
+    return mean, m2
+
+class FeatureBatch:
+    """Up to `capacity` positions for one RowLayout, turned into rows by flush()
+
+    Anchors are passed as the generators' AnchorObservations; a distance of
+    None is computed here from the tag and anchor coordinates.
+    """
+
+    def __init__(self, layout: RowLayout, map_ids: Sequence[str], capacity: int = 256,
+                 max_delay: float = 0.5, clock=time.monotonic):
+        self.layout = layout
+        self.map_ids = list(map_ids)
+        self.map_codes = {map_id: code for code, map_id in enumerate(self.map_ids)}
+        self.map_columns = [layout.map_offsets[map_id] for map_id in self.map_ids]
+        self.stat_columns = (np.array(self.map_columns)[:, None] + np.arange(MAP_STAT_WIDTH)).ravel()
+        self.template = np.empty(layout.width, dtype=object)
+        self.template[:] = layout.template
+        self.rendered_template = np.empty(layout.width, dtype=object)  # The template as CSV text
+        self.rendered_template[:] = render_cells(layout.template)
+        self.grids: Dict[bool, np.ndarray] = {}  # Preallocated template rows, by rendered or not
+        self.capacity = capacity
+        self.max_delay = max_delay  # Flush a partial batch once its oldest position waited this long
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.first_added: Optional[float] = None
+        self.tag_macs: List[str] = []
+        self.bases: List[List[Any]] = []
+        self.contexts: List[Any] = []
+        self.row_starts: List[int] = [0]  # Entries of row r are cells[row_starts[r]:row_starts[r + 1]]
+        self.cells: List[Tuple[Any, ...]] = []  # 7 cells per heard anchor
+        self.distance_entries = np.empty(0, dtype=np.int64)  # Entries added with distance None...
+        self.distance_values: List[float] = []  # ...and their computed distances
+        self.columns: List[int] = []  # Layout offset of each entry, -1 for anchors outside the header
+
+    def __len__(self) -> int:
+        return len(self.bases)
+
+    @property
+    def full(self) -> bool:
+        return len(self.bases) >= self.capacity
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """True if the batch holds positions older than max_delay"""
+        if self.first_added is None:
+            return False
+        return (self.clock() if now is None else now) - self.first_added >= self.max_delay
+
+    def add(self, tag_mac: str, base: Sequence[Any], anchors: AnchorObservations, context: Any = None):
+        """Queue one position; base is the 9 leading columns (tag x/y at 2 and 3)"""
+        names = anchors.map_codes.names
+        self.cells.extend((rssi, used, x, y, names[code], distance, quality)
+                          for rssi, used, x, y, code, distance, quality in anchors.records.values())
+        self.columns.extend(map(self.layout.anchor_offsets.get, anchors.records, [-1] * len(anchors)))
+        self.row_starts.append(len(self.cells))
+        self.tag_macs.append(tag_mac)
+        self.bases.append(list(base))
+        self.contexts.append(context)
+        if self.first_added is None:
+            self.first_added = self.clock()
+
+    def entry_rows(self) -> np.ndarray:
+        """Row index of every entry"""
+        return np.repeat(np.arange(len(self.bases)), np.diff(self.row_starts))
+
+    def compute_distances(self, entry_rows: np.ndarray, xs: Sequence[Any], ys: Sequence[Any], distances: Sequence[Any]):
+        """Euclidean tag-anchor distance for entries added with distance None
+        
+        Computed per entry with calculate_distance's float operations: x ** 2
+        (C pow) and NumPy's x * x round differently in rare cases.
+        """
+        needs = [entry for entry, distance in enumerate(distances) if distance is None]
+        if not needs:
+            return
+        bases = self.bases
+        rows = entry_rows[needs].tolist()
+        self.distance_entries = np.array(needs, dtype=np.int64)
+        self.distance_values = [math.sqrt((xs[entry] - bases[row][2]) ** 2 + (ys[entry] - bases[row][3]) ** 2)
+                                for entry, row in zip(needs, rows)]
+
+    def map_stat_cells(self, entry_rows: np.ndarray, rssi_cells: Sequence[Any], used_cells: Sequence[Any],
+                       map_cells: Sequence[Any]) -> List[List[Any]]:
+        """The 8 statistics cells for every (row, map), row-major, like MapStats.values()"""
+        maps = len(self.map_ids)
+        size = len(self.bases) * maps
+        count = len(self.cells)
+        entry_map = np.fromiter(map(self.map_codes.get, map_cells, [-1] * count), np.int64, count)
+        on_map = entry_map >= 0
+        entry_keys = entry_rows * maps + entry_map
+        has_rssi = np.fromiter((value != "" and value is not None for value in rssi_cells), np.bool_, count) & on_map
+        rssi_values = [value for value, has in zip(rssi_cells, has_rssi.tolist()) if has]
+        keys = entry_keys[on_map]
+        rssi_keys = entry_keys[has_rssi]
+        rssi = np.array(rssi_values, dtype=np.float64)
+        non_int = np.fromiter((type(value) is not int for value in rssi_values), np.bool_, len(rssi_values))
+        used = (np.array(used_cells) == 1)[on_map]
+
+        total = np.bincount(keys, minlength=size)
+        used_count = np.bincount(keys, weights=used, minlength=size).astype(np.int64)
+        rssi_count = np.bincount(rssi_keys, minlength=size)
+        non_int_count = np.bincount(rssi_keys, weights=non_int, minlength=size)
+        # Int RSSI: exact sum and sum of squares, as MapStats keeps them
+        int_rssi = np.where(non_int, 0, rssi).astype(np.int64)
+        sums = np.zeros(size, np.int64)
+        squares = np.zeros(size, np.int64)
+        np.add.at(sums, rssi_keys, int_rssi)
+        np.add.at(squares, rssi_keys, int_rssi * int_rssi)
+        # Float RSSI: MapStats' Welford update
+        mean, m2 = welford(rssi_keys, rssi, size)
+        std = np.sqrt(m2 / np.maximum(rssi_count - 1, 1))
+        low = np.full(size, np.inf)
+        high = np.full(size, -np.inf)
+        np.minimum.at(low, rssi_keys, rssi)
+        np.maximum.at(high, rssi_keys, rssi)
+
+        # Mixed int/float RSSI keeps per-value types in MapStats; rare enough to redo those scalar
+        mixed = np.flatnonzero((non_int_count > 0) & (non_int_count < rssi_count))
+        mixed_stats: Dict[int, MapStats] = {}
+        if len(mixed):
+            for entry in np.flatnonzero(on_map & np.isin(entry_keys, mixed)).tolist():
+                stats = mixed_stats.setdefault(int(entry_keys[entry]), MapStats())
+                stats.add(self.cells[entry][0], self.cells[entry][1])
+
+        cells = []
+        for key, (total_n, used_n, count_n, mean_v, std_v, low_v, high_v, all_int, sum_n, squares_n) in enumerate(zip(
+                total.tolist(), used_count.tolist(), rssi_count.tolist(), mean.tolist(), std.tolist(),
+                low.tolist(), high.tolist(), (non_int_count == 0).tolist(), sums.tolist(), squares.tolist())):
+            if key in mixed_stats:
+                cells.append(mixed_stats[key].values())
+                continue
+            if count_n == 0:
+                cells.append([total_n, used_n, total_n, "", "", "", "", ""])
+                continue
+            if all_int:
+                low_v, high_v = int(low_v), int(high_v)
+                mean_v = exact_mean(sum_n, count_n)
+                std_v = exact_stdev(sum_n, squares_n, count_n) if count_n > 1 else 0
+            cells.append([total_n, used_n, total_n, mean_v, high_v, low_v, std_v if count_n > 1 else 0, high_v - low_v])
+        return cells
+
+    def template_grid(self, render: bool, count: int) -> np.ndarray:
+        """At least `count` rows holding the (rendered) template, allocated once and reused by every flush"""
+        grid = self.grids.get(render)
+        if grid is None or len(grid) < count:
+            grid = self.grids[render] = np.empty((max(self.capacity, count), self.layout.width), dtype=object)
+            grid[:] = self.rendered_template if render else self.template
+        return grid
+        
+    def flush(self, render: bool = False) -> List[Tuple[str, Any, Any]]:
+        """Build all queued rows; returns (tag_mac, row, context) in the order they were added
+        
+        With render set, each row is its CSV line (no line terminator) rather than a list of values.
+        """
+        if not self.bases:
+            return []
+        count = len(self.bases)
+        entry_rows = self.entry_rows()
+        rssi_cells, used_cells, xs, ys, map_cells, distances, _ = zip(*self.cells) if self.cells else ([],) * ANCHOR_WIDTH
+        self.compute_distances(entry_rows, xs, ys, distances)
+        stats = self.map_stat_cells(entry_rows, rssi_cells, used_cells, map_cells)
+
+        # Every cell that differs from the template: base columns, map statistics, heard anchors in the header
+        columns = np.array(self.columns, dtype=np.int64)
+        heard = columns >= 0
+        values = list(chain.from_iterable(self.bases))
+        values += chain.from_iterable(stats)
+        anchors_start = len(values)
+        values += chain.from_iterable(compress(self.cells, heard.tolist()))
+        # Computed distances replace the None the entries were added with
+        computed = heard[self.distance_entries]
+        ranks = np.cumsum(heard)[self.distance_entries[computed]] - 1
+        for index, distance in zip((anchors_start + ranks * ANCHOR_WIDTH + DISTANCE_CELL).tolist(),
+                                   compress(self.distance_values, computed.tolist())):
+            values[index] = distance
+        row_index = np.concatenate((
+            np.repeat(np.arange(count), BASE_WIDTH),
+            np.repeat(np.arange(count), len(self.stat_columns)),
+            np.repeat(entry_rows[heard], ANCHOR_WIDTH)))
+        column_index = np.concatenate((
+            np.tile(np.arange(BASE_WIDTH), count),
+            np.tile(self.stat_columns, count),
+            (columns[heard][:, None] + np.arange(ANCHOR_WIDTH)).ravel()))
+            
+        template = self.rendered_template if render else self.template
+        grid = self.template_grid(render, count)
+        grid[row_index, column_index] = render_cells(values) if render else values
+        rows = grid[:count].tolist()
+        grid[row_index, column_index] = template[column_index]  # Back to the template for the next flush
+        if render:
+            rows = list(map(",".join, rows))
+        result = list(zip(self.tag_macs, rows, self.contexts))
+        self.reset()
+        return result
+
+class BatchedRowWriter:
+    """Collects the generators' positions in a FeatureBatch and writes the finished rows to each tag's writer
+    
+    Rows are handed over as CSV lines when the writers take them
+    (write_rendered), otherwise as value lists. after_row(tag_mac, base) runs
+    once a row was written; observe(stage, started) records stage timings.
+    """
+    
+    def __init__(self, writers: Dict[str, Any], map_ids: Sequence[str], get_layout: Callable[[Set[str]], RowLayout],
+                 capacity: int = 256, max_delay: float = 0.5,
+                 after_row: Optional[Callable[[str, List[Any]], None]] = None,
+                 observe: Optional[Callable[[str, float], float]] = None):
+        self.writers = writers
+        self.map_ids = list(map_ids)
+        self.get_layout = get_layout
+        self.capacity = capacity
+        self.max_delay = max_delay
+        self.after_row = after_row
+        self.observe = observe
+        self.batch: Optional[FeatureBatch] = None
+        self.lock = threading.Lock()  # Guards batch when ingestion workers run concurrently
+        
+    def queue(self, tag_mac: str, base: List[Any], anchors: AnchorObservations, anchor_macs: Set[str]):
+        """Add a position to the batch, writing the batch once it is full"""
+        layout = self.get_layout(anchor_macs)
+        with self.lock:
+            if self.batch is not None and self.batch.layout is not layout:
+                self.write()  # Rows built from the previous column layout
+                self.batch = None
+            if self.batch is None:
+                self.batch = FeatureBatch(layout, self.map_ids, self.capacity, self.max_delay)
+            self.batch.add(tag_mac, base, anchors, context=base)
+            if self.batch.full:
+                self.write()
+                
+    def write(self):
+        """Build every queued row and hand it to the tag's writer (caller holds the lock)"""
+        started = time.perf_counter()
+        render = all(hasattr(writer, "write_rendered") for writer in self.writers.values())
+        rows = self.batch.flush(render=render)
+        assembled = self.observe("assembly", started) if self.observe else None  # Per batch, not per row
+        for tag_mac, row, base in rows:
+            if render:
+                self.writers[tag_mac].write_rendered(row, base)
+            else:
+                self.writers[tag_mac].writerow(row)
+            if self.after_row is not None:
+                self.after_row(tag_mac, base)
+        if self.observe:
+            self.observe("write", assembled)
+            
+    def flush(self, force: bool = False):
+        """Write a partial batch once it waited max_delay (or right away if forced)"""
+        with self.lock:
+            if self.batch is not None and len(self.batch) and (force or self.batch.due()):
+                self.write()
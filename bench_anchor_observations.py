@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: AnchorObservations vs the dict-of-dicts all_anchors
+Builds the anchors of a position, computes the per-map statistics and
+assembles the wide row both ways; reports throughput (timeit) and the
+memory each position's anchors hold while queued (tracemalloc)
+"""
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+sys.path.append('.')
+from anchor_observations import AnchorObservations, MapCodes
+from rssi_stats import sweep_map_stats
+from row_layout import RowLayout
+from generate_ml_data import MAP_IDS, generate_csv_header
+from test_ml_data_generation import create_sample_mqtt_message
+
+def anchor_fields(pos, key: str, used: int):
+    for anchor in pos.get(key, []):
+        yield anchor["mac"], anchor["rssi"], used, anchor.get("x", 0), anchor.get("y", 0), anchor["map_id"], \
+            anchor.get("cart_d", 0), anchor.get("signal_quality", "") if used else ""
+
+def build_dicts(pos):
+    """What process_position_message built before: one 7-key dict per anchor"""
+    all_anchors = {}
+    for key, used in (("used_anchors", 1), ("unused_anchors", 0)):
+        for mac, rssi, used, x, y, map_id, distance, quality in anchor_fields(pos, key, used):
+            all_anchors[mac] = {"rssi": rssi, "used": used, "x": x, "y": y, "map_id": map_id,
+                                "distance": distance, "signal_quality": quality}
+    return all_anchors
+
+def build_observations(pos, map_codes: MapCodes) -> AnchorObservations:
+    all_anchors = AnchorObservations(map_codes)
+    for key, used in (("used_anchors", 1), ("unused_anchors", 0)):
+        for fields in anchor_fields(pos, key, used):
+            all_anchors.add(*fields)
+    return all_anchors
+
+def dict_path(pos, layout: RowLayout) -> list:
+    all_anchors = build_dicts(pos)
+    map_stats = sweep_map_stats(all_anchors.values(), MAP_IDS)
+    row = layout.new_row()
+    for map_id in MAP_IDS:
+        layout.set_map_stats(row, map_id, map_stats[map_id].values())
+    for anchor_mac, anchor in all_anchors.items():
+        layout.set_anchor(row, anchor_mac, [anchor["rssi"], anchor["used"], anchor["x"], anchor["y"],
+                                            anchor["map_id"], anchor["distance"], anchor["signal_quality"]])
+    return row
+
+def observation_path(pos, layout: RowLayout, map_codes: MapCodes) -> list:
+    all_anchors = build_observations(pos, map_codes)
+    map_stats = all_anchors.map_stats(MAP_IDS)
+    row = layout.new_row()
+    for map_id in MAP_IDS:
+        layout.set_map_stats(row, map_id, map_stats[map_id].values())
+    all_anchors.scatter(row, layout.anchor_offsets)
+    return row
+
+def bench(label: str, func, number: int) -> float:
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    rate = number / best
+    print(f"  {label:<28} {rate:>12,.0f} msg/s  ({best / number * 1e6:.2f} µs/msg)")
+    return rate
+
+def allocated(func, number: int):
+    """Bytes held per result while `number` results are kept (e.g. queued in a feature batch)"""
+    tracemalloc.start()
+    results = []
+    start, _ = tracemalloc.get_traced_memory()
+    for _ in range(number):
+        results.append(func())
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (held - start) / number
+
+def widen(pos, used: int, unused: int):
+    """Repeat the sample anchors under new MACs to get a realistic number of heard anchors"""
+    for prefix, (key, count) in enumerate((("used_anchors", used), ("unused_anchors", unused))):
+        sample = pos[key]
+        pos[key] = [dict(sample[i % len(sample)], mac=f"{prefix}{i:011x}") for i in range(count)]
+
+def main():
+    number = 20000
+    position_data = json.loads(json.dumps(create_sample_mqtt_message("f8c6e10eb94d")))
+    pos = position_data["location"]["position"]
+    widen(pos, used=6, unused=8)
+    anchor_macs = {anchor["mac"] for key in ("used_anchors", "unused_anchors") for anchor in pos.get(key, [])}
+    layout = RowLayout(generate_csv_header(anchor_macs), MAP_IDS)
+    map_codes = MapCodes(MAP_IDS)
+    heard = len(build_dicts(pos))
+
+    print(f"🏁 Anchor container benchmark ({heard} anchors per position)")
+    baseline = bench("dict of dicts", lambda: dict_path(pos, layout), number)
+    compact = bench("AnchorObservations", lambda: observation_path(pos, layout, map_codes), number)
+    print(f"  Speedup: {compact / baseline:.2f}x")
+
+    print("🧮 Memory per position (anchors only, tracemalloc)")
+    for label, build in (("dict of dicts", lambda: build_dicts(pos)),
+                         ("AnchorObservations", lambda: build_observations(pos, map_codes))):
+        print(f"  {label:<28} {allocated(build, 2000):>8,.0f} bytes/position")
+
+if __name__ == "__main__":
+    main()
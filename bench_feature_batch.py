@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-position wide rows vs FeatureBatch
+Builds and writes the CSV rows of the same positions one at a time
+(template copy + csv.writer) and through FeatureBatch (2-D template grid,
+rendered lines), with and without anchor-database defaults in the template
+"""
+
+import csv
+import io
+import json
+import random
+import sys
+import timeit
+
+sys.path.append('.')
+from anchor_observations import AnchorObservations, MapCodes
+from batch_features import FeatureBatch
+from row_layout import RowLayout
+from generate_ml_data import MAP_IDS, generate_csv_header
+from test_ml_data_generation import create_sample_mqtt_message
+
+def make_positions(anchor_macs, count: int, heard: int = 14):
+    """Positions hearing `heard` random anchors each, 6 of them used (with coordinates)"""
+    rng = random.Random(1)
+    positions = []
+    for index in range(count):
+        position_data = json.loads(json.dumps(create_sample_mqtt_message("f8c6e10eb94d")))
+        pos = position_data["location"]["position"]
+        macs = rng.sample(anchor_macs, heard)
+        pos["used_anchors"] = [{"mac": mac, "rssi": round(rng.uniform(-110, -80), 2), "map_id": MAP_IDS[i % len(MAP_IDS)],
+                                "x": rng.uniform(0, 60), "y": rng.uniform(0, 60)} for i, mac in enumerate(macs[:6])]
+        pos["unused_anchors"] = [{"mac": mac, "rssi": round(rng.uniform(-115, -90), 2), "map_id": MAP_IDS[i % len(MAP_IDS)],
+                                  "cart_d": round(rng.uniform(1, 40), 2)} for i, mac in enumerate(macs[6:])]
+        base = [position_data["location"]["map_id"], position_data["timestamp"] + index, pos["x"], pos["y"],
+                0.78, 0.73, 0.73, 0.86, MAP_IDS[0]]
+        positions.append((base, pos))
+    return positions
+
+def observations(pos, map_codes: MapCodes, batched: bool) -> AnchorObservations:
+    all_anchors = AnchorObservations(map_codes)
+    for anchor in pos["used_anchors"]:
+        # The batch computes used-anchor distances itself
+        distance = None if batched else 1.0
+        all_anchors.add(anchor["mac"], anchor["rssi"], 1, anchor["x"], anchor["y"], anchor["map_id"], distance, "")
+    for anchor in pos["unused_anchors"]:
+        all_anchors.add(anchor["mac"], anchor["rssi"], 0, 0, 0, anchor["map_id"], anchor["cart_d"], "")
+    return all_anchors
+
+def scalar_path(positions, layout: RowLayout, map_codes: MapCodes):
+    writer = csv.writer(io.StringIO())
+    for base, pos in positions:
+        all_anchors = observations(pos, map_codes, False)
+        map_stats = all_anchors.map_stats(MAP_IDS)
+        row = layout.new_row()
+        layout.set_base(row, base)
+        for map_id in MAP_IDS:
+            layout.set_map_stats(row, map_id, map_stats[map_id].values())
+        all_anchors.scatter(row, layout.anchor_offsets)
+        writer.writerow(row)
+
+def batch_path(positions, layout: RowLayout, map_codes: MapCodes, size: int):
+    output = io.StringIO()
+    batch = FeatureBatch(layout, MAP_IDS, size)
+    for base, pos in positions:
+        batch.add("tag", base, observations(pos, map_codes, True))
+        if batch.full:
+            for _, line, _ in batch.flush(render=True):
+                output.write(line)
+                output.write("\r\n")
+
+def bench(label: str, func, number: int) -> float:
+    best = min(timeit.repeat(func, number=1, repeat=7))
+    rate = number / best
+    print(f"  {label:<28} {rate:>12,.0f} rows/s  ({best / number * 1e6:.2f} µs/row)")
+    return rate
+
+def main():
+    number = 2048
+    rng = random.Random(2)
+    anchor_macs = sorted(f"{rng.getrandbits(48):012x}" for _ in range(240))
+    positions = make_positions(anchor_macs, number)
+    map_codes = MapCodes(MAP_IDS)
+    header = generate_csv_header(set(anchor_macs))
+    anchor_database = {mac: {"x": rng.uniform(0, 60), "y": rng.uniform(0, 60), "map_id": MAP_IDS[0]} for mac in anchor_macs}
+    
+    for label, database in (("empty template", None), ("anchor database defaults", anchor_database)):
+        layout = RowLayout(header, MAP_IDS, database)
+        print(f"🏁 Wide rows, {len(header)} columns, 14 heard anchors per position, {label}")
+        baseline = bench("per position", lambda: scalar_path(positions, layout, map_codes), number)
+        for size in (64, 256):
+            rate = bench(f"FeatureBatch({size})", lambda: batch_path(positions, layout, map_codes, size), number)
+            print(f"  Speedup: {rate / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
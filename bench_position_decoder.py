@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: typed PositionMessage decoder vs the current decode + json.loads path
+Uses the message shape from test_ml_data_generation.create_sample_mqtt_message
+"""
+
+import json
+import sys
+import timeit
+
+sys.path.append('.')
+from position_decoder import decode_position, JSON_BACKEND
+from test_ml_data_generation import create_sample_mqtt_message
+
+def current_path(raw_payload: bytes) -> int:
+    """What on_message + the feature code do today"""
+    position_data = json.loads(raw_payload.decode("utf-8", errors="replace"))
+    pos = position_data["location"]["position"]
+    heard = 0
+    for anchor in pos.get("used_anchors", []):
+        heard += anchor.get("rssi") is not None and anchor.get("x") is not None
+    for anchor in pos.get("unused_anchors", []):
+        heard += anchor.get("rssi") is not None and anchor.get("x") is None
+    return heard
+
+def typed_path(raw_payload: bytes) -> int:
+    """Decode into a PositionMessage and walk its parallel arrays"""
+    message = decode_position(raw_payload)
+    heard = 0
+    for rssi, x, used in zip(message.anchor_rssi, message.anchor_x, message.anchor_used):
+        heard += rssi is not None and (x is not None) == bool(used)
+    return heard
+
+def bench(label: str, func, raw_payload: bytes, number: int) -> float:
+    best = min(timeit.repeat(lambda: func(raw_payload), number=number, repeat=5))
+    rate = number / best
+    print(f"  {label:<28} {rate:>12,.0f} msg/s  ({best / number * 1e6:.2f} µs/msg)")
+    return rate
+
+def main():
+    number = 20000
+    raw_payload = json.dumps(create_sample_mqtt_message("f8c6e10eb94d")).encode("utf-8")
+
+    print(f"🏁 Position decode benchmark ({len(raw_payload)} byte payload, backend: {JSON_BACKEND})")
+    baseline = bench("decode + json.loads", current_path, raw_payload, number)
+    typed = bench(f"decode_position ({JSON_BACKEND})", typed_path, raw_payload, number)
+    print(f"  Speedup: {typed / baseline:.2f}x")
+
+if __name__ == "__main__":
+    main()
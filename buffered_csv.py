@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Group-commit CSV writers for the per-tag training data files
+Rows are buffered in memory and pushed to the file by row count, byte size
+or elapsed time instead of flushing after every single row
+"""
+
+from typing import Dict, Any, Iterable, List, Optional, Callable, Sequence
+import csv, io, os, signal, threading, time
+
+class FlushPolicy:
+    """When buffered rows are written out, and how often the file is fsynced"""
+
+    def __init__(self, max_rows: int = 200, max_bytes: int = 256 * 1024,
+                 max_interval: float = 5.0, fsync_interval: Optional[float] = None):
+        self.max_rows = max_rows              # Flush once this many rows are buffered
+        self.max_bytes = max_bytes            # ...or once the buffer reaches this size
+        self.max_interval = max_interval      # ...or once the oldest buffered row is this old (seconds)
+        self.fsync_interval = fsync_interval  # fsync at most this often (seconds), None disables fsync
+
+class BufferedCSVWriter:
+    """csv.writer replacement that batches rows for one file handle
+
+    With mark_column set, the value in that column (e.g. the position
+    timestamp) of the first and last row that reached the file is kept, so
+    bookkeeping never describes rows that are still buffered.
+    """
+
+    def __init__(self, file_handle, policy: Optional[FlushPolicy] = None,
+                 clock: Callable[[], float] = time.monotonic, mark_column: Optional[int] = None):
+        self.file_handle = file_handle
+        self.policy = policy or FlushPolicy()
+        self.clock = clock
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows_buffered = 0
+        self.rows_on_disk = 0     # Rows handed to the OS (flushed)
+        self.rows_synced = 0      # Rows known durable (fsynced)
+        self.bytes_on_disk = 0
+        self.first_buffered_at: Optional[float] = None
+        self.mark_column = mark_column
+        self.buffered_marks: List[Any] = [None, None]  # mark_column of the first and last buffered row
+        self.first_mark_on_disk: Any = None
+        self.last_mark_on_disk: Any = None
+        self.last_sync = self.clock()
+        # Re-entrant so a signal-handler flush on the writing thread cannot deadlock
+        self.lock = threading.RLock()
+
+    @property
+    def bytes_buffered(self) -> int:
+        return self.buffer.tell()
+        
+    @property
+    def closed(self) -> bool:
+        return self.file_handle.closed
+
+    def writerow(self, row: Iterable[Any]):
+        """Buffer one row and flush if the row or byte limit is reached"""
+        with self.lock:
+            self.writer.writerow(row)
+            self.row_buffered(row)
+            
+    def write_rendered(self, line: str, leading: Sequence[Any] = ()):
+        """Buffer one row already rendered as CSV text (without the line terminator)
+        
+        leading holds the row's first values, enough to include mark_column.
+        """
+        with self.lock:
+            self.buffer.write(line)
+            self.buffer.write(self.writer.dialect.lineterminator)
+            self.row_buffered(leading)
+            
+    def row_buffered(self, row: Sequence[Any]):
+        """Count a row just added to the buffer and flush if a limit is reached (caller holds the lock)"""
+        if self.mark_column is not None:
+            if not self.rows_buffered:
+                self.buffered_marks[0] = row[self.mark_column]
+            self.buffered_marks[1] = row[self.mark_column]
+        self.rows_buffered += 1
+        if self.first_buffered_at is None:
+            self.first_buffered_at = self.clock()
+        if self.rows_buffered >= self.policy.max_rows or self.bytes_buffered >= self.policy.max_bytes:
+            self.flush()
+
+    def writerows(self, rows: Iterable[Iterable[Any]]):
+        for row in rows:
+            self.writerow(row)
+
+    def flush_due(self, now: Optional[float] = None) -> bool:
+        """Flush if the oldest buffered row has waited longer than max_interval"""
+        if self.first_buffered_at is None:
+            return False
+        now = self.clock() if now is None else now
+        with self.lock:
+            if self.first_buffered_at is not None and now - self.first_buffered_at >= self.policy.max_interval:
+                self.flush()
+                return True
+        return False
+
+    def flush(self, sync: bool = False):
+        """Write buffered rows to the file; fsync when forced or when the interval has elapsed"""
+        with self.lock:
+            if self.rows_buffered:
+                # Take the rows out of the buffer before writing them: a signal-handler flush that
+                # interrupts this one on the same thread (the lock is re-entrant) finds nothing to repeat
+                data, rows, (first_mark, last_mark) = self.buffer.getvalue(), self.rows_buffered, self.buffered_marks
+                self.buffer = io.StringIO()
+                self.writer = csv.writer(self.buffer)
+                self.rows_buffered = 0
+                self.buffered_marks = [None, None]
+                self.first_buffered_at = None
+                self.file_handle.write(data)
+                self.file_handle.flush()
+                self.rows_on_disk += rows
+                self.bytes_on_disk += len(data)
+                if self.first_mark_on_disk is None:
+                    self.first_mark_on_disk = first_mark
+                self.last_mark_on_disk = last_mark
+
+            fsync_interval = self.policy.fsync_interval
+            now = self.clock()
+            if self.rows_synced < self.rows_on_disk and (
+                    sync or (fsync_interval is not None and now - self.last_sync >= fsync_interval)):
+                os.fsync(self.file_handle.fileno())
+                self.rows_synced = self.rows_on_disk
+                self.last_sync = now
+
+    def close(self):
+        """Flush remaining rows (durably) and close the file"""
+        with self.lock:
+            if not self.file_handle.closed:
+                self.flush(sync=True)
+                self.file_handle.close()
+
+def flush_due(writers: Dict[str, BufferedCSVWriter]) -> int:
+    """Run the time-based flush check on every writer, returns how many flushed"""
+    now = time.monotonic()
+    return sum(1 for writer in writers.values()
+               if hasattr(writer, "flush_due") and writer.flush_due(now))
+
+def flush_all(writers: Dict[str, BufferedCSVWriter], sync: bool = False):
+    """Flush every writer regardless of policy"""
+    for writer in writers.values():
+        if hasattr(writer, "flush_due") and not writer.closed:
+            writer.flush(sync=sync)
+
+def buffer_totals(writers: Dict[str, BufferedCSVWriter]) -> Dict[str, int]:
+    """Rows and bytes still in memory vs already written across all writers"""
+    totals = {"rows_buffered": 0, "bytes_buffered": 0, "rows_on_disk": 0, "rows_synced": 0, "bytes_on_disk": 0}
+    for writer in writers.values():
+        if hasattr(writer, "flush_due"):
+            totals["rows_buffered"] += writer.rows_buffered
+            totals["bytes_buffered"] += writer.bytes_buffered
+            totals["rows_on_disk"] += writer.rows_on_disk
+            totals["rows_synced"] += writer.rows_synced
+            totals["bytes_on_disk"] += writer.bytes_on_disk
+    return totals
+
+def install_signal_flush(writers: Dict[str, BufferedCSVWriter]):
+    """Flush every writer on SIGINT/SIGTERM, then stop through the usual KeyboardInterrupt path"""
+    def handle_signal(signum, frame):
+        flush_all(writers, sync=True)
+        raise KeyboardInterrupt
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            signal.signal(sig, handle_signal)
+        except ValueError:
+            # Signal handlers can only be installed from the main thread
+            pass
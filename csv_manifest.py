@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Per-tag sidecar manifest for the wide CSV training data
+manifest.json keeps row count, byte size, first/last position timestamp and
+a header hash for every <tag>.csv, so startup, cap checks and reports do not
+have to count lines. Files whose first column is "seq" (the sparse format)
+get their first/last seq instead of timestamps. An entry is trusted only while its byte size matches
+the file; otherwise the file is rescanned.
+
+Repair: python csv_manifest.py <output_dir>
+"""
+
+from typing import Dict, Any, Optional, Sequence, Tuple
+import csv, hashlib, json, os, sys, threading
+
+MANIFEST_FILE = "manifest.json"
+
+# Column tracked per file -> the entry keys of its first and last value
+MARK_KEYS = {"position_timestamp": ("first_timestamp", "last_timestamp"), "seq": ("first_seq", "last_seq")}
+
+def mark_column(header: Sequence[str]) -> str:
+    """The column whose first/last value an entry keeps: seq for sparse files, else position_timestamp"""
+    return "seq" if header and header[0] == "seq" else "position_timestamp"
+
+def header_hash(header: Sequence[str]) -> str:
+    """Short hash of a CSV header (column names joined by commas)"""
+    return hashlib.sha1(",".join(header).encode("utf-8")).hexdigest()[:16]
+
+def scan_csv(filename: str) -> Dict[str, Any]:
+    """Build a manifest entry by reading the whole file once"""
+    with open(filename, 'r', newline='') as f:
+        header_line = f.readline()
+        header = next(csv.reader([header_line])) if header_line else []
+        marked = mark_column(header)
+        first_key, last_key = MARK_KEYS[marked]
+        entry = {"rows": 0, "bytes": os.path.getsize(filename), "header_hash": header_hash(header) if header else "",
+                 first_key: None, last_key: None}
+        first_line = last_line = None
+        rows = 0
+        for line in f:
+            if first_line is None:
+                first_line = line
+            last_line = line
+            rows += 1
+    entry["rows"] = rows
+
+    if rows and marked in header:
+        column = header.index(marked)
+        for key, line in ((first_key, first_line), (last_key, last_line)):
+            try:
+                entry[key] = int(next(csv.reader([line]))[column])
+            except (ValueError, IndexError):
+                pass
+    return entry
+
+class CSVManifest:
+    """Row/byte bookkeeping for the per-tag CSV files of one output directory"""
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.base_rows: Dict[str, int] = {}  # Rows in the file when this session opened it
+        self.saved_rows: Dict[str, int] = {}  # writer.rows_on_disk when the entry's timestamps were last taken
+        self.mark_keys: Dict[str, Tuple[str, str]] = {}  # Entry keys the writer's flushed marks go to
+        self.lock = threading.Lock()
+
+    def load(self) -> "CSVManifest":
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"⚠️ Could not read {self.path}, rebuilding entries: {e}")
+                self.entries = {}
+        return self
+
+    def row_count(self, tag_mac: str, filename: str) -> Optional[int]:
+        """Rows recorded for a tag if the entry still matches the file size, else None"""
+        entry = self.entries.get(tag_mac)
+        if entry is None or not os.path.exists(filename) or os.path.getsize(filename) != entry["bytes"]:
+            return None
+        return entry["rows"]
+
+    def seed(self, tag_mac: str, filename: str, header: Sequence[str]) -> int:
+        """Row count of an opened tag file, rescanning only when the entry is missing or stale"""
+        rows = self.row_count(tag_mac, filename)
+        if rows is None:
+            if tag_mac in self.entries:
+                print(f"🔧 Manifest entry for {tag_mac} is out of sync, rescanning {os.path.basename(filename)}")
+            self.entries[tag_mac] = scan_csv(filename)
+            rows = self.entries[tag_mac]["rows"]
+        if self.entries[tag_mac]["header_hash"] != header_hash(header):
+            print(f"⚠️ {os.path.basename(filename)} was written with a different header, appended rows will not match it")
+        self.base_rows[tag_mac] = rows
+        self.saved_rows[tag_mac] = 0
+        self.mark_keys[tag_mac] = MARK_KEYS[mark_column(header)]
+        return rows
+
+    def rebase(self, tag_mac: str, rows: int, writer: Any, first_timestamp: Optional[int], last_timestamp: Optional[int]):
+        """Reset a tag's entry after its file was rewritten (e.g. compacted) to `rows` data rows"""
+        with self.lock:
+            self.base_rows[tag_mac] = rows - writer.rows_on_disk
+            self.saved_rows[tag_mac] = writer.rows_on_disk
+            entry = self.entries[tag_mac]
+            entry["rows"] = rows
+            entry["bytes"] = os.fstat(writer.file_handle.fileno()).st_size
+            entry["first_timestamp"] = first_timestamp
+            entry["last_timestamp"] = last_timestamp
+
+    def save(self, writers: Dict[str, Any]):
+        """Snapshot what the writers have flushed and atomically rewrite manifest.json
+
+        Timestamps come from the writers' flushed marks (mark_column set to
+        position_timestamp), so the entry only ever describes rows on disk.
+        """
+        with self.lock:
+            for tag_mac, base_rows in self.base_rows.items():
+                writer = writers.get(tag_mac)
+                if writer is None or writer.closed:
+                    continue
+                with writer.lock:
+                    entry = self.entries[tag_mac]
+                    entry["rows"] = base_rows + writer.rows_on_disk
+                    entry["bytes"] = os.fstat(writer.file_handle.fileno()).st_size
+                    if writer.rows_on_disk > self.saved_rows.get(tag_mac, 0) and writer.last_mark_on_disk is not None:
+                        first_key, last_key = self.mark_keys.get(tag_mac, MARK_KEYS["position_timestamp"])
+                        if entry.get(first_key) is None:
+                            entry[first_key] = writer.first_mark_on_disk
+                        entry[last_key] = writer.last_mark_on_disk
+                    self.saved_rows[tag_mac] = writer.rows_on_disk
+
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+def rebuild_manifest(output_dir: str) -> CSVManifest:
+    """Rescan every <tag>.csv in output_dir and rewrite the manifest"""
+    manifest = CSVManifest(output_dir)
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.endswith(".csv"):
+            manifest.entries[filename[:-4]] = scan_csv(os.path.join(output_dir, filename))
+    manifest.save({})
+    return manifest
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python csv_manifest.py <output_dir>")
+        sys.exit(1)
+    rebuilt = rebuild_manifest(sys.argv[1])
+    total_rows = sum(entry["rows"] for entry in rebuilt.entries.values())
+    print(f"✅ Rebuilt {rebuilt.path}: {len(rebuilt.entries)} files, {total_rows} data rows")
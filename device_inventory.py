@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Device inventory from the S00695 device list exports
+Loads the anchor and tag lists once, normalises MACs to lowercase hex and
+caches the compiled index in device_inventory.json (rebuilt when a source
+CSV changes). Live traffic is reconciled against it: anchors heard but not
+listed, and listed anchors never heard.
+"""
+
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+import csv, json, os, threading
+
+ANCHOR_LIST_FILE = "S00695 - devices list - BLE Anchors AC dual (1).csv"
+TAG_LIST_FILE = "S00695 - devices list - M4 Tags (1).csv"
+INVENTORY_CACHE_FILE = "device_inventory.json"
+
+def normalize_mac(mac: str) -> str:
+    """'FB:D0:43:0B:8B:21' / 'FBD0430B8B21' -> 'fbd0430b8b21'"""
+    return mac.strip().replace(":", "").replace("-", "").lower()
+
+def source_signature(path: str) -> Optional[List[int]]:
+    """Size and mtime of a source file, used to invalidate the cache"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def read_device_list(path: str) -> Dict[str, Dict[str, str]]:
+    """MAC -> remaining columns of one device list export"""
+    devices = {}
+    if not os.path.exists(path):
+        print(f"⚠️ Device list not found: {path}")
+        return devices
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f):
+            mac = normalize_mac(record.pop("macAddress", "") or "")
+            if len(mac) == 12:
+                devices[mac] = {key: value for key, value in record.items() if key}
+    return devices
+
+def header_anchor_macs(output_dir: str) -> Optional[Set[str]]:
+    """Anchor MACs in the header of the first non-empty CSV in output_dir, None if there is none
+
+    Appended rows must match the columns of the files already on disk, so an
+    existing header takes precedence over the inventory.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    for filename in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, filename)
+        if filename.endswith(".csv") and os.path.getsize(path) > 0:
+            with open(path, 'r') as f:
+                header = f.readline().strip().split(',')
+            return {col[:-5] for col in header if col.endswith('_rssi') and len(col) == 17}
+    return None
+
+class DeviceInventory:
+    """Anchor and tag universe plus the devices actually heard this session"""
+
+    def __init__(self, anchors: Dict[str, Dict[str, str]], tags: Dict[str, Dict[str, str]]):
+        self.anchors = anchors
+        self.tags = tags
+        self.heard_anchors: Set[str] = set()
+        self.heard_tags: Set[str] = set()
+        self.lock = threading.Lock()
+
+    @property
+    def anchor_macs(self) -> Set[str]:
+        return set(self.anchors)
+
+    def note_heard(self, tag_mac: str, anchor_macs: Iterable[str]):
+        """Record the tag and anchors of one live message"""
+        with self.lock:
+            self.heard_tags.add(tag_mac)
+            self.heard_anchors.update(anchor_macs)
+
+    def reconcile(self) -> Tuple[List[str], List[str]]:
+        """(heard anchors missing from the inventory, inventory anchors never heard)"""
+        with self.lock:
+            heard = set(self.heard_anchors)
+        return sorted(heard - self.anchors.keys()), sorted(self.anchors.keys() - heard)
+
+    def print_reconciliation(self):
+        unknown, silent = self.reconcile()
+        print(f"Inventory: {len(self.anchors)} anchors, {len(self.tags)} tags | "
+              f"Heard: {len(self.heard_anchors)} anchors, {len(self.heard_tags)} tags")
+        if unknown:
+            print(f"   ⚠️ {len(unknown)} live anchors not in the inventory: {', '.join(unknown[:5])}{' ...' if len(unknown) > 5 else ''}")
+        if silent:
+            print(f"   🔇 {len(silent)} inventory anchors never heard: {', '.join(silent[:5])}{' ...' if len(silent) > 5 else ''}")
+        unknown_tags = len(self.heard_tags - self.tags.keys())
+        if unknown_tags:
+            print(f"   ⚠️ {unknown_tags} live tags not in the inventory")
+
+def load_inventory(anchor_list: str = ANCHOR_LIST_FILE, tag_list: str = TAG_LIST_FILE,
+                   cache_path: Optional[str] = INVENTORY_CACHE_FILE) -> DeviceInventory:
+    """Load the compiled index, re-reading the device lists only if they changed"""
+    sources = {"anchors": source_signature(anchor_list), "tags": source_signature(tag_list)}
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get("sources") == sources:
+                return DeviceInventory(cached["anchors"], cached["tags"])
+        except (ValueError, OSError, KeyError) as e:
+            print(f"⚠️ Ignoring unreadable inventory cache {cache_path}: {e}")
+
+    inventory = DeviceInventory(read_device_list(anchor_list), read_device_list(tag_list))
+    print(f"📇 Device inventory: {len(inventory.anchors)} anchors, {len(inventory.tags)} tags")
+    if cache_path:
+        temp_path = cache_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"sources": sources, "anchors": inventory.anchors, "tags": inventory.tags}, f, indent=1, sort_keys=True)
+        os.replace(temp_path, cache_path)
+    return inventory
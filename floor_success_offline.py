@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Offline floor success evaluation over recorded datasets
+Every row the generators wrote already carries map_id and true_map_id, so
+floor accuracy can be measured from the per-tag files in seconds instead of
+waiting for TOTAL_RUNS live runs. Only the needed columns are read; the rows
+of all tags are merged into one time-ordered stream and scored with NumPy,
+either all of them or emulating floor_success_rate's sampling: the rows are
+replayed through the live RunScheduler at their recorded timestamps, with the
+live pipeline depth and run deadline unless --depth/--deadline say otherwise.
+One run at a time without a deadline (the first message of each tag per run,
+a run ending once EXPECTED_UNIQUE_TAGS_PER_RUN different tags were heard) is
+computed with NumPy instead. The report is floor_success_rate's own.
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import argparse, glob, os, time
+import numpy as np
+import pandas as pd
+
+import floor_success_rate
+from run_scheduler import RunScheduler
+from tag_registry import TAGS, DOWNSTAIRS, MEZZANINE
+
+COLUMNS = ["map_id", "position_timestamp", "tag_x", "tag_y", "true_map_id"]
+
+def tag_files(data_dir: str, data_format: str = "csv") -> List[Tuple[int, str]]:
+    """(tag index, path) of every registered tag with recorded data; other files are ignored"""
+    if data_format == "parquet":
+        paths = [path for path in glob.glob(os.path.join(data_dir, "*")) if os.path.isdir(path)]
+    else:
+        paths = glob.glob(os.path.join(data_dir, "*.csv"))
+    files = []
+    for path in sorted(paths):
+        tag_index = TAGS.index(os.path.basename(path).replace(".csv", ""))
+        if tag_index is not None:
+            files.append((tag_index, path))
+    return files
+
+def read_columns(path: str, data_format: str = "csv") -> pd.DataFrame:
+    if data_format == "parquet":
+        from parquet_sink import read_tag_columns
+        return read_tag_columns(path, COLUMNS)
+    return pd.read_csv(path, usecols=COLUMNS, dtype={"map_id": str, "true_map_id": str})
+
+def load_stream(data_dir: str, data_format: str = "csv") -> Dict[str, np.ndarray]:
+    """All recorded rows ordered by position_timestamp: tag index, timestamp, success, x, y"""
+    frames = []
+    for tag_index, path in tag_files(data_dir, data_format):
+        frame = read_columns(path, data_format)
+        frame["tag"] = tag_index
+        frames.append(frame)
+    if not frames:
+        return {"tag": np.empty(0, np.int64), "timestamp": np.empty(0, np.int64), "success": np.empty(0, bool),
+                "x": np.empty(0), "y": np.empty(0)}
+    data = pd.concat(frames, ignore_index=True)
+    order = np.argsort(data["position_timestamp"].to_numpy(), kind="stable")
+    return {
+        "tag": data["tag"].to_numpy(np.int64)[order],
+        "timestamp": data["position_timestamp"].to_numpy(np.int64)[order],
+        "success": (data["map_id"].to_numpy() == data["true_map_id"].to_numpy())[order],
+        "x": data["tag_x"].to_numpy(np.float64)[order],
+        "y": data["tag_y"].to_numpy(np.float64)[order],
+    }
+
+def sample_runs(tags: np.ndarray, total_runs: int, tags_per_run: int) -> Tuple[np.ndarray, int]:
+    """Rows the live evaluation would score, and the number of completed runs
+
+    Per run, the first row of every tag at or after the run start is found
+    with one searchsorted over the rows grouped by tag; the run ends at the
+    tags_per_run-th of those. A final incomplete run is scored like an
+    interrupted live run.
+    """
+    n = len(tags)
+    by_tag = np.argsort(tags, kind="stable")  # Rows grouped by tag, stream order within each tag
+    keys = tags[by_tag] * n + by_tag
+    tag_ids = np.unique(tags)
+    selected = []
+    start = runs = 0
+    while runs < total_runs and start < n:
+        at = np.searchsorted(keys, tag_ids * n + start)
+        candidate = keys[np.minimum(at, n - 1)]
+        heard = (at < n) & (candidate // n == tag_ids)
+        first = np.where(heard, candidate - tag_ids * n, n)
+        if np.count_nonzero(heard) < tags_per_run:
+            selected.append(first[heard])
+            break
+        end = np.partition(first, tags_per_run - 1)[tags_per_run - 1]
+        selected.append(first[first <= end])
+        runs += 1
+        start = end + 1
+    rows = np.sort(np.concatenate(selected)) if selected else np.empty(0, np.int64)
+    return rows, runs
+
+def schedule_runs(tags: np.ndarray, timestamps: np.ndarray, total_runs: int, tags_per_run: int,
+                  depth: int = 1, deadline: Optional[float] = None) -> Tuple[np.ndarray, RunScheduler]:
+    """Rows the live run scheduler would sample, replaying the stream at its recorded timestamps (ms)
+    
+    Due runs are closed before each row (the live loop's periodic check) and
+    after it (the check following each message), all with now= the row's time.
+    """
+    scheduler = RunScheduler(TAGS, total_runs, tags_per_run, deadline, depth)
+    selected = []
+    for row, (tag, timestamp) in enumerate(zip(tags.tolist(), timestamps.tolist())):
+        now = timestamp / 1000
+        scheduler.close_due(now)
+        if scheduler.finished:
+            break
+        if scheduler.assign(tag, now) is not None:
+            selected.append(row)
+        scheduler.close_due(now)
+    return np.asarray(selected, np.int64), scheduler
+
+def evaluate(stream: Dict[str, np.ndarray], total_runs: int = floor_success_rate.TOTAL_RUNS,
+             tags_per_run: int = floor_success_rate.EXPECTED_UNIQUE_TAGS_PER_RUN,
+             every_row: bool = False, depth: int = floor_success_rate.RUN_PIPELINE_DEPTH,
+             deadline: Optional[float] = floor_success_rate.RUN_DEADLINE) -> Dict[str, Any]:
+    """Success/failure counts overall, per floor and per tag (indexed like TAGS)"""
+    scheduler = None
+    if every_row:
+        rows, runs = np.arange(len(stream["tag"])), 0
+    elif depth <= 1 and deadline is None:
+        rows, runs = sample_runs(stream["tag"], total_runs, tags_per_run)
+    else:
+        rows, scheduler = schedule_runs(stream["tag"], stream["timestamp"], total_runs, tags_per_run, depth, deadline)
+        runs = scheduler.closed
+    tags = stream["tag"][rows]
+    success = stream["success"][rows]
+    floors = np.asarray(TAGS.floors, np.int64)[tags]
+    timestamps = stream["timestamp"][rows]
+    return {
+        "rows": rows,
+        "runs": runs,
+        "success": int(np.count_nonzero(success)),
+        "failure": int(len(rows) - np.count_nonzero(success)),
+        "floor_success": np.bincount(floors[success], minlength=2),
+        "floor_failure": np.bincount(floors[~success], minlength=2),
+        "tag_messages": np.bincount(tags, minlength=len(TAGS)),
+        "tag_failures": np.bincount(tags[~success], minlength=len(TAGS)),
+        "span_seconds": float(timestamps.max() - timestamps.min()) / 1000 if len(rows) else 0.0,
+        "scheduler": scheduler,  # The replayed RunScheduler, None when it was not needed
+    }
+
+def report(stream: Dict[str, np.ndarray], stats: Dict[str, Any]):
+    """Print the result through floor_success_rate.print_final_stats (spatial plot included)"""
+    fsr = floor_success_rate
+    fsr.success_count, fsr.failure_count = stats["success"], stats["failure"]
+    fsr.downstairs_success_count = int(stats["floor_success"][DOWNSTAIRS])
+    fsr.downstairs_failure_count = int(stats["floor_failure"][DOWNSTAIRS])
+    fsr.mezzanine_success_count = int(stats["floor_success"][MEZZANINE])
+    fsr.mezzanine_failure_count = int(stats["floor_failure"][MEZZANINE])
+    fsr.tag_message_counts = stats["tag_messages"].tolist()
+    fsr.failed_tags = stats["tag_failures"].tolist()
+    fsr.current_run = stats["runs"]
+    if stats["scheduler"] is not None:
+        fsr.run_scheduler = stats["scheduler"]  # Its summary and stragglers go into the report
+    fsr.start_time = time.time() - stats["span_seconds"]  # Runtime: the time span the scored rows cover
+
+    rows = stats["rows"]
+    floors = np.asarray(TAGS.floors, np.int64)[stream["tag"][rows]]
+    success = stream["success"][rows]
+    xs, ys = stream["x"][rows], stream["y"][rows]
+    for floor in (DOWNSTAIRS, MEZZANINE):
+        mask = floors == floor
+        fsr.spatial_grids[floor].reset()
+        fsr.spatial_grids[floor].add_many(xs[mask], ys[mask], success[mask])
+    fsr.print_final_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description="Floor success rate from recorded per-tag data")
+    parser.add_argument("data_dir", nargs="?", default="ml_training_data_new")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--all", action="store_true", help="Score every recorded row instead of emulating runs")
+    parser.add_argument("--runs", type=int, default=floor_success_rate.TOTAL_RUNS)
+    parser.add_argument("--tags-per-run", type=int, default=floor_success_rate.EXPECTED_UNIQUE_TAGS_PER_RUN)
+    parser.add_argument("--depth", type=int, default=floor_success_rate.RUN_PIPELINE_DEPTH, help="Runs open at once")
+    parser.add_argument("--deadline", type=float, default=floor_success_rate.RUN_DEADLINE,
+                        help="Seconds a run waits for its quorum (0: no deadline)")
+    args = parser.parse_args()
+    deadline = args.deadline or None
+
+    started = time.monotonic()
+    stream = load_stream(args.data_dir, args.format)
+    loaded = time.monotonic()
+    stats = evaluate(stream, args.runs, args.tags_per_run, every_row=args.all, depth=args.depth, deadline=deadline)
+    mode = "every row" if args.all else (f"first message per tag, {args.runs} runs of {args.tags_per_run} tags, "
+                                         f"{args.depth} open at once, deadline {f'{deadline}s' if deadline else 'none'}")
+    print(f"📂 {args.data_dir}: {len(stream['tag'])} rows loaded in {loaded - started:.2f}s, "
+          f"{len(stats['rows'])} scored ({mode}) in {time.monotonic() - loaded:.2f}s")
+    report(stream, stats)
+
+if __name__ == "__main__":
+    main()
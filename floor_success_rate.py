@@ -1,11 +1,17 @@
 from typing import Dict, Any, Tuple, List
 import logging, paho.mqtt.client as mqtt
-import time, requests, json
+import time, json
 import matplotlib.pyplot as plt
 import numpy as np
 import os
 
-from get_tag_macs import tag_id_to_mac
+from trigger_scheduler import TriggerScheduler
+from position_decoder import json_loads
+from recent_keys import RecentKeyIndex, position_key
+from tag_registry import TAGS, DOWNSTAIRS, MEZZANINE, FLOOR_NAMES
+from quality_monitor import QualityMonitor
+from spatial_grid import SpatialGrid
+from run_scheduler import RunScheduler
 
 """
 Anchor lists:
@@ -24,15 +30,9 @@ headers = {
     "accept": "application/json",
     "Content-Type": "application/json"
 }
+API_TRIGGER_INTERVAL = 100.0  # Seconds between broadcast triggers (sent from a background thread)
 #missing tag ids: ('47621', '19466', '1758')
-TAG_MAC_LIST: List[str] = [
-    'f8c6e10eb94d', 'e80511ee6f95', 'ebc3d8c27268', 'ea130331a7d6', 'e5618db03315', 'f53d908ae87e', 'faebae16f304', 'dcb814adee27', 'ee1ae8c0199b', 'e71ebc086c12', 'dc6fd1014985', 
-    'e0187539099c', 'ed3dc76b5057', 'cfcba5a4aa8c', 'd2433d346da0', 'c3fdcfc7cde7', 'fbde6b71de2c', 'eed4934cb925', 'd55a17359cec', 'dd35e8065e41', 'de8a7eb407c5', 'c694e5297d8c', 
-    'f7fb6d248542', 'f1465d4b34ad', 'c5d89d98d531', 'e3c858bb535e', 'e12a0889fc9d', 'f17508753dd2', 'eacbbb80d2ae', 'd908a64ff5c8', 'e0179d3286a1', 'ca70faad5185', 'eaf519e486b7', 
-    'f260a59af3be', 'd1162b91f43c', 'c0c28a5250d1', 'e45428cd811f', 'f9cf5a96910d', 'e1221fc96df8', 'db87600e1088', 'ea0efa76b1d7', 'e75675d44213', 'cfa33b8f966f', 'e6a1121bd9ba', 
-    'c61444ecfa21', 'cbafa76ff612', 'eabf49388a88', 'e6dee509ceb7', 'd31e40a36148', 'fe916ad112d4', 'dbd8f214e90c', 'f8e68ad462b8', 'ced95ba5af64', 'c07f2aebbfb2', 'dbdfe63c5bfe', 
-    'eb7dd4251a0b', 'e9ee05861174', 'c48718b206de', 'dfe232164c0a', 'ccd6b409ba05'
-]
+TAG_MAC_LIST: List[str] = list(TAGS.macs)  # Every registered tag (see tag_registry.py)
 payload: Dict[str, Any] = {
     "devices": TAG_MAC_LIST,
     "adv_type": "uwb",
@@ -49,222 +49,20 @@ payload: Dict[str, Any] = {
     "timeout": 90
 }
 
-tag_id_to_mac: Dict[str, str] = {
-    '28064': 'd2433d346da0', '21342': 'e3c858bb535e', '53934': 'eacbbb80d2ae', '13485': 'f1465d4b34ad', '15826': 'f17508753dd2', '47397': 'eed4934cb925', 
-    '34114': 'f7fb6d248542', '20869': 'ca70faad5185', '54577': 'c5d89d98d531', '32140': 'c694e5297d8c', '40172': 'd55a17359cec', '62920': 'd908a64ff5c8', '64669': 'e12a0889fc9d', 
-    '24129': 'dd35e8065e41', '34465': 'e0179d3286a1', '34487': 'eaf519e486b7', '20689': 'c0c28a5250d1', '35464': 'eabf49388a88', '55738': 'e6a1121bd9ba', '37133': 'f9cf5a96910d', 
-    '38511': 'cfa33b8f966f', '49074': 'c07f2aebbfb2', '62524': 'd1162b91f43c', '28152': 'e1221fc96df8', '23550': 'dbdfe63c5bfe', '24904': 'd31e40a36148', '25272': 'f8e68ad462b8', 
-    '62994': 'cbafa76ff612', '4820': 'fe916ad112d4', '44900': 'ced95ba5af64', '62398': 'f260a59af3be', '45527': 'ea0efa76b1d7', '52919': 'e6dee509ceb7', '64033': 'c61444ecfa21', 
-    '33055': 'e45428cd811f', '43660': 'cfcba5a4aa8c', '20567': 'ed3dc76b5057', '1989': 'de8a7eb407c5', '52711': 'c3fdcfc7cde7', '56876': 'fbde6b71de2c', '59660': 'dbd8f214e90c', 
-    '4232': 'db87600e1088', '16915': 'e75675d44213', '1758': 'c48718b206de', '42966': 'ea130331a7d6', '28565': 'e80511ee6f95', '13077': 'e5618db03315', '59518': 'f53d908ae87e', 
-    '29288': 'ebc3d8c27268', '19466': 'dfe232164c0a', '4468': 'e9ee05861174', '60967': 'dcb814adee27', '62212': 'faebae16f304', '6555': 'ee1ae8c0199b', '18821': 'dc6fd1014985', 
-    '2460': 'e0187539099c', '6667': 'eb7dd4251a0b', '27666': 'e71ebc086c12', '47437': 'f8c6e10eb94d', '47621': 'ccd6b409ba05'
-}
-#success rate evaluater info:
-TAG_POSITION_DICT: Dict[str, str] = {
-    # Downstairs tags
-    "62398": "682c66de8cde618ce1270230",
-    "33055": "682c66de8cde618ce1270230",
-    "34487": "682c66de8cde618ce1270230",
-    "27666": "682c66de8cde618ce1270230",
-    "4232": "682c66de8cde618ce1270230",
-    "16915": "682c66de8cde618ce1270230",
-    "45527": "682c66de8cde618ce1270230",
-    "21342": "682c66de8cde618ce1270230",
-    "37133": "682c66de8cde618ce1270230",
-    "4468": "682c66de8cde618ce1270230",
-    "54577": "682c66de8cde618ce1270230",
-    "15826": "682c66de8cde618ce1270230",
-    "47621": "682c66de8cde618ce1270230",
-    "43660": "682c66de8cde618ce1270230",
-    "19466": "682c66de8cde618ce1270230",
-    "42966": "682c66de8cde618ce1270230",
-    "4820": "682c66de8cde618ce1270230",
-    "62994": "682c66de8cde618ce1270230",
-    "24904": "682c66de8cde618ce1270230",
-    "20567": "682c66de8cde618ce1270230",
-    "34114": "682c66de8cde618ce1270230",
-    "13077": "682c66de8cde618ce1270230",
-    "1758": "682c66de8cde618ce1270230",
-    "44900": "682c66de8cde618ce1270230",
-    "28565": "682c66de8cde618ce1270230",
-    "25272": "682c66de8cde618ce1270230",
-    "49074": "682c66de8cde618ce1270230",
-    "18821": "682c66de8cde618ce1270230",
-    "23550": "682c66de8cde618ce1270230",
-    "59518": "682c66de8cde618ce1270230",
-    
-    # Mezzanine tags
-    "53934": "682c66f08cde618ce127025e",
-    "40172": "682c66f08cde618ce127025e",
-    "52711": "682c66f08cde618ce127025e",
-    "24129": "682c66f08cde618ce127025e",
-    "13485": "682c66f08cde618ce127025e",
-    "28064": "682c66f08cde618ce127025e",
-    "1989": "682c66f08cde618ce127025e",
-    "56876": "682c66f08cde618ce127025e",
-    "47397": "682c66f08cde618ce127025e",
-    "32140": "682c66f08cde618ce127025e",
-    "60967": "682c66f08cde618ce127025e",
-    "6555": "682c66f08cde618ce127025e",
-    "64669": "682c66f08cde618ce127025e",
-    "20869": "682c66f08cde618ce127025e",
-    "28152": "682c66f08cde618ce127025e",
-    "35464": "682c66f08cde618ce127025e",
-    "62212": "682c66f08cde618ce127025e",
-    "55738": "682c66f08cde618ce127025e",
-    "29288": "682c66f08cde618ce127025e",
-    "20689": "682c66f08cde618ce127025e",
-    "6667": "682c66f08cde618ce127025e",
-    "59660": "682c66f08cde618ce127025e",
-    "47437": "682c66f08cde618ce127025e",
-    "64033": "682c66f08cde618ce127025e",
-    "52919": "682c66f08cde618ce127025e",
-    "2460": "682c66f08cde618ce127025e",
-    "38511": "682c66f08cde618ce127025e",
-    "62524": "682c66f08cde618ce127025e",
-    "62920": "682c66f08cde618ce127025e",
-    "34465": "682c66f08cde618ce127025e"
-}
-
-# Dictionary mapping MAC addresses to map IDs
-TAG_MAC_TO_MAP_ID: Dict[str, str] = {
-    # Downstairs tags (map_id: 682c66de8cde618ce1270230)
-    'f260a59af3be': '682c66de8cde618ce1270230',  # 62398
-    'e45428cd811f': '682c66de8cde618ce1270230',  # 33055
-    'eaf519e486b7': '682c66de8cde618ce1270230',  # 34487
-    'e71ebc086c12': '682c66de8cde618ce1270230',  # 27666
-    'db87600e1088': '682c66de8cde618ce1270230',  # 4232
-    'e75675d44213': '682c66de8cde618ce1270230',  # 16915
-    'ea0efa76b1d7': '682c66de8cde618ce1270230',  # 45527
-    'e3c858bb535e': '682c66de8cde618ce1270230',  # 21342
-    'f9cf5a96910d': '682c66de8cde618ce1270230',  # 37133
-    'e9ee05861174': '682c66de8cde618ce1270230',  # 4468
-    'c5d89d98d531': '682c66de8cde618ce1270230',  # 54577
-    'f17508753dd2': '682c66de8cde618ce1270230',  # 15826
-    'ccd6b409ba05': '682c66de8cde618ce1270230',  # 47621
-    'cfcba5a4aa8c': '682c66de8cde618ce1270230',  # 43660
-    'dfe232164c0a': '682c66de8cde618ce1270230',  # 19466
-    'ea130331a7d6': '682c66de8cde618ce1270230',  # 42966
-    'fe916ad112d4': '682c66de8cde618ce1270230',  # 4820
-    'cbafa76ff612': '682c66de8cde618ce1270230',  # 62994
-    'd31e40a36148': '682c66de8cde618ce1270230',  # 24904
-    'ed3dc76b5057': '682c66de8cde618ce1270230',  # 20567
-    'f7fb6d248542': '682c66de8cde618ce1270230',  # 34114
-    'e5618db03315': '682c66de8cde618ce1270230',  # 13077
-    'c48718b206de': '682c66de8cde618ce1270230',  # 1758
-    'ced95ba5af64': '682c66de8cde618ce1270230',  # 44900
-    'e80511ee6f95': '682c66de8cde618ce1270230',  # 28565
-    'f8e68ad462b8': '682c66de8cde618ce1270230',  # 25272
-    'c07f2aebbfb2': '682c66de8cde618ce1270230',  # 49074
-    'dc6fd1014985': '682c66de8cde618ce1270230',  # 18821
-    'dbdfe63c5bfe': '682c66de8cde618ce1270230',  # 23550
-    'f53d908ae87e': '682c66de8cde618ce1270230',  # 59518
-    
-    # Mezzanine tags (map_id: 682c66f08cde618ce127025e)
-    'eacbbb80d2ae': '682c66f08cde618ce127025e',  # 53934
-    'd55a17359cec': '682c66f08cde618ce127025e',  # 40172
-    'c3fdcfc7cde7': '682c66f08cde618ce127025e',  # 52711
-    'dd35e8065e41': '682c66f08cde618ce127025e',  # 24129
-    'f1465d4b34ad': '682c66f08cde618ce127025e',  # 13485
-    'd2433d346da0': '682c66f08cde618ce127025e',  # 28064
-    'de8a7eb407c5': '682c66f08cde618ce127025e',  # 1989
-    'fbde6b71de2c': '682c66f08cde618ce127025e',  # 56876
-    'eed4934cb925': '682c66f08cde618ce127025e',  # 47397
-    'c694e5297d8c': '682c66f08cde618ce127025e',  # 32140
-    'dcb814adee27': '682c66f08cde618ce127025e',  # 60967
-    'ee1ae8c0199b': '682c66f08cde618ce127025e',  # 6555
-    'e12a0889fc9d': '682c66f08cde618ce127025e',  # 64669
-    'ca70faad5185': '682c66f08cde618ce127025e',  # 20869
-    'e1221fc96df8': '682c66f08cde618ce127025e',  # 28152
-    'eabf49388a88': '682c66f08cde618ce127025e',  # 35464
-    'faebae16f304': '682c66f08cde618ce127025e',  # 62212
-    'e6a1121bd9ba': '682c66f08cde618ce127025e',  # 55738
-    'ebc3d8c27268': '682c66f08cde618ce127025e',  # 29288
-    'c0c28a5250d1': '682c66f08cde618ce127025e',  # 20689
-    'eb7dd4251a0b': '682c66f08cde618ce127025e',  # 6667
-    'dbd8f214e90c': '682c66f08cde618ce127025e',  # 59660
-    'f8c6e10eb94d': '682c66f08cde618ce127025e',  # 47437
-    'c61444ecfa21': '682c66f08cde618ce127025e',  # 64033
-    'e6dee509ceb7': '682c66f08cde618ce127025e',  # 52919
-    'e0187539099c': '682c66f08cde618ce127025e',  # 2460
-    'cfa33b8f966f': '682c66f08cde618ce127025e',  # 38511
-    'd1162b91f43c': '682c66f08cde618ce127025e',  # 62524
-    'd908a64ff5c8': '682c66f08cde618ce127025e',  # 62920
-    'e0179d3286a1': '682c66f08cde618ce127025e'   # 34465
-}
-
-# Tag MAC to floor level mapping (0 = downstairs, 1 = upstairs/mezzanine)
-TAG_MAC_TO_FLOOR: Dict[str, int] = {
-    # Downstairs tags (floor = 0)
-    'f260a59af3be': 0,  # 62398
-    'e45428cd811f': 0,  # 33055
-    'eaf519e486b7': 0,  # 34487
-    'e71ebc086c12': 0,  # 27666
-    'db87600e1088': 0,  # 4232
-    'e75675d44213': 0,  # 16915
-    'ea0efa76b1d7': 0,  # 45527
-    'e3c858bb535e': 0,  # 21342
-    'f9cf5a96910d': 0,  # 37133
-    'e9ee05861174': 0,  # 4468
-    'c5d89d98d531': 0,  # 54577
-    'f17508753dd2': 0,  # 15826
-    'ccd6b409ba05': 0,  # 47621
-    'cfcba5a4aa8c': 0,  # 43660
-    'dfe232164c0a': 0,  # 19466
-    'ea130331a7d6': 0,  # 42966
-    'fe916ad112d4': 0,  # 4820
-    'cbafa76ff612': 0,  # 62994
-    'd31e40a36148': 0,  # 24904
-    'ed3dc76b5057': 0,  # 20567
-    'f7fb6d248542': 0,  # 34114
-    'e5618db03315': 0,  # 13077
-    'c48718b206de': 0,  # 1758
-    'ced95ba5af64': 0,  # 44900
-    'e80511ee6f95': 0,  # 28565
-    'f8e68ad462b8': 0,  # 25272
-    'c07f2aebbfb2': 0,  # 49074
-    'dc6fd1014985': 0,  # 18821
-    'dbdfe63c5bfe': 0,  # 23550
-    'f53d908ae87e': 0,  # 59518
-    
-    # Mezzanine/upstairs tags (floor = 1)
-    'eacbbb80d2ae': 1,  # 53934
-    'd55a17359cec': 1,  # 40172
-    'c3fdcfc7cde7': 1,  # 52711
-    'dd35e8065e41': 1,  # 24129
-    'f1465d4b34ad': 1,  # 13485
-    'd2433d346da0': 1,  # 28064
-    'de8a7eb407c5': 1,  # 1989
-    'fbde6b71de2c': 1,  # 56876
-    'eed4934cb925': 1,  # 47397
-    'c694e5297d8c': 1,  # 32140
-    'dcb814adee27': 1,  # 60967
-    'ee1ae8c0199b': 1,  # 6555
-    'e12a0889fc9d': 1,  # 64669
-    'ca70faad5185': 1,  # 20869
-    'e1221fc96df8': 1,  # 28152
-    'eabf49388a88': 1,  # 35464
-    'faebae16f304': 1,  # 62212
-    'e6a1121bd9ba': 1,  # 55738
-    'ebc3d8c27268': 1,  # 29288
-    'c0c28a5250d1': 1,  # 20689
-    'eb7dd4251a0b': 1,  # 6667
-    'dbd8f214e90c': 1,  # 59660
-    'f8c6e10eb94d': 1,  # 47437
-    'c61444ecfa21': 1,  # 64033
-    'e6dee509ceb7': 1,  # 52919
-    'e0187539099c': 1,  # 2460
-    'cfa33b8f966f': 1,  # 38511
-    'd1162b91f43c': 1,  # 62524
-    'd908a64ff5c8': 1,  # 62920
-    'e0179d3286a1': 1   # 34465
-}
-
 BROKER_HOST = ""  # MQTT broker address (redacted)
 BROKER_PORT = 0  # MQTT broker port (redacted)
 TOPIC        = "engine/+/positions"           # the same pattern you used in mosquitto_sub
 MAX_MESSAGES_ACCEPTED: int = 1
+DEDUP_CAPACITY = 20000  # Recent (tag MAC, timestamp, map ID) keys remembered to drop repeated deliveries
+DEDUP_WINDOW = 120.0  # Seconds a key is remembered after it was last received
+
+# "runs": score the first message of each tag per run for TOTAL_RUNS runs, "stream": score every message until stopped
+EVALUATION_MODE = "runs"
+QUALITY_WINDOW = 300.0  # Seconds of decisions behind the [QUALITY STATUS] accuracy (see quality_monitor.py)
+QUALITY_BUCKET = 10.0  # Resolution the window slides by
+QUALITY_INTERVAL = 120.0  # Seconds between [QUALITY STATUS] lines
+HEATMAP_CELL_SIZE = 1.0  # Meters per side of a spatial heatmap cell
+HEATMAP_MARGIN = 5.0  # Meters the heatmap extends past the floor outline on every side
 
 # Counters for tracking success/failure
 success_count = 0
@@ -277,45 +75,33 @@ mezzanine_success_count = 0
 mezzanine_failure_count = 0
 
 # Map IDs for reference
-DOWNSTAIRS_MAP_ID = "682c66de8cde618ce1270230"
-MEZZANINE_MAP_ID = "682c66f08cde618ce127025e"
+DOWNSTAIRS_MAP_ID = TAGS.map_ids[DOWNSTAIRS]
+MEZZANINE_MAP_ID = TAGS.map_ids[MEZZANINE]
 
 # Track start time for runtime calculation
 start_time = time.time()
 
-# Dictionary to track message counts for each tag ID
-tag_message_counts: Dict[str, int] = {
-    # Downstairs tags
-    "62398": 0, "33055": 0, "34487": 0, "27666": 0, "4232": 0,
-    "16915": 0, "45527": 0, "21342": 0, "37133": 0, "4468": 0,
-    "54577": 0, "15826": 0, "47621": 0, "43660": 0, "19466": 0,
-    "42966": 0, "4820": 0, "62994": 0, "24904": 0, "20567": 0,
-    "34114": 0, "13077": 0, "1758": 0, "44900": 0, "28565": 0,
-    "25272": 0, "49074": 0, "18821": 0, "23550": 0, "59518": 0,
-    
-    # Mezzanine tags
-    "53934": 0, "40172": 0, "52711": 0, "24129": 0, "13485": 0,
-    "28064": 0, "1989": 0, "56876": 0, "47397": 0, "32140": 0,
-    "60967": 0, "6555": 0, "64669": 0, "20869": 0, "28152": 0,
-    "35464": 0, "62212": 0, "55738": 0, "29288": 0, "20689": 0,
-    "6667": 0, "59660": 0, "47437": 0, "64033": 0, "52919": 0,
-    "2460": 0, "38511": 0, "62524": 0, "62920": 0, "34465": 0
-}
+# Scored messages per tag, indexed like TAGS (tag ID / MAC lookups go through the registry)
+tag_message_counts: List[int] = TAGS.counters()
 
-# Track failed tags and their failure counts
-failed_tags: Dict[str, int] = {}  # tag_id -> failure_count
+# Positions delivered more than once (QoS retries, reconnects, duplicate engines) are only scored once
+recent_positions = RecentKeyIndex(DEDUP_CAPACITY, DEDUP_WINDOW)
 
-# Spatial tracking data structures - separate successful and failed positions
-downstairs_success_positions: List[Tuple[float, float]] = []  # Green positions
-downstairs_fail_positions: List[Tuple[float, float]] = []     # Red positions
-mezzanine_success_positions: List[Tuple[float, float]] = []   # Green positions
-mezzanine_fail_positions: List[Tuple[float, float]] = []      # Red positions
+# Windowed accuracy per floor and per tag, printed every QUALITY_INTERVAL
+quality_monitor = QualityMonitor(TAGS, QUALITY_WINDOW, QUALITY_BUCKET, QUALITY_INTERVAL)
+
+# Track failed tags and their failure counts
+failed_tags: List[int] = TAGS.counters()  # Failures per tag index
 
 # Data collection control variables
 TOTAL_RUNS = 20
-EXPECTED_UNIQUE_TAGS_PER_RUN = 56  # Wait for 56 different tags to publish once each
-current_run = 0
-tags_published_in_current_run = set()  # Track which tags have published in current run
+EXPECTED_UNIQUE_TAGS_PER_RUN = 56  # Quorum: a run closes once 56 different tags published once each
+RUN_DEADLINE = 120.0  # Seconds a run waits for the quorum before closing without its stragglers (None: no limit)
+RUN_PIPELINE_DEPTH = 3  # Runs open at once; a tag already sampled in one run feeds the next (1: one run at a time)
+current_run = 0  # Runs closed
+
+# Which open run each tag's first message goes to (see run_scheduler.py)
+run_scheduler = RunScheduler(TAGS, TOTAL_RUNS, EXPECTED_UNIQUE_TAGS_PER_RUN, RUN_DEADLINE, RUN_PIPELINE_DEPTH)
 
 # Floor plan vertices (from plotter.py)
 verts_floor_1 = [
@@ -329,51 +115,33 @@ verts_floor_1 = [
     [66.6, 45.6, 0.0]
 ]
 
+# Spatial tracking - success/failure counts per heatmap cell, one grid per floor (indexed like FLOOR_NAMES)
+spatial_grids: List[SpatialGrid] = [SpatialGrid.around(verts_floor_1, HEATMAP_CELL_SIZE, HEATMAP_MARGIN)
+                                    for _ in FLOOR_NAMES]
+
 def create_spatial_visualization():
-    """Create spatial distribution visualization of tag positions"""
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
-    
-    # Downstairs plot
-    if downstairs_success_positions:
-        x_coords_success, y_coords_success = zip(*downstairs_success_positions)
-        ax1.scatter(x_coords_success, y_coords_success, c='green', alpha=0.6, s=20, label='Success')
-    if downstairs_fail_positions:
-        x_coords_fail, y_coords_fail = zip(*downstairs_fail_positions)
-        ax1.scatter(x_coords_fail, y_coords_fail, c='red', alpha=0.6, s=20, label='Failure')
+    """Create per-cell failure rate heatmaps of the scored positions"""
+    fig, axes = plt.subplots(1, 2, figsize=(15, 6))
     
-    # Draw floor plan outline for downstairs
+    # Floor plan outline (the mezzanine has the same shape)
     floor_x = [v[0] for v in verts_floor_1]
     floor_y = [v[1] for v in verts_floor_1]
     floor_x.append(floor_x[0])  # Close the polygon
     floor_y.append(floor_y[0])
-    ax1.plot(floor_x, floor_y, 'k-', linewidth=2, label='Floor Plan')
-    ax1.fill(floor_x, floor_y, alpha=0.1, color='gray')
-    
-    ax1.set_xlabel('X Position (meters)')
-    ax1.set_ylabel('Y Position (meters)')
-    ax1.set_title('Floor Success Rate - Downstairs: Spatial Distribution')
-    ax1.legend()
-    ax1.grid(True, alpha=0.3)
-    ax1.invert_yaxis()  # Invert Y-axis to match expected orientation
     
-    # Mezzanine plot
-    if mezzanine_success_positions:
-        x_coords_success, y_coords_success = zip(*mezzanine_success_positions)
-        ax2.scatter(x_coords_success, y_coords_success, c='green', alpha=0.6, s=20, label='Success')
-    if mezzanine_fail_positions:
-        x_coords_fail, y_coords_fail = zip(*mezzanine_fail_positions)
-        ax2.scatter(x_coords_fail, y_coords_fail, c='red', alpha=0.6, s=20, label='Failure')
+    for ax, floor in zip(axes, (DOWNSTAIRS, MEZZANINE)):
+        grid = spatial_grids[floor]
+        image = ax.imshow(grid.failure_rate(), extent=grid.extent(), origin='lower', cmap='RdYlGn_r',
+                          vmin=0.0, vmax=1.0, interpolation='nearest', aspect='equal')
+        ax.plot(floor_x, floor_y, 'k-', linewidth=2, label='Floor Plan')
     
-    # Draw floor plan outline for mezzanine (same shape)
-    ax2.plot(floor_x, floor_y, 'k-', linewidth=2, label='Floor Plan')
-    ax2.fill(floor_x, floor_y, alpha=0.1, color='gray')
-    
-    ax2.set_xlabel('X Position (meters)')
-    ax2.set_ylabel('Y Position (meters)')
-    ax2.set_title('Floor Success Rate - Mezzanine: Spatial Distribution')
-    ax2.legend()
-    ax2.grid(True, alpha=0.3)
-    ax2.invert_yaxis()  # Invert Y-axis to match expected orientation
+        ax.set_xlabel('X Position (meters)')
+        ax.set_ylabel('Y Position (meters)')
+        ax.set_title(f'Floor Success Rate - {FLOOR_NAMES[floor]}: Failure Rate per {grid.cell_size:g} m Cell')
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+        ax.invert_yaxis()  # Invert Y-axis to match expected orientation
+        fig.colorbar(image, ax=ax, label='Failure rate', shrink=0.5)
     
     plt.tight_layout()
     
@@ -385,35 +153,20 @@ def create_spatial_visualization():
     plt.close()
     
     print(f"🗺️  Spatial distribution saved to spatial_analysis/floor_success_spatial_distribution.png")
-    print(f"   Downstairs Success: {len(downstairs_success_positions)}")
-    print(f"   Downstairs Failure: {len(downstairs_fail_positions)}")
-    print(f"   Mezzanine Success: {len(mezzanine_success_positions)}")
-    print(f"   Mezzanine Failure: {len(mezzanine_fail_positions)}")
+    for floor in (DOWNSTAIRS, MEZZANINE):
+        successes, failures = spatial_grids[floor].totals()
+        outside = sum(spatial_grids[floor].outside)
+        name = FLOOR_NAMES[floor]
+        print(f"   {name} Success: {successes}")
+        print(f"   {name} Failure: {failures}" + (f" ({outside} outside the heatmap)" if outside else ""))
 
 def add_position_to_tracking(tag_mac: str, x: float, y: float, success: bool):
-    """Add a position to the appropriate floor tracking list"""
-    # Determine floor based on tag MAC and TAG_POSITION_DICT
-    # First, find the tag_id for this MAC
-    tag_id = None
-    for tid, mac in tag_id_to_mac.items():
-        if mac == tag_mac:
-            tag_id = tid
-            break
+    """Count a position in its floor's heatmap grid"""
+    # Expected floor straight from the tag registry (unknown MACs are not tracked)
+    expected_floor = TAGS.floor(tag_mac)
     
-    if tag_id and tag_id in TAG_POSITION_DICT:
-        expected_map_id = TAG_POSITION_DICT[tag_id]
-        
-        # Add to appropriate floor list based on expected map_id
-        if expected_map_id == DOWNSTAIRS_MAP_ID:
-            if success:
-                downstairs_success_positions.append((x, y))
-            else:
-                downstairs_fail_positions.append((x, y))
-        elif expected_map_id == MEZZANINE_MAP_ID:
-            if success:
-                mezzanine_success_positions.append((x, y))
-            else:
-                mezzanine_fail_positions.append((x, y))
+    if expected_floor >= 0:
+        spatial_grids[expected_floor].add(x, y, success)
 
 #code:
 def get_key_info(position_data: Dict[str, Any]) -> Tuple[str, str]:
@@ -431,25 +184,78 @@ def on_connect(client, userdata, flags, rc, properties=None):
 def on_subscribe(client, userdata, mid, granted_qos, properties=None):
     print("✅ Subscribed, waiting for messages…")
 
+def record_stream_decision(tag_index: int, actual_map_id: str, x: float, y: float):
+    """Stream mode: score every message in the quality window, the heatmap and the cumulative counters, without printing"""
+    global success_count, failure_count
+    global downstairs_success_count, downstairs_failure_count
+    global mezzanine_success_count, mezzanine_failure_count
+    
+    tag_message_counts[tag_index] += 1
+    expected_floor = TAGS.floors[tag_index]
+    correct = quality_monitor.record(tag_index, TAGS.floor_of_map(actual_map_id))
+    spatial_grids[expected_floor].add(x, y, correct)
+    if correct:
+        success_count += 1
+        if expected_floor == DOWNSTAIRS:
+            downstairs_success_count += 1
+        elif expected_floor == MEZZANINE:
+            mezzanine_success_count += 1
+    else:
+        failure_count += 1
+        failed_tags[tag_index] += 1
+        if expected_floor == DOWNSTAIRS:
+            downstairs_failure_count += 1
+        elif expected_floor == MEZZANINE:
+            mezzanine_failure_count += 1
+
+def close_due_runs(client):
+    """Close the runs that reached the quorum or their deadline; disconnect after the last one"""
+    global current_run
+    
+    closed = run_scheduler.close_due()
+    for run in closed:
+        current_run = run_scheduler.closed
+        stragglers = run.stragglers()
+        print(f"🎯 COMPLETED RUN {run.number}/{TOTAL_RUNS} ({run.closed_by} after {run.closed - run.opened:.0f}s)")
+        print(f"📊 Run Summary: {run.count} unique tags published once, {len(stragglers)} stragglers"
+              + (f": {', '.join(TAGS.ids[index] for index in stragglers[:8])}" if stragglers else ""))
+        print(f"📊 Total stats so far: {success_count} successes, {failure_count} failures\n")
+        
+    # Check if we've completed all runs
+    if closed and run_scheduler.finished:
+        print(f"🏁 ALL {TOTAL_RUNS} RUNS COMPLETED!")
+        print(f"📊 Final Summary: {success_count} total successes, {failure_count} total failures")
+        print(f"🎯 {run_scheduler.summary()}")
+        print(f"🎯 Stopping data collection...\n")
+        # Disconnect and exit
+        client.disconnect()
+
 def on_message(client, userdata, msg):
     global success_count, failure_count, tag_message_counts, failed_tags
     global downstairs_success_count, downstairs_failure_count
     global mezzanine_success_count, mezzanine_failure_count
-    global current_run, tags_published_in_current_run
     
     try:
-        payload = msg.payload.decode("utf-8", errors="replace")
-        position_data = json.loads(payload)
+        position_data = json_loads(msg.payload)  # Fastest available JSON backend, straight from bytes
+        if recent_positions.seen(position_key(position_data)):
+            return  # A redelivery must not count as the tag's message in a later run
         key_info = get_key_info(position_data)
+        tag_index = TAGS.index_of_id(key_info[0])
         
-        if key_info[0] in TAG_POSITION_DICT.keys():
+        if tag_index is not None:
             tag_id, actual_map_id = key_info
-            expected_map_id = TAG_POSITION_DICT[tag_id]
+            expected_map_id = TAGS.map_ids[TAGS.floors[tag_index]]
             
+            if EVALUATION_MODE == "stream":
+                position = position_data["location"]["position"]
+                record_stream_decision(tag_index, actual_map_id, position["x"], position["y"])
+                return
+                
             # ONLY process the FIRST message from each tag per run
-            if tag_id not in tags_published_in_current_run:
-                tags_published_in_current_run.add(tag_id)
-                tag_message_counts[tag_id] += 1
+            run = run_scheduler.assign(tag_index)
+            if run is not None:
+                tag_message_counts[tag_index] += 1
+                quality_monitor.record(tag_index, TAGS.floor_of_map(actual_map_id))
                 
                 # Extract position data for spatial tracking
                 tag_mac = position_data["tag"]["mac"]
@@ -475,9 +281,7 @@ def on_message(client, userdata, msg):
                     failure_count += 1
                     
                     # Track failed tags
-                    if tag_id not in failed_tags:
-                        failed_tags[tag_id] = 0
-                    failed_tags[tag_id] += 1
+                    failed_tags[tag_index] += 1
                     
                     print(f"❌ FAILURE: {key_info} (Expected: {expected_map_id})")
                     
@@ -487,37 +291,19 @@ def on_message(client, userdata, msg):
                     elif expected_map_id == MEZZANINE_MAP_ID:
                         mezzanine_failure_count += 1
             else:
-                # This tag already published in current run, ignore this message
-                #print(f"🔄 IGNORING: Tag {tag_id} already published in current run")
+                # This tag already published in every run that can be open, ignore this message
+                #print(f"🔄 IGNORING: Tag {tag_id} already published in the open runs")
                 return
             
             # Print current stats
             total = success_count + failure_count
             success_rate = (success_count / total * 100) if total > 0 else 0
-            unique_tags_in_run = len(tags_published_in_current_run)
             print(f"📊 Stats: {success_count} successes, {failure_count} failures, {success_rate:.1f}% success rate")
             print(f"📍 Position: ({x:.1f}, {y:.1f}) | Tag: {tag_mac[:6]}... | Floor: {'Downstairs' if expected_map_id == DOWNSTAIRS_MAP_ID else 'Mezzanine'}")
-            print(f"🔄 Run {current_run + 1}/{TOTAL_RUNS} | Unique tags in current run: {unique_tags_in_run}/{EXPECTED_UNIQUE_TAGS_PER_RUN}\n")
+            print(f"🔄 Run {run.number}/{TOTAL_RUNS} | Unique tags in run: {run.count}/{EXPECTED_UNIQUE_TAGS_PER_RUN} | "
+                  f"Open runs: {len(run_scheduler.open_runs)}\n")
             
-            # Check if we've completed the current run (all 58 unique tags have published)
-            if unique_tags_in_run >= EXPECTED_UNIQUE_TAGS_PER_RUN:
-                current_run += 1
-                tags_published_in_current_run.clear()  # Reset for next run
-                
-                print(f"🎯 COMPLETED RUN {current_run}/{TOTAL_RUNS}")
-                print(f"📊 Run Summary: All {EXPECTED_UNIQUE_TAGS_PER_RUN} unique tags published once")
-                print(f"📊 Total stats so far: {success_count} successes, {failure_count} failures")
-                print(f"🔄 Starting next run, waiting for all {EXPECTED_UNIQUE_TAGS_PER_RUN} tags again...\n")
-                
-                # Check if we've completed all runs
-                if current_run >= TOTAL_RUNS:
-                    print(f"🏁 ALL {TOTAL_RUNS} RUNS COMPLETED!")
-                    print(f"📊 Final Summary: {success_count} total successes, {failure_count} total failures")
-                    print(f"🎯 Each of the {EXPECTED_UNIQUE_TAGS_PER_RUN} tags published exactly {TOTAL_RUNS} times")
-                    print(f"🎯 Stopping data collection...\n")
-                    # Disconnect and exit
-                    client.disconnect()
-                    return
+            close_due_runs(client)
             
     except (json.JSONDecodeError, KeyError) as e:
         print(f"❌ Error parsing message: {e}")
@@ -528,10 +314,10 @@ def print_final_stats():
     global success_count, failure_count, tag_message_counts, failed_tags
     global downstairs_success_count, downstairs_failure_count
     global mezzanine_success_count, mezzanine_failure_count
-    global current_run, tags_published_in_current_run
+    global current_run
     
     total = success_count + failure_count
-    call_counts = tag_message_counts.values()
+    call_counts = tag_message_counts
     max_calls = max(call_counts)
     min_calls = min(call_counts)
     avg_calls = sum(call_counts) / len(call_counts)
@@ -543,9 +329,9 @@ def print_final_stats():
 
     #generate non-pinged tags
     non_pinged: List[str] = []
-    for tag_id in tag_message_counts.keys():
-        if tag_message_counts[tag_id] == 0:
-            non_pinged.append(tag_id)
+    for tag_index, count in enumerate(tag_message_counts):
+        if count == 0:
+            non_pinged.append(TAGS.ids[tag_index])
 
     
     if total > 0:
@@ -562,9 +348,18 @@ def print_final_stats():
         print(f"\n{'='*50}")
         print(f"FINAL RESULTS:")
         print(f"Runtime: {runtime_minutes:.2f} minutes ({runtime_seconds:.1f} seconds)")
-        print(f"Runs completed: {current_run}/{TOTAL_RUNS}")
-        print(f"Expected messages per tag: {TOTAL_RUNS} (one per run)")
-        print(f"Total unique messages processed: {total} (from {EXPECTED_UNIQUE_TAGS_PER_RUN} unique tags)")
+        if EVALUATION_MODE == "stream":
+            print(f"Messages scored (stream mode, every message): {total}")
+        else:
+            print(f"Runs completed: {current_run}/{TOTAL_RUNS}")
+            print(f"Expected messages per tag: {TOTAL_RUNS} (one per run)")
+            print(f"Total unique messages processed: {total} (quorum {EXPECTED_UNIQUE_TAGS_PER_RUN} unique tags per run)")
+            if run_scheduler.sampled:
+                print(f"Run scheduler: {run_scheduler.summary()}")
+                stragglers = ", ".join(f"{tag_id} ({misses})" for tag_id, misses in run_scheduler.worst_stragglers())
+                print(f"Stragglers (runs missed): {stragglers or 'none'}")
+        if runtime_minutes > 0:
+            print(f"Scored messages per minute: {total / runtime_minutes:.1f}")
         print(f"Overall success rate: {success_rate:.2f}%")
         print(f"🏢 Downstairs success rate: {downstairs_rate:.2f}% ({downstairs_success_count}/{downstairs_total})")
         print(f"🏗️  Mezzanine success rate: {mezzanine_rate:.2f}% ({mezzanine_success_count}/{mezzanine_total})")
@@ -575,27 +370,32 @@ def print_final_stats():
         print(f"Tag most messages amt: {max_calls}")
         print(f"Tag least messages amt: {min_calls}")
         print(f"Non pinged tags: {non_pinged}")
+        if recent_positions.unique:
+            print(f"Duplicate filter: {recent_positions.summary()}")
+        if quality_monitor.decisions:
+            for line in quality_monitor.status_lines():
+                print(line)
         print(f"{'='*50}")
         
         # Display failed tags analysis
-        if failed_tags:
+        if any(failed_tags):
             print(f"\n❌ FAILED TAGS ANALYSIS:")
             print(f"{'='*50}")
             
             # Sort failed tags by failure count (highest first)
-            sorted_failed_tags = sorted(failed_tags.items(), key=lambda x: x[1], reverse=True)
+            sorted_failed_tags = sorted(((tag_index, count) for tag_index, count in enumerate(failed_tags) if count),
+                                        key=lambda x: x[1], reverse=True)
             
             downstairs_failed = []
             mezzanine_failed = []
             
-            for tag_id, failure_count in sorted_failed_tags:
-                expected_map_id = TAG_POSITION_DICT.get(tag_id, "UNKNOWN")
-                floor_name = "Downstairs" if expected_map_id == DOWNSTAIRS_MAP_ID else "Mezzanine"
-                tag_mac = tag_id_to_mac.get(tag_id, "UNKNOWN_MAC")
+            for tag_index, failure_count in sorted_failed_tags:
+                tag_id, tag_mac, floor = TAGS.ids[tag_index], TAGS.macs[tag_index], TAGS.floors[tag_index]
+                floor_name = FLOOR_NAMES[floor]
                 
-                if expected_map_id == DOWNSTAIRS_MAP_ID:
+                if floor == DOWNSTAIRS:
                     downstairs_failed.append((tag_mac, failure_count))
-                elif expected_map_id == MEZZANINE_MAP_ID:
+                elif floor == MEZZANINE:
                     mezzanine_failed.append((tag_mac, failure_count))
                 
                 print(f"  Tag {tag_id} ({tag_mac}): {failure_count} failures | Floor: {floor_name}")
@@ -624,61 +424,51 @@ def print_final_stats():
         print("No messages were processed.")
 
 
-def make_api_request():
-    """Make the API POST request to trigger tag broadcasting"""
-    try:
-        response = requests.post(url, headers=headers, json=payload, verify=False)
-        print(f"🔄 API Request - Status: {response.status_code}")
-        if response.status_code == 201:
-            print("✅ API Request successful - Tags should start broadcasting")
-        else:
-            print(f"⚠️  API Response: {response.text}")
-        return response.status_code == 201
-    except requests.exceptions.RequestException as e:
-        print(f"❌ API Request failed: {e}")
-        return False
-
 def runner():
     global start_time
     
-    # Track when we last made an API request
-    last_api_request = 0
-    api_interval = 100  # Make API request every 80 seconds (timeout is 90s, so slight overlap)
-    
     client = mqtt.Client(protocol=mqtt.MQTTv311)   
     client.enable_logger()                         
     client.on_connect   = on_connect
     client.on_subscribe = on_subscribe
     client.on_message   = on_message
+    trigger_scheduler = TriggerScheduler([url], headers, payload, interval=API_TRIGGER_INTERVAL)
 
     try:
-        # Make initial API request
-        print("🚀 Making initial API request...")
-        make_api_request()
-        last_api_request = time.time()
+        # Broadcast triggers run on their own thread so a slow API never stalls the MQTT loop
+        print("🚀 Starting API trigger scheduler...")
+        trigger_scheduler.start()
         
         # Connect to MQTT
         client.connect(BROKER_HOST, BROKER_PORT, keepalive=60)
+        print(f"🎯 Evaluation mode: {EVALUATION_MODE} | Quality window {QUALITY_WINDOW / 60:.1f} min, "
+              f"status every {QUALITY_INTERVAL:.0f}s")
+        if EVALUATION_MODE == "runs":
+            print(f"🎯 Runs: {TOTAL_RUNS}, each closing at {EXPECTED_UNIQUE_TAGS_PER_RUN} tags or after {RUN_DEADLINE}s, "
+                  f"{RUN_PIPELINE_DEPTH} open at once")
         
-        # Start the loop with periodic API requests
-        print("🔄 Starting MQTT loop with periodic API requests...")
+        # Start the loop
+        print("🔄 Starting MQTT loop (API requests run in the background)...")
         while True:
-            # Check if we need to make another API request
-            current_time = time.time()
-            if current_time - last_api_request >= api_interval:
-                print(f"⏰ {api_interval}s elapsed, making another API request...")
-                make_api_request()
-                last_api_request = current_time
-            
             # Process MQTT messages for a short time
             client.loop(timeout=1.0)
+            quality_monitor.emit_due()
+            if EVALUATION_MODE == "runs":
+                close_due_runs(client)  # Deadlines pass without messages too
+                if run_scheduler.finished:
+                    break
+                    
+        trigger_scheduler.stop()
+        print_final_stats()
             
     except KeyboardInterrupt:
         print("\n🛑 Stopping...")
+        trigger_scheduler.stop()
         client.disconnect()
         print_final_stats()
     except Exception as e:
         print(f"❌ Connection error: {e}")
+        trigger_scheduler.stop()
         client.disconnect()
         print_final_stats()
     
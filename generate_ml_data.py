@@ -1,13 +1,57 @@
 from typing import Dict, Any, List, Set
 import logging, paho.mqtt.client as mqtt
-import time, requests, json, csv, os, math
-from statistics import mean, stdev, median
+import time, json, csv, os, math, threading
+from statistics import median
+
+from row_layout import RowLayout
+from batch_features import BatchedRowWriter
+from rssi_stats import MapStats
+from anchor_observations import AnchorObservations, MapCodes
+from sparse_output import SparseSink
+from csv_manifest import CSVManifest
+from device_inventory import load_inventory, header_anchor_macs
+from position_decoder import PositionMessage, decode_position
+from ingestion import IngestionPipeline, DROP_OLDEST
+from mqtt_capture import CaptureWriter, replay
+from trigger_scheduler import TriggerScheduler, TagLiveness
+from pipeline_metrics import PipelineMetrics, MetricsServer
+from recent_keys import RecentKeyIndex
+from tag_registry import TAGS
+from buffered_csv import BufferedCSVWriter, FlushPolicy, flush_due, flush_all, buffer_totals, install_signal_flush
 
 # Configuration
 BROKER_HOST = ""  # MQTT broker address (redacted)
 BROKER_PORT = 0  # MQTT broker port (redacted)
 TOPIC = "engine/+/positions"
 OUTPUT_DIR = "ml_training_data_new"
+OUTPUT_FORMAT = "wide"  # "wide": one CSV row per position, "sparse": long format (see sparse_output.py)
+SPARSE_OUTPUT_DIR = "ml_training_data_sparse"
+
+# CSV write batching: each tag's rows are flushed every 200 rows, 256 KB or 5 s (set fsync_interval for durability)
+FLUSH_POLICY = FlushPolicy(max_rows=200, max_bytes=256 * 1024, max_interval=5.0, fsync_interval=None)
+
+# Feature extraction: >0 collects this many positions and builds their rows at once with NumPy (see batch_features.py), 0 builds each row as it arrives; the rows are identical either way
+FEATURE_BATCH_SIZE = 256
+FEATURE_BATCH_MAX_DELAY = 0.5  # Seconds a partial batch may wait before it is written
+
+# Ingestion: "inline" processes on the MQTT network thread, "queued" hands raw payloads to worker threads
+INGESTION_MODE = "inline"
+INGESTION_WORKERS = 4  # Partitioned by tag MAC so each tag's rows stay in order
+INGESTION_QUEUE_SIZE = 10000  # Total queued payloads across all workers
+BACKPRESSURE_POLICY = DROP_OLDEST  # block, drop-oldest or drop-newest when the queue is full
+
+# De-duplication of positions delivered more than once (QoS retries, reconnects, duplicate engines)
+DEDUP_CAPACITY = 20000  # Recent (tag MAC, timestamp, map ID) keys remembered at most
+DEDUP_WINDOW = 120.0  # Seconds a key is remembered after it was last received
+
+# Raw capture: set to a directory to also append every received payload to a replayable log (see mqtt_capture.py)
+CAPTURE_DIR = None
+
+# Metrics: per-stage latency histograms, queue depth, drops and bytes written (see pipeline_metrics.py)
+METRICS_ENABLED = True
+METRICS_PORT = 9108  # Prometheus text at http://127.0.0.1:<port>/metrics, None disables the endpoint
+METRICS_JSON_FILE = "metrics.json"  # Rewritten in OUTPUT_DIR every METRICS_JSON_INTERVAL seconds, None disables
+METRICS_JSON_INTERVAL = 60.0
 
 # API configuration
 url = ""  # API endpoint (redacted)
@@ -15,15 +59,13 @@ headers = {
     "accept": "application/json",
     "Content-Type": "application/json"
 }
+API_TRIGGER_INTERVAL = 100.0  # Seconds between broadcast triggers (sent from a background thread)
+# "liveness": trigger each tag shortly before its broadcast timeout, or sooner when it went silent; "interval": all tags every API_TRIGGER_INTERVAL
+API_TRIGGER_MODE = "liveness"
+TRIGGER_LEAD = 10.0  # Seconds before a tag's broadcast times out that it is re-triggered
+TRIGGER_QUIET_AFTER = 30.0  # Re-trigger a tag silent this long after its trigger (doubles while it stays silent)
 
-TAG_MAC_LIST: List[str] = [
-    'f8c6e10eb94d', 'e80511ee6f95', 'ebc3d8c27268', 'ea130331a7d6', 'e5618db03315', 'f53d908ae87e', 'faebae16f304', 'dcb814adee27', 'ee1ae8c0199b', 'e71ebc086c12', 'dc6fd1014985', 
-    'e0187539099c', 'ed3dc76b5057', 'cfcba5a4aa8c', 'd2433d346da0', 'c3fdcfc7cde7', 'fbde6b71de2c', 'eed4934cb925', 'd55a17359cec', 'dd35e8065e41', 'de8a7eb407c5', 'c694e5297d8c', 
-    'f7fb6d248542', 'f1465d4b34ad', 'c5d89d98d531', 'e3c858bb535e', 'e12a0889fc9d', 'f17508753dd2', 'eacbbb80d2ae', 'd908a64ff5c8', 'e0179d3286a1', 'ca70faad5185', 'eaf519e486b7', 
-    'f260a59af3be', 'd1162b91f43c', 'c0c28a5250d1', 'e45428cd811f', 'f9cf5a96910d', 'e1221fc96df8', 'db87600e1088', 'ea0efa76b1d7', 'e75675d44213', 'cfa33b8f966f', 'e6a1121bd9ba', 
-    'c61444ecfa21', 'cbafa76ff612', 'eabf49388a88', 'e6dee509ceb7', 'd31e40a36148', 'fe916ad112d4', 'dbd8f214e90c', 'f8e68ad462b8', 'ced95ba5af64', 'c07f2aebbfb2', 'dbdfe63c5bfe', 
-    'eb7dd4251a0b', 'e9ee05861174', 'c48718b206de', 'dfe232164c0a', 'ccd6b409ba05'
-]
+TAG_MAC_LIST: List[str] = list(TAGS.macs)  # Every registered tag (see tag_registry.py)
 
 payload: Dict[str, Any] = {
     "devices": TAG_MAC_LIST,
@@ -42,74 +84,11 @@ payload: Dict[str, Any] = {
 }
 
 # TAG_MAC_TO_MAP_ID for determining true_map_id
-TAG_MAC_TO_MAP_ID: Dict[str, str] = {
-    # Downstairs tags (map_id: 682c66de8cde618ce1270230)
-    'f260a59af3be': '682c66de8cde618ce1270230',  # 62398
-    'e45428cd811f': '682c66de8cde618ce1270230',  # 33055
-    'eaf519e486b7': '682c66de8cde618ce1270230',  # 34487
-    'e71ebc086c12': '682c66de8cde618ce1270230',  # 27666
-    'db87600e1088': '682c66de8cde618ce1270230',  # 4232
-    'e75675d44213': '682c66de8cde618ce1270230',  # 16915
-    'ea0efa76b1d7': '682c66de8cde618ce1270230',  # 45527
-    'e3c858bb535e': '682c66de8cde618ce1270230',  # 21342
-    'f9cf5a96910d': '682c66de8cde618ce1270230',  # 37133
-    'e9ee05861174': '682c66de8cde618ce1270230',  # 4468
-    'c5d89d98d531': '682c66de8cde618ce1270230',  # 54577
-    'f17508753dd2': '682c66de8cde618ce1270230',  # 15826
-    'ccd6b409ba05': '682c66de8cde618ce1270230',  # 47621
-    'cfcba5a4aa8c': '682c66de8cde618ce1270230',  # 43660
-    'dfe232164c0a': '682c66de8cde618ce1270230',  # 19466
-    'ea130331a7d6': '682c66de8cde618ce1270230',  # 42966
-    'fe916ad112d4': '682c66de8cde618ce1270230',  # 4820
-    'cbafa76ff612': '682c66de8cde618ce1270230',  # 62994
-    'd31e40a36148': '682c66de8cde618ce1270230',  # 24904
-    'ed3dc76b5057': '682c66de8cde618ce1270230',  # 20567
-    'f7fb6d248542': '682c66de8cde618ce1270230',  # 34114
-    'e5618db03315': '682c66de8cde618ce1270230',  # 13077
-    'c48718b206de': '682c66de8cde618ce1270230',  # 1758
-    'ced95ba5af64': '682c66de8cde618ce1270230',  # 44900
-    'e80511ee6f95': '682c66de8cde618ce1270230',  # 28565
-    'f8e68ad462b8': '682c66de8cde618ce1270230',  # 25272
-    'c07f2aebbfb2': '682c66de8cde618ce1270230',  # 49074
-    'dc6fd1014985': '682c66de8cde618ce1270230',  # 18821
-    'dbdfe63c5bfe': '682c66de8cde618ce1270230',  # 23550
-    'f53d908ae87e': '682c66de8cde618ce1270230',  # 59518
-    
-    # Mezzanine tags (map_id: 682c66f08cde618ce127025e)
-    'eacbbb80d2ae': '682c66f08cde618ce127025e',  # 53934
-    'd55a17359cec': '682c66f08cde618ce127025e',  # 40172
-    'c3fdcfc7cde7': '682c66f08cde618ce127025e',  # 52711
-    'dd35e8065e41': '682c66f08cde618ce127025e',  # 24129
-    'f1465d4b34ad': '682c66f08cde618ce127025e',  # 13485
-    'd2433d346da0': '682c66f08cde618ce127025e',  # 28064
-    'de8a7eb407c5': '682c66f08cde618ce127025e',  # 1989
-    'fbde6b71de2c': '682c66f08cde618ce127025e',  # 56876
-    'eed4934cb925': '682c66f08cde618ce127025e',  # 47397
-    'c694e5297d8c': '682c66f08cde618ce127025e',  # 32140
-    'dcb814adee27': '682c66f08cde618ce127025e',  # 60967
-    'ee1ae8c0199b': '682c66f08cde618ce127025e',  # 6555
-    'e12a0889fc9d': '682c66f08cde618ce127025e',  # 64669
-    'ca70faad5185': '682c66f08cde618ce127025e',  # 20869
-    'e1221fc96df8': '682c66f08cde618ce127025e',  # 28152
-    'eabf49388a88': '682c66f08cde618ce127025e',  # 35464
-    'faebae16f304': '682c66f08cde618ce127025e',  # 62212
-    'e6a1121bd9ba': '682c66f08cde618ce127025e',  # 55738
-    'ebc3d8c27268': '682c66f08cde618ce127025e',  # 29288
-    'c0c28a5250d1': '682c66f08cde618ce127025e',  # 20689
-    'eb7dd4251a0b': '682c66f08cde618ce127025e',  # 6667
-    'dbd8f214e90c': '682c66f08cde618ce127025e',  # 59660
-    'f8c6e10eb94d': '682c66f08cde618ce127025e',  # 47437
-    'c61444ecfa21': '682c66f08cde618ce127025e',  # 64033
-    'e6dee509ceb7': '682c66f08cde618ce127025e',  # 52919
-    'e0187539099c': '682c66f08cde618ce127025e',  # 2460
-    'cfa33b8f966f': '682c66f08cde618ce127025e',  # 38511
-    'd1162b91f43c': '682c66f08cde618ce127025e',  # 62524
-    'd908a64ff5c8': '682c66f08cde618ce127025e',  # 62920
-    'e0179d3286a1': '682c66f08cde618ce127025e'   # 34465
-}
+TAG_MAC_TO_MAP_ID: Dict[str, str] = TAGS.mac_to_map_id()
 
 # Map IDs
-MAP_IDS = ["682c66de8cde618ce1270230", "682c66f08cde618ce127025e"]
+MAP_IDS = list(TAGS.map_ids)
+map_codes = MapCodes(MAP_IDS)  # Map ID <-> small integer code for every AnchorObservations
 
 # Global variables
 start_time = time.time()
@@ -117,33 +96,35 @@ message_count = 0
 csv_writers = {}
 csv_files = {}
 tag_message_counts = {}  # Track messages per tag
+counter_lock = threading.Lock()  # Guards message_count when ingestion workers run concurrently
+row_layout = None  # Compiled column layout, built in setup_csv_files
+sparse_sink = None  # SparseSink when OUTPUT_FORMAT is "sparse"
+manifest = None  # CSVManifest of the wide CSV files (row counts without re-reading them)
+capture_writer = None  # CaptureWriter when CAPTURE_DIR is set
+row_batcher = None  # BatchedRowWriter for the wide files when FEATURE_BATCH_SIZE > 0, created in setup_csv_files
+device_inventory = None  # DeviceInventory from the S00695 device lists, loaded at startup
+row_layout_anchor_macs = None  # Anchor set row_layout was compiled from
 last_stats_print = time.time()
+trigger_scheduler = None  # TriggerScheduler sending the broadcast trigger, started in runner
+metrics = None  # PipelineMetrics when METRICS_ENABLED, started in runner
+metrics_server = None  # MetricsServer behind METRICS_PORT
+tag_liveness = None  # TagLiveness fed by incoming positions in "liveness" trigger mode
+recent_positions = None  # RecentKeyIndex dropping repeated deliveries, created in runner
 
 def calculate_distance(x1: float, y1: float, x2: float, y2: float) -> float:
     """Calculate Euclidean distance between two points"""
     return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
 
 def get_all_anchor_macs() -> Set[str]:
-    """Get all unique anchor MACs from the existing CSV files to ensure compatibility"""
-    anchor_macs = set()
+    """Anchor columns: those of the existing CSV files (to keep appends aligned), otherwise the device inventory"""
+    anchor_macs = header_anchor_macs(OUTPUT_DIR)
+    if anchor_macs is not None:
+        return anchor_macs
     
-    # Read one of the existing CSV files to extract anchor MACs from the header
-    try:
-        sample_file = "ml_training_data/c0a9266bb706.csv"
-        with open(sample_file, 'r') as f:
-            header = f.readline().strip().split(',')
-            
-        # Extract anchor MACs from column names (columns ending with _rssi)
-        for col in header:
-            if col.endswith('_rssi'):
-                anchor_mac = col[:-5]  # Remove '_rssi' suffix
-                if len(anchor_mac) == 12:  # Valid MAC address length
-                    anchor_macs.add(anchor_mac)
-                    
-    except FileNotFoundError:
-        print("Warning: Could not find sample CSV file to extract anchor MACs")
-        
-    return anchor_macs
+    if device_inventory is None:
+        print("Warning: No existing CSV files and no device inventory to take anchor MACs from")
+        return set()
+    return device_inventory.anchor_macs
 
 def generate_csv_header(anchor_macs: Set[str]) -> List[str]:
     """Generate the CSV header based on the same format as existing files"""
@@ -179,43 +160,74 @@ def generate_csv_header(anchor_macs: Set[str]) -> List[str]:
     
     return header
 
+def compile_row_layout(anchor_macs: Set[str]) -> RowLayout:
+    """Compile the column layout for the given anchor set once"""
+    return RowLayout(generate_csv_header(anchor_macs), MAP_IDS)
+
+def get_row_layout(anchor_macs: Set[str]) -> RowLayout:
+    """Return the compiled layout, recompiling only if the anchor set changed"""
+    global row_layout, row_layout_anchor_macs
+    
+    if row_layout is None or row_layout_anchor_macs is not anchor_macs:
+        row_layout = compile_row_layout(anchor_macs)
+        row_layout_anchor_macs = anchor_macs
+    return row_layout
+
+def setup_sparse_files():
+    """Initialize the sparse long-format files for each tag MAC"""
+    global sparse_sink
+    
+    sparse_sink = SparseSink(SPARSE_OUTPUT_DIR, MAP_IDS, FLUSH_POLICY)
+    tag_message_counts.update(sparse_sink.open(list(TAG_MAC_TO_MAP_ID.keys())))
+    csv_writers.update(sparse_sink.writers)
+    csv_files.update(sparse_sink.file_handles())
+    
+    print(f"✅ Sparse output: positions + per-anchor observations for {len(TAG_MAC_TO_MAP_ID)} tags")
+    print(f"📁 All files in {SPARSE_OUTPUT_DIR}/ (anchor coordinates in anchor_table.csv)")
+    
+    # Make sure buffered rows reach disk if we are interrupted or terminated
+    install_signal_flush(csv_writers)
+
 def setup_csv_files(anchor_macs: Set[str]):
     """Initialize CSV files for each tag MAC"""
-    global csv_writers, csv_files, tag_message_counts
+    global csv_writers, csv_files, tag_message_counts, manifest, row_batcher
+    
+    manifest = None
+    row_batcher = None
+    if OUTPUT_FORMAT == "sparse":
+        setup_sparse_files()
+        return
+    if FEATURE_BATCH_SIZE > 0:
+        row_batcher = BatchedRowWriter(csv_writers, MAP_IDS, get_row_layout, FEATURE_BATCH_SIZE, FEATURE_BATCH_MAX_DELAY,
+                                       observe=observe_stage)
     
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    header = generate_csv_header(anchor_macs)
+    header = get_row_layout(anchor_macs).header
     print(f"🔧 CSV header has {len(header)} columns")
     
+    # Existing row counts come from the manifest; files are only rescanned if it is stale
+    manifest = CSVManifest(OUTPUT_DIR).load()
+    timestamp_column = header.index("position_timestamp")  # Flushed timestamps feed the manifest
+    
     for tag_mac in TAG_MAC_TO_MAP_ID.keys():
         filename = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
         
         # Check if file exists and is non-empty
-        file_exists = os.path.exists(filename)
-        write_header = True
-        existing_rows = 0
-        
-        if file_exists:
-            try:
-                with open(filename, 'r') as check_file:
-                    existing_rows = sum(1 for _ in check_file)
-                    write_header = existing_rows == 0  # Only write header if file is empty
-            except:
-                write_header = True  # If error reading, assume we need header
+        write_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
         
         # Open in append mode
         file_handle = open(filename, 'a', newline='')
-        writer = csv.writer(file_handle)
         
         # Only write header if file is new or empty
         if write_header:
-            writer.writerow(header)
+            csv.writer(file_handle).writerow(header)
+            file_handle.flush()
         
         csv_files[tag_mac] = file_handle
-        csv_writers[tag_mac] = writer
-        tag_message_counts[tag_mac] = existing_rows - 1 if existing_rows > 0 else 0  # Account for header
+        csv_writers[tag_mac] = BufferedCSVWriter(file_handle, FLUSH_POLICY, mark_column=timestamp_column)
+        tag_message_counts[tag_mac] = manifest.seed(tag_mac, filename, header)
         
     new_files = sum(1 for tag_mac in TAG_MAC_TO_MAP_ID.keys() 
                     if not os.path.exists(os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")) 
@@ -225,148 +237,107 @@ def setup_csv_files(anchor_macs: Set[str]):
     print(f"✅ Setup complete: {new_files} new CSV files, {existing_files} existing files (appending)")
     print(f"📁 All files in {OUTPUT_DIR}/")
     print(f"📋 Sample file names: {list(TAG_MAC_TO_MAP_ID.keys())[:3]}.csv, ...")
+    manifest.save(csv_writers)
+    
+    # Make sure buffered rows reach disk if we are interrupted or terminated
+    install_signal_flush(csv_writers)
+
+def write_wide_row(tag_mac: str, base: List[Any], map_stats: Dict[str, MapStats],
+                   all_anchors: AnchorObservations, anchor_macs: Set[str]):
+    """Assemble the wide row for one position and write it to the tag's CSV"""
+    started = time.perf_counter()
+    # Build CSV row from the prefilled template (absent anchors already hold empty values)
+    layout = get_row_layout(anchor_macs)
+    row = layout.new_row()
+    layout.set_base(row, base)
+    
+    # Add per-map statistics
+    for mid in MAP_IDS:
+        layout.set_map_stats(row, mid, map_stats[mid].values())
+        
+    # Scatter only the anchors heard in this message
+    all_anchors.scatter(row, layout.anchor_offsets)
+        
+    # Write to appropriate CSV file
+    assembled = observe_stage("assembly", started)
+    csv_writers[tag_mac].writerow(row)  # Buffered, flushed according to FLUSH_POLICY
+    observe_stage("write", assembled)
+
+def observe_stage(stage: str, started: float) -> float:
+    """Record the time since `started` (perf_counter) for a pipeline stage; returns the end time"""
+    now = time.perf_counter()
+    if metrics is not None:
+        metrics.observe(stage, now - started)
+    return now
 
-def process_position_message(position_data: Dict[str, Any], anchor_macs: Set[str]):
+def process_position_message(message: PositionMessage, anchor_macs: Set[str]):
     """Process a single position message and write to appropriate CSV"""
     global message_count, tag_message_counts
     
     try:
-        tag_mac = position_data["tag"]["mac"]
+        tag_mac = message.tag_mac
         
         # Only process if it's one of our 60 tags
         if tag_mac not in TAG_MAC_TO_MAP_ID:
             return
+        if tag_liveness is not None:
+            tag_liveness.note_seen(tag_mac)
             
-        message_count += 1
+        with counter_lock:
+            message_count += 1
         tag_message_counts[tag_mac] += 1
         
-        # Extract basic position data
-        location = position_data["location"]
-        map_id = location["map_id"]
-        timestamp = position_data["timestamp"]
-        pos = location["position"]
-        tag_x = pos["x"]
-        tag_y = pos["y"]
+        started = time.perf_counter()
         
-        # Extract covariance matrix
-        cov = pos["covariance"]
-        cov_xx = cov[0][0]
-        cov_xy = cov[0][1] 
-        cov_yx = cov[1][0]
-        cov_yy = cov[1][1]
+        # Basic position data and covariance matrix
+        map_id = message.map_id
+        timestamp = message.timestamp
+        tag_x = message.x
+        tag_y = message.y
+        cov_xx, cov_xy, cov_yx, cov_yy = message.covariance
         
         true_map_id = TAG_MAC_TO_MAP_ID[tag_mac]
+        batching = row_batcher is not None
         
-        # Collect all anchors (used + unused)
-        all_anchors = {}
-        
-        # Process used anchors
-        for anchor in pos.get("used_anchors", []):
-            anchor_mac = anchor["mac"]
-            # Some used anchors may not have x,y coordinates
-            if "x" in anchor and "y" in anchor:
-                distance = calculate_distance(tag_x, tag_y, anchor["x"], anchor["y"])
-                anchor_x = anchor["x"]
-                anchor_y = anchor["y"]
+        # Collect all anchors (used first, then unused)
+        all_anchors = AnchorObservations(map_codes)
+        for anchor_mac, used, rssi, anchor_x, anchor_y, anchor_map_id, cart_d, signal_quality in message.anchors():
+            if rssi is None:
+                rssi = ""  # Missing RSSI
+            if not used:
+                distance = cart_d  # Distance already calculated
+            elif anchor_x is not None and anchor_y is not None:
+                # Batched rows get their distances computed for the whole batch at once
+                distance = None if batching else calculate_distance(tag_x, tag_y, anchor_x, anchor_y)
             else:
-                # Use cart_d if available, otherwise 0
-                distance = anchor.get("cart_d", 0)
-                anchor_x = 0
-                anchor_y = 0
-                
-            all_anchors[anchor_mac] = {
-                "rssi": anchor["rssi"],
-                "used": 1,
-                "x": anchor_x,
-                "y": anchor_y, 
-                "map_id": anchor["map_id"],
-                "distance": distance,
-                "signal_quality": anchor.get("signal_quality", "")
-            }
-            
-        # Process unused anchors
-        for anchor in pos.get("unused_anchors", []):
-            anchor_mac = anchor["mac"]
-            distance = anchor.get("cart_d", 0)  # Distance already calculated
-            all_anchors[anchor_mac] = {
-                "rssi": anchor["rssi"],
-                "used": 0,
-                "x": anchor.get("x", 0),
-                "y": anchor.get("y", 0),
-                "map_id": anchor["map_id"], 
-                "distance": distance,
-                "signal_quality": ""
-            }
+                # Some used anchors may not have x,y coordinates: use cart_d if available, otherwise 0
+                distance = cart_d
+            all_anchors.add(anchor_mac, rssi, used, anchor_x if anchor_x is not None else 0,
+                            anchor_y if anchor_y is not None else 0, anchor_map_id, distance, signal_quality)
         
-        # Calculate per-map statistics
-        map_stats = {}
-        for mid in MAP_IDS:
-            anchors_for_map = [a for a in all_anchors.values() if a["map_id"] == mid]
-            
-            if anchors_for_map:
-                rssi_values = [a["rssi"] for a in anchors_for_map]
-                map_stats[mid] = {
-                    "total_anchors": len(anchors_for_map),
-                    "anchors_used": sum(1 for a in anchors_for_map if a["used"] == 1),
-                    "anchors_hearing": len(anchors_for_map),
-                    "avg_rssi": mean(rssi_values),
-                    "max_rssi": max(rssi_values),
-                    "min_rssi": min(rssi_values),
-                    "rssi_std": stdev(rssi_values) if len(rssi_values) > 1 else 0,
-                    "rssi_range": max(rssi_values) - min(rssi_values)
-                }
-            else:
-                map_stats[mid] = {
-                    "total_anchors": 0,
-                    "anchors_used": 0, 
-                    "anchors_hearing": 0,
-                    "avg_rssi": "",
-                    "max_rssi": "",
-                    "min_rssi": "",
-                    "rssi_std": "",
-                    "rssi_range": ""
-                }
+        if device_inventory is not None:
+            device_inventory.note_heard(tag_mac, all_anchors.macs())
         
-        # Build CSV row
-        row = [
+        base = [
             map_id, timestamp, tag_x, tag_y,
             cov_xx, cov_xy, cov_yx, cov_yy, true_map_id
         ]
         
-        # Add per-map statistics
-        for mid in MAP_IDS:
-            stats = map_stats[mid]
-            row.extend([
-                stats["total_anchors"],
-                stats["anchors_used"],
-                stats["anchors_hearing"], 
-                stats["avg_rssi"],
-                stats["max_rssi"],
-                stats["min_rssi"],
-                stats["rssi_std"],
-                stats["rssi_range"]
-            ])
-        
-        # Add per-anchor data (in sorted order)
-        for anchor_mac in sorted(anchor_macs):
-            if anchor_mac in all_anchors:
-                anchor = all_anchors[anchor_mac]
-                row.extend([
-                    anchor["rssi"],
-                    anchor["used"],
-                    anchor["x"],
-                    anchor["y"],
-                    anchor["map_id"],
-                    anchor["distance"],
-                    anchor["signal_quality"]
-                ])
+        if batching:
+            # Statistics, distances and row assembly are done for the whole batch with NumPy
+            observe_stage("features", started)
+            row_batcher.queue(tag_mac, base, all_anchors, anchor_macs)
+        else:
+            # Calculate per-map statistics in a single pass over the heard anchors
+            map_stats = all_anchors.map_stats(MAP_IDS)
+            features_done = observe_stage("features", started)
+            
+            if sparse_sink is not None:
+                # Sparse long format: one position row plus one row per heard anchor
+                sparse_sink.write_position(tag_mac, base, {mid: map_stats[mid].values() for mid in MAP_IDS}, all_anchors)
+                observe_stage("write", features_done)
             else:
-                # Empty values for anchors not present
-                row.extend(["", 0, "", "", "", "", ""])
-        
-        # Write to appropriate CSV file
-        csv_writers[tag_mac].writerow(row)
-        csv_files[tag_mac].flush()  # Ensure data is written
+                write_wide_row(tag_mac, base, map_stats, all_anchors, anchor_macs)
         
         # Debug output for first few messages of each tag
         if tag_message_counts[tag_mac] <= 3:
@@ -380,19 +351,17 @@ def process_position_message(position_data: Dict[str, Any], anchor_macs: Set[str
         import traceback
         traceback.print_exc()
 
-def make_api_request():
-    """Make the API POST request to trigger tag broadcasting"""
-    try:
-        response = requests.post(url, headers=headers, json=payload, verify=False)
-        print(f"🔄 API Request - Status: {response.status_code}")
-        if response.status_code == 201:
-            print("✅ API Request successful - Tags should start broadcasting")
-        else:
-            print(f"⚠️  API Response: {response.text}")
-        return response.status_code == 201
-    except requests.exceptions.RequestException as e:
-        print(f"❌ API Request failed: {e}")
-        return False
+def start_trigger_scheduler():
+    """Send the broadcast trigger off the MQTT thread, per tag liveness or every API_TRIGGER_INTERVAL seconds"""
+    global trigger_scheduler, tag_liveness
+    if API_TRIGGER_MODE == "liveness":
+        tag_liveness = TagLiveness(payload["devices"], payload["timeout"], lead=TRIGGER_LEAD, quiet_after=TRIGGER_QUIET_AFTER)
+    trigger_scheduler = TriggerScheduler([url], headers, payload, interval=API_TRIGGER_INTERVAL, liveness=tag_liveness)
+    trigger_scheduler.start()
+
+def stop_trigger_scheduler():
+    if trigger_scheduler is not None:
+        trigger_scheduler.stop()
 
 def on_connect(client, userdata, flags, rc, properties=None):
     print("🔌 on_connect rc =", rc)
@@ -404,17 +373,100 @@ def on_connect(client, userdata, flags, rc, properties=None):
 def on_subscribe(client, userdata, mid, granted_qos, properties=None):
     print("✅ Subscribed, waiting for messages…")
 
-def on_message(client, userdata, msg):
+def handle_payload(raw_payload: bytes, anchor_macs: Set[str]):
+    """Decode one raw MQTT payload and process it"""
     try:
-        payload = msg.payload.decode("utf-8", errors="replace")
-        position_data = json.loads(payload)
-        process_position_message(position_data, userdata["anchor_macs"])
+        started = time.perf_counter()
+        message = decode_position(raw_payload)  # Fastest available JSON backend, straight from bytes
+        observe_stage("decode", started)
+        if recent_positions is not None and recent_positions.seen(message.key()):
+            return  # Delivered before, must not count against MAX_LINES twice
+        process_position_message(message, anchor_macs)
     except (json.JSONDecodeError, KeyError) as e:
         print(f"❌ Error parsing message: {e}")
+        if metrics is not None:
+            metrics.count("parse_errors")
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
 
-def print_periodic_stats():
+def on_message(client, userdata, msg):
+    if capture_writer is not None:
+        capture_writer.write(msg.topic, msg.payload)
+        
+    pipeline = userdata.get("pipeline")
+    if pipeline is not None:
+        # Queued mode: only hand the raw bytes over, the workers do the rest
+        pipeline.submit(msg.payload)
+    else:
+        handle_payload(msg.payload, userdata["anchor_macs"])
+
+def start_ingestion_pipeline(anchor_macs: Set[str]):
+    """Start the worker pool when INGESTION_MODE is "queued", otherwise return None"""
+    if INGESTION_MODE != "queued":
+        return None
+    pipeline = IngestionPipeline(lambda raw_payload: handle_payload(raw_payload, anchor_macs),
+                                 workers=INGESTION_WORKERS, queue_size=INGESTION_QUEUE_SIZE,
+                                 policy=BACKPRESSURE_POLICY)
+    pipeline.start()
+    print(f"🧵 Queued ingestion: {INGESTION_WORKERS} workers, queue size {INGESTION_QUEUE_SIZE}, policy {BACKPRESSURE_POLICY}")
+    return pipeline
+
+def start_capture():
+    """Open the raw capture log when CAPTURE_DIR is set"""
+    global capture_writer
+    
+    if CAPTURE_DIR:
+        capture_writer = CaptureWriter(CAPTURE_DIR)
+        print(f"📼 Capturing raw payloads to {CAPTURE_DIR}/")
+
+def start_metrics(pipeline=None):
+    """Create the stage metrics, register the readouts and start the local /metrics endpoint"""
+    global metrics, metrics_server
+    if not METRICS_ENABLED:
+        return
+    json_path = None
+    if METRICS_JSON_FILE:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        json_path = os.path.join(OUTPUT_DIR, METRICS_JSON_FILE)
+    metrics = PipelineMetrics(json_path=json_path, json_interval=METRICS_JSON_INTERVAL)
+    metrics.register("messages", lambda: message_count, "counter", "Position messages processed")
+    metrics.describe("parse_errors", "Payloads that failed to decode or lacked required fields")
+    metrics.register("bytes_written", lambda: buffer_totals(csv_writers)["bytes_on_disk"], "counter",
+                     "Bytes written by the data writers this session")
+    metrics.register("rows_buffered", lambda: buffer_totals(csv_writers)["rows_buffered"], "gauge",
+                     "Rows waiting in the writer buffers")
+    if pipeline is not None:
+        metrics.register("queue_depth", pipeline.depth, "gauge", "Payloads waiting in the ingestion queues")
+        metrics.register("dropped", lambda: pipeline.dropped_oldest + pipeline.dropped_newest, "counter",
+                         "Payloads dropped by the backpressure policy")
+        metrics.register("ingestion_errors", lambda: pipeline.errors, "counter", "Payloads that raised in a worker")
+    if recent_positions is not None:
+        metrics.register("duplicates_dropped", lambda: recent_positions.duplicates, "counter",
+                         "Positions dropped as repeated deliveries")
+    if METRICS_PORT is not None:
+        try:
+            metrics_server = MetricsServer(metrics, METRICS_PORT).start()
+            print(f"📈 Metrics at http://127.0.0.1:{metrics_server.port}/metrics")
+        except OSError as e:
+            print(f"⚠️ Could not start the metrics endpoint on port {METRICS_PORT}: {e}")
+
+def stop_metrics():
+    """Write the final JSON dump and stop the endpoint"""
+    global metrics_server
+    if metrics is not None:
+        metrics.dump_json()
+    if metrics_server is not None:
+        metrics_server.stop()
+        metrics_server = None
+
+def stop_ingestion_pipeline(pipeline):
+    """Process whatever is still queued, then stop the workers"""
+    if pipeline is not None:
+        print(f"🧵 Draining ingestion queue ({pipeline.depth()} payloads)...")
+        pipeline.stop(drain=True)
+        pipeline.print_stats()
+
+def print_periodic_stats(pipeline=None):
     """Print detailed statistics every few minutes"""
     global last_stats_print
     
@@ -453,25 +505,45 @@ def print_periodic_stats():
             if least_active_tags:
                 print(f"Top 5 least active tags: {', '.join([f'{tag[:6]}:{count}' for tag, count in least_active_tags])}")
         
-        # File size check
-        try:
-            total_size = 0
-            for tag_mac in csv_files.keys():
-                filepath = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
-                if os.path.exists(filepath):
-                    size = os.path.getsize(filepath)
-                    total_size += size
-            
-            total_size_mb = total_size / (1024 * 1024)
-            print(f"Total data written: {total_size_mb:.1f} MB")
-        except Exception as e:
-            print(f"Could not calculate file sizes: {e}")
+        # Data written, from the writers' own counters instead of stat-ing every file
+        totals = buffer_totals(csv_writers)
+        print(f"Data written this session: {totals['bytes_on_disk'] / (1024 * 1024):.1f} MB")
+        print(f"Rows on disk: {totals['rows_on_disk']} | Rows buffered: {totals['rows_buffered']} ({totals['bytes_buffered'] / 1024:.1f} KB)")
     
+    if pipeline is not None:
+        pipeline.print_stats()
+    if metrics is not None:
+        metrics.print_stats()
+    if trigger_scheduler is not None:
+        trigger_scheduler.print_stats()
+    if recent_positions is not None:
+        print(f"Duplicate filter: {recent_positions.summary()}")
+        
+    if device_inventory is not None:
+        device_inventory.print_reconciliation()
+        
+    # Persist flushed row counts so a restart does not have to count lines
+    if manifest is not None:
+        manifest.save(csv_writers)
+    elif sparse_sink is not None:
+        sparse_sink.save()
+        
     print(f"{'='*60}\n")
     last_stats_print = current_time
 
 def cleanup_files():
-    """Close all CSV files"""
+    """Flush buffered rows and close all CSV files"""
+    if row_batcher is not None:
+        row_batcher.flush(force=True)
+    totals = buffer_totals(csv_writers)
+    flush_all(csv_writers, sync=True)
+    stop_metrics()
+    if manifest is not None:
+        manifest.save(csv_writers)
+    elif sparse_sink is not None:
+        sparse_sink.save()
+    if capture_writer is not None:
+        capture_writer.close()
     for file_handle in csv_files.values():
         file_handle.close()
     
@@ -481,15 +553,22 @@ def cleanup_files():
     print(f"{'='*60}")
     print(f"Total messages processed: {message_count}")
     print(f"CSV files closed: {len(csv_files)}")
+    print(f"Buffered rows flushed on close: {totals['rows_buffered']}")
+    if device_inventory is not None:
+        device_inventory.print_reconciliation()
     
     # Count lines in each file
     try:
         total_lines = 0
         for tag_mac in csv_files.keys():
             filepath = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
-            if os.path.exists(filepath):
+            lines = None
+            if manifest is not None and tag_mac in manifest.entries:
+                lines = manifest.entries[tag_mac]["rows"]  # Saved above, no need to re-read the file
+            elif os.path.exists(filepath):
                 with open(filepath, 'r') as f:
                     lines = sum(1 for _ in f) - 1  # Subtract header
+            if lines is not None:
                 total_lines += lines
                 if lines > 0:
                     print(f"  {tag_mac}.csv: {lines} data rows")
@@ -500,59 +579,87 @@ def cleanup_files():
     
     print(f"{'='*60}")
 
+def replay_runner(capture_dir: str, speed: float = None) -> int:
+    """Rebuild the CSVs from a raw capture log instead of live MQTT (see mqtt_capture.py)"""
+    global device_inventory, recent_positions
+    
+    print(f"📼 Replaying {capture_dir} into ML data generation...")
+    
+    device_inventory = load_inventory()
+    anchor_macs = get_all_anchor_macs()
+    print(f"📡 Found {len(anchor_macs)} anchor MACs from existing data")
+    setup_csv_files(anchor_macs)
+    
+    # Captures keep every delivery, duplicates included
+    recent_positions = RecentKeyIndex(DEDUP_CAPACITY, DEDUP_WINDOW)
+    
+    # Inline processing keeps replays lossless and deterministic
+    count = replay(capture_dir, lambda topic, payload: handle_payload(payload, anchor_macs), speed)
+    cleanup_files()
+    return count
+
 def runner():
-    global start_time
+    global start_time, device_inventory, recent_positions
     
     print("🚀 Starting ML data generation...")
     
-    # Get anchor MACs from existing data
+    # Get anchor MACs from existing data (or the device inventory for a new dataset)
+    device_inventory = load_inventory()
     anchor_macs = get_all_anchor_macs()
     print(f"📡 Found {len(anchor_macs)} anchor MACs from existing data")
     
     # Setup CSV files
     setup_csv_files(anchor_macs)
     
-    # Track when we last made an API request
-    last_api_request = 0
-    api_interval = 100  # Make API request every 100 seconds
+    # Drop repeated deliveries before any feature extraction
+    recent_positions = RecentKeyIndex(DEDUP_CAPACITY, DEDUP_WINDOW)
+    
+    # Start ingestion workers (queued mode only)
+    pipeline = start_ingestion_pipeline(anchor_macs)
+    start_capture()
+    start_metrics(pipeline)
     
     client = mqtt.Client(protocol=mqtt.MQTTv311)
     client.enable_logger()
     client.on_connect = on_connect
     client.on_subscribe = on_subscribe
     client.on_message = on_message
-    client.user_data_set({"anchor_macs": anchor_macs})
+    client.user_data_set({"anchor_macs": anchor_macs, "pipeline": pipeline})
     
     try:
-        # Make initial API request
-        print("🚀 Making initial API request...")
-        make_api_request()
-        last_api_request = time.time()
+        # Broadcast triggers run on their own thread so a slow API never stalls the MQTT loop
+        print("🚀 Starting API trigger scheduler...")
+        start_trigger_scheduler()
         
         # Connect to MQTT
         client.connect(BROKER_HOST, BROKER_PORT, keepalive=60)
         
-        # Start the loop with periodic API requests
-        print("🔄 Starting MQTT loop with periodic API requests...")
+        # Start the loop
+        print("🔄 Starting MQTT loop (API requests run in the background)...")
         while True:
             current_time = time.time()
             
-            # Check if we need to make another API request
-            if current_time - last_api_request >= api_interval:
-                print(f"⏰ {api_interval}s elapsed, making another API request...")
-                make_api_request()
-                last_api_request = current_time
-            
             # Print periodic stats every 5 minutes
             if current_time - last_stats_print >= 300:  # 5 minutes
-                print_periodic_stats()
+                print_periodic_stats(pipeline)
             
             # Process MQTT messages for a short time
             client.loop(timeout=1.0)
             
+            # Flush tags whose buffered rows have waited past FLUSH_POLICY.max_interval
+            if row_batcher is not None:
+                row_batcher.flush()
+            started = time.perf_counter()
+            if flush_due(csv_writers):
+                observe_stage("flush", started)
+            if metrics is not None:
+                metrics.dump_due()
+            
     except KeyboardInterrupt:
         print("\n🛑 Stopping...")
+        stop_trigger_scheduler()
         client.disconnect()
+        stop_ingestion_pipeline(pipeline)
         cleanup_files()
         
         # Print final stats
@@ -563,7 +670,9 @@ def runner():
         
     except Exception as e:
         print(f"❌ Connection error: {e}")
+        stop_trigger_scheduler()
         client.disconnect()
+        stop_ingestion_pipeline(pipeline)
         cleanup_files()
 
 if __name__ == "__main__":
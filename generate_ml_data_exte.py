@@ -8,19 +8,75 @@ Includes detailed per-anchor information and appends to existing files
 
 from typing import Dict, Any, List, Set
 import logging, paho.mqtt.client as mqtt
-import time, requests, json, csv, os, math
-from statistics import mean, stdev, median
+import time, json, csv, os, math, threading
+from statistics import median
 import pandas as pd
 import sys
 
+from row_layout import RowLayout
+from batch_features import BatchedRowWriter
+from rssi_stats import MapStats
+from anchor_observations import AnchorObservations, MapCodes
+from sparse_output import SparseSink
+from csv_manifest import CSVManifest
+from device_inventory import load_inventory, header_anchor_macs
+from parquet_sink import open_parquet_writers, existing_row_count
+from position_decoder import PositionMessage, decode_position
+from ingestion import IngestionPipeline, DROP_OLDEST, extract_tag_mac
+from mqtt_capture import CaptureWriter, replay
+from recent_keys import RecentKeyIndex, raw_position_key
+from anchor_registry import AnchorRegistry
+from trigger_scheduler import TriggerScheduler, TagLiveness
+from adv_rate_controller import AdvRateController
+from tag_sampling import TagSample, stratum_key, scan_strata, compact_csv, load_sampling_state, save_sampling_state
+from pipeline_metrics import PipelineMetrics, MetricsServer
+from tag_registry import TAGS
+from buffered_csv import BufferedCSVWriter, FlushPolicy, flush_due, flush_all, buffer_totals, install_signal_flush
+
 #csv config
 MAX_LINES: int = 8500
 
+# What happens once a tag holds MAX_LINES rows (wide CSV only, see tag_sampling.py): "truncate" stops writing it,
+# "reservoir" keeps a uniform sample of everything seen, "stratified" evens rows out over grid cells and floor correctness
+SAMPLING_MODE = "truncate"
+SAMPLING_CELL_SIZE = 5.0  # Stratum grid cell size in metres
+SAMPLING_COMPACT_EVERY = 500  # Rewrite a tag's CSV once this many of its rows have been replaced
+
+# CSV write batching: each tag's rows are flushed every 200 rows, 256 KB or 5 s (set fsync_interval for durability)
+FLUSH_POLICY = FlushPolicy(max_rows=200, max_bytes=256 * 1024, max_interval=5.0, fsync_interval=None)
+
+# Feature extraction: >0 collects this many positions and builds their rows at once with NumPy (see batch_features.py), 0 builds each row as it arrives; the rows are identical either way
+FEATURE_BATCH_SIZE = 256
+FEATURE_BATCH_MAX_DELAY = 0.5  # Seconds a partial batch may wait before it is written
+
+# Ingestion: "inline" processes on the MQTT network thread, "queued" hands raw payloads to worker threads
+INGESTION_MODE = "inline"
+INGESTION_WORKERS = 4  # Partitioned by tag MAC so each tag's rows stay in order
+INGESTION_QUEUE_SIZE = 10000  # Total queued payloads across all workers
+BACKPRESSURE_POLICY = DROP_OLDEST  # block, drop-oldest or drop-newest when the queue is full
+
+# Raw capture: set to a directory to also append every received payload to a replayable log (see mqtt_capture.py)
+CAPTURE_DIR = None
+
+# Metrics: per-stage latency histograms, queue depth, drops and bytes written (see pipeline_metrics.py)
+METRICS_ENABLED = True
+METRICS_PORT = 9109  # Prometheus text at http://127.0.0.1:<port>/metrics, None disables the endpoint
+METRICS_JSON_FILE = "metrics.json"  # Rewritten in OUTPUT_DIR every METRICS_JSON_INTERVAL seconds, None disables
+METRICS_JSON_INTERVAL = 60.0
+
 # Configuration - Updated for SSH tunnels
 BROKER_HOST = ""  # MQTT broker address (redacted)
 BROKER_PORTS = [0]  # MQTT broker ports (redacted)
+BROKER_MODE = "single"  # "single": first reachable port, "multi": subscribe on every active port at once
+DEDUP_CAPACITY = 20000  # Recent (tag MAC, timestamp, map ID) keys remembered to drop repeated deliveries (cross-broker, QoS retries, duplicate engines)
+DEDUP_WINDOW = 120.0  # Seconds a key is remembered after it was last received
 TOPIC = "engine/+/positions"
 OUTPUT_DIR = "ml_training_data_exte_new"
+OUTPUT_FORMAT = "wide"  # "wide": one CSV row per position, "sparse": long format (see sparse_output.py), "parquet": typed columns (see parquet_sink.py)
+SPARSE_OUTPUT_DIR = "ml_training_data_exte_sparse"
+PARQUET_OUTPUT_DIR = "ml_training_data_exte_parquet"  # <tag>/part-<session>.parquet
+PARQUET_POLICY = FlushPolicy(max_rows=256, max_interval=60.0)  # Row group size and max wait for Parquet rows
+ANCHOR_REGISTRY_FILE = "anchor_registry.json"  # Persisted anchor positions, see anchor_registry.py
 
 # API configuration - Use working tunneled endpoint
 API_URLS = [
@@ -30,16 +86,20 @@ headers = {
     "accept": "application/json",
     "Content-Type": "application/json"
 }
+API_TRIGGER_INTERVAL = 100.0  # Seconds between broadcast triggers (sent from a background thread)
+# "liveness": trigger each tag shortly before its broadcast timeout, or sooner when it went silent; "interval": all tags every API_TRIGGER_INTERVAL
+API_TRIGGER_MODE = "liveness"
+TRIGGER_LEAD = 10.0  # Seconds before a tag's broadcast times out that it is re-triggered
+TRIGGER_QUIET_AFTER = 30.0  # Re-trigger a tag silent this long after its trigger (doubles while it stays silent)
+# Per-tag adv_interval so all tags reach MAX_LINES together (see adv_rate_controller.py); the payload's value is the default.
+# Off until the tags are confirmed to accept an interval below 20 ms: without one it cannot speed weak tags up (the total
+# time stays that of the slowest tag at 20 ms) and every trigger becomes one API request per interval
+ADV_RATE_CONTROL = False
+ADV_INTERVAL_CHOICES = (20, 40, 80, 160)  # Allowed adv_interval values; add faster ones only if the tags support them
+API_MAX_FAILURES = 5  # Stop triggering after this many consecutive failed rounds
 
 # Use the same 60 tags as in ml_training_data_new
-TAG_MAC_LIST: List[str] = [
-    'f8c6e10eb94d', 'e80511ee6f95', 'ebc3d8c27268', 'ea130331a7d6', 'e5618db03315', 'f53d908ae87e', 'faebae16f304', 'dcb814adee27', 'ee1ae8c0199b', 'e71ebc086c12', 'dc6fd1014985', 
-    'e0187539099c', 'ed3dc76b5057', 'cfcba5a4aa8c', 'd2433d346da0', 'c3fdcfc7cde7', 'fbde6b71de2c', 'eed4934cb925', 'd55a17359cec', 'dd35e8065e41', 'de8a7eb407c5', 'c694e5297d8c', 
-    'f7fb6d248542', 'f1465d4b34ad', 'c5d89d98d531', 'e3c858bb535e', 'e12a0889fc9d', 'f17508753dd2', 'eacbbb80d2ae', 'd908a64ff5c8', 'e0179d3286a1', 'ca70faad5185', 'eaf519e486b7', 
-    'f260a59af3be', 'd1162b91f43c', 'c0c28a5250d1', 'e45428cd811f', 'f9cf5a96910d', 'e1221fc96df8', 'db87600e1088', 'ea0efa76b1d7', 'e75675d44213', 'cfa33b8f966f', 'e6a1121bd9ba', 
-    'c61444ecfa21', 'cbafa76ff612', 'eabf49388a88', 'e6dee509ceb7', 'd31e40a36148', 'fe916ad112d4', 'dbd8f214e90c', 'f8e68ad462b8', 'ced95ba5af64', 'c07f2aebbfb2', 'dbdfe63c5bfe', 
-    'eb7dd4251a0b', 'e9ee05861174', 'c48718b206de', 'dfe232164c0a', 'ccd6b409ba05'
-]
+TAG_MAC_LIST: List[str] = list(TAGS.macs)  # Every registered tag (see tag_registry.py)
 
 payload: Dict[str, Any] = {
     "devices": TAG_MAC_LIST,
@@ -58,74 +118,11 @@ payload: Dict[str, Any] = {
 }
 
 # TAG_MAC_TO_MAP_ID for determining true_map_id
-TAG_MAC_TO_MAP_ID: Dict[str, str] = {
-    # Downstairs tags (map_id: 682c66de8cde618ce1270230)
-    'f260a59af3be': '682c66de8cde618ce1270230',  # 62398
-    'e45428cd811f': '682c66de8cde618ce1270230',  # 33055
-    'eaf519e486b7': '682c66de8cde618ce1270230',  # 34487
-    'e71ebc086c12': '682c66de8cde618ce1270230',  # 27666
-    'db87600e1088': '682c66de8cde618ce1270230',  # 4232
-    'e75675d44213': '682c66de8cde618ce1270230',  # 16915
-    'ea0efa76b1d7': '682c66de8cde618ce1270230',  # 45527
-    'e3c858bb535e': '682c66de8cde618ce1270230',  # 21342
-    'f9cf5a96910d': '682c66de8cde618ce1270230',  # 37133
-    'e9ee05861174': '682c66de8cde618ce1270230',  # 4468
-    'c5d89d98d531': '682c66de8cde618ce1270230',  # 54577
-    'f17508753dd2': '682c66de8cde618ce1270230',  # 15826
-    'ccd6b409ba05': '682c66de8cde618ce1270230',  # 47621
-    'cfcba5a4aa8c': '682c66de8cde618ce1270230',  # 43660
-    'dfe232164c0a': '682c66de8cde618ce1270230',  # 19466
-    'ea130331a7d6': '682c66de8cde618ce1270230',  # 42966
-    'fe916ad112d4': '682c66de8cde618ce1270230',  # 4820
-    'cbafa76ff612': '682c66de8cde618ce1270230',  # 62994
-    'd31e40a36148': '682c66de8cde618ce1270230',  # 24904
-    'ed3dc76b5057': '682c66de8cde618ce1270230',  # 20567
-    'f7fb6d248542': '682c66de8cde618ce1270230',  # 34114
-    'e5618db03315': '682c66de8cde618ce1270230',  # 13077
-    'c48718b206de': '682c66de8cde618ce1270230',  # 1758
-    'ced95ba5af64': '682c66de8cde618ce1270230',  # 44900
-    'e80511ee6f95': '682c66de8cde618ce1270230',  # 28565
-    'f8e68ad462b8': '682c66de8cde618ce1270230',  # 25272
-    'c07f2aebbfb2': '682c66de8cde618ce1270230',  # 49074
-    'dc6fd1014985': '682c66de8cde618ce1270230',  # 18821
-    'dbdfe63c5bfe': '682c66de8cde618ce1270230',  # 23550
-    'f53d908ae87e': '682c66de8cde618ce1270230',  # 59518
-    
-    # Mezzanine tags (map_id: 682c66f08cde618ce127025e)
-    'eacbbb80d2ae': '682c66f08cde618ce127025e',  # 53934
-    'd55a17359cec': '682c66f08cde618ce127025e',  # 40172
-    'c3fdcfc7cde7': '682c66f08cde618ce127025e',  # 52711
-    'dd35e8065e41': '682c66f08cde618ce127025e',  # 24129
-    'f1465d4b34ad': '682c66f08cde618ce127025e',  # 13485
-    'd2433d346da0': '682c66f08cde618ce127025e',  # 28064
-    'de8a7eb407c5': '682c66f08cde618ce127025e',  # 1989
-    'fbde6b71de2c': '682c66f08cde618ce127025e',  # 56876
-    'eed4934cb925': '682c66f08cde618ce127025e',  # 47397
-    'c694e5297d8c': '682c66f08cde618ce127025e',  # 32140
-    'dcb814adee27': '682c66f08cde618ce127025e',  # 60967
-    'ee1ae8c0199b': '682c66f08cde618ce127025e',  # 6555
-    'e12a0889fc9d': '682c66f08cde618ce127025e',  # 64669
-    'ca70faad5185': '682c66f08cde618ce127025e',  # 20869
-    'e1221fc96df8': '682c66f08cde618ce127025e',  # 28152
-    'eabf49388a88': '682c66f08cde618ce127025e',  # 35464
-    'faebae16f304': '682c66f08cde618ce127025e',  # 62212
-    'e6a1121bd9ba': '682c66f08cde618ce127025e',  # 55738
-    'ebc3d8c27268': '682c66f08cde618ce127025e',  # 29288
-    'c0c28a5250d1': '682c66f08cde618ce127025e',  # 20689
-    'eb7dd4251a0b': '682c66f08cde618ce127025e',  # 6667
-    'dbd8f214e90c': '682c66f08cde618ce127025e',  # 59660
-    'f8c6e10eb94d': '682c66f08cde618ce127025e',  # 47437
-    'c61444ecfa21': '682c66f08cde618ce127025e',  # 64033
-    'e6dee509ceb7': '682c66f08cde618ce127025e',  # 52919
-    'e0187539099c': '682c66f08cde618ce127025e',  # 2460
-    'cfa33b8f966f': '682c66f08cde618ce127025e',  # 38511
-    'd1162b91f43c': '682c66f08cde618ce127025e',  # 62524
-    'd908a64ff5c8': '682c66f08cde618ce127025e',  # 62920
-    'e0179d3286a1': '682c66f08cde618ce127025e'   # 34465
-}
+TAG_MAC_TO_MAP_ID: Dict[str, str] = TAGS.mac_to_map_id()
 
 # Map IDs
-MAP_IDS = ["682c66de8cde618ce1270230", "682c66f08cde618ce127025e"]
+MAP_IDS = list(TAGS.map_ids)
+map_codes = MapCodes(MAP_IDS)  # Map ID <-> small integer code for every AnchorObservations
 
 # Global variables
 start_time = time.time()
@@ -133,7 +130,26 @@ message_count = 0
 csv_writers = {}
 csv_files = {}
 tag_message_counts = {}  # Track messages per tag
+counter_lock = threading.Lock()  # Guards message_count when ingestion workers run concurrently
+row_layout = None  # Compiled column layout, built in setup_csv_files
+sparse_sink = None  # SparseSink when OUTPUT_FORMAT is "sparse"
+manifest = None  # CSVManifest of the wide CSV files (row counts without re-reading them)
+capture_writer = None  # CaptureWriter when CAPTURE_DIR is set
+row_batcher = None  # BatchedRowWriter for the wide files when FEATURE_BATCH_SIZE > 0, created in setup_csv_files
+device_inventory = None  # DeviceInventory from the S00695 device lists, loaded at startup
+anchor_registry = None  # AnchorRegistry backing ANCHOR_DATABASE, loaded in load_anchors
+row_layout_anchor_macs = None  # Anchor set row_layout was compiled from
+row_layout_registry_version = None  # anchor_registry.version row_layout's default coordinates came from
 last_stats_print = time.time()
+recent_positions = None  # RecentKeyIndex dropping repeated deliveries, created in runner
+broker_message_counts = {}  # Payloads received per broker port
+trigger_scheduler = None  # TriggerScheduler sending the broadcast trigger, started in runner
+metrics = None  # PipelineMetrics when METRICS_ENABLED, started in runner
+metrics_server = None  # MetricsServer behind METRICS_PORT
+tag_liveness = None  # TagLiveness fed by incoming positions in "liveness" trigger mode
+adv_controller = None  # AdvRateController choosing per-tag adv_interval when ADV_RATE_CONTROL is set
+tag_samples = {}  # TagSample per tag when SAMPLING_MODE is not "truncate"
+skipped_payloads = 0  # Payloads dropped before decoding (untracked, capped or not sampled)
 
 # Global anchor database
 ANCHOR_DATABASE: Dict[str, Dict[str, Any]] = {}
@@ -249,37 +265,20 @@ def build_anchor_database() -> Dict[str, Dict[str, Any]]:
     return anchor_db
 
 def get_all_anchor_macs() -> Set[str]:
-    """Get all unique anchor MACs from the existing CSV files in ml_training_data_exte_new/"""
-    anchor_macs = set()
-    
-    # Read from existing files in ml_training_data_exte_new to get comprehensive anchor list
-    import glob
-    exte_csv_files = glob.glob(f"{OUTPUT_DIR}/*.csv")
+    """Anchor columns: those of the existing files in ml_training_data_exte_new/, otherwise inventory + registry anchors"""
+    anchor_macs = header_anchor_macs(OUTPUT_DIR)
+    inventory_macs = device_inventory.anchor_macs if device_inventory is not None else set()
     
-    if not exte_csv_files:
-        print("❌ No CSV files found in ml_training_data_exte_new/ directory")
+    if anchor_macs is not None:
+        # Appended rows must keep the columns of the files already on disk
+        print(f"📡 Found {len(anchor_macs)} anchor MACs in the header of the existing extended files")
+        missing = inventory_macs - anchor_macs
+        if missing:
+            print(f"⚠️  {len(missing)} inventory anchors have no columns yet (use a new OUTPUT_DIR to include them)")
         return anchor_macs
     
-    print(f"📡 Scanning {len(exte_csv_files)} files in ml_training_data_exte_new/ for anchor MACs...")
-    
-    # Read headers from existing files to get all possible anchor MACs
-    for csv_file in exte_csv_files[:5]:  # Sample first 5 files to get anchor list
-        try:
-            with open(csv_file, 'r') as f:
-                header = f.readline().strip().split(',')
-                
-            # Extract anchor MACs from column names (columns ending with _rssi)
-            for col in header:
-                if col.endswith('_rssi'):
-                    anchor_mac = col[:-5]  # Remove '_rssi' suffix
-                    if len(anchor_mac) == 12:  # Valid MAC address length
-                        anchor_macs.add(anchor_mac)
-                        
-        except Exception as e:
-            print(f"Warning: Could not read {csv_file}: {e}")
-            continue
-    
-    print(f"📡 Found {len(anchor_macs)} unique anchor MACs from extended data format")
+    anchor_macs = inventory_macs | set(ANCHOR_DATABASE.keys())
+    print(f"📡 No existing files: {len(anchor_macs)} anchor MACs from the device inventory and anchor registry")
     return anchor_macs
 
 def generate_csv_header(anchor_macs: Set[str]) -> List[str]:
@@ -316,43 +315,98 @@ def generate_csv_header(anchor_macs: Set[str]) -> List[str]:
     
     return header
 
+def compile_row_layout(anchor_macs: Set[str]) -> RowLayout:
+    """Compile the column layout once, prefilling absent anchors with ANCHOR_DATABASE positions"""
+    return RowLayout(generate_csv_header(anchor_macs), MAP_IDS, anchor_database=ANCHOR_DATABASE)
+
+def get_row_layout(anchor_macs: Set[str]) -> RowLayout:
+    """Return the compiled layout, recompiling only if the anchor set changed or the registry added/moved an anchor"""
+    global row_layout, row_layout_anchor_macs, row_layout_registry_version
+    
+    registry_version = anchor_registry.version if anchor_registry is not None else None
+    if (row_layout is None or row_layout_anchor_macs is not anchor_macs
+            or row_layout_registry_version != registry_version):
+        row_layout = compile_row_layout(anchor_macs)
+        row_layout_anchor_macs = anchor_macs
+        row_layout_registry_version = registry_version
+    return row_layout
+
+def setup_sparse_files():
+    """Initialize the sparse long-format files for each tag MAC"""
+    global sparse_sink
+    
+    sparse_sink = SparseSink(SPARSE_OUTPUT_DIR, MAP_IDS, FLUSH_POLICY)
+    tag_message_counts.update(sparse_sink.open(list(TAG_MAC_TO_MAP_ID.keys())))
+    csv_writers.update(sparse_sink.writers)
+    csv_files.update(sparse_sink.file_handles())
+    
+    print(f"✅ Sparse output: positions + per-anchor observations for {len(TAG_MAC_TO_MAP_ID)} tags")
+    print(f"📁 All files in {SPARSE_OUTPUT_DIR}/ (anchor coordinates in anchor_table.csv)")
+    
+    # Make sure buffered rows reach disk if we are interrupted or terminated
+    install_signal_flush(csv_writers)
+
+def setup_parquet_files(anchor_macs: Set[str]):
+    """Open a new Parquet part file per tag MAC with the wide column layout"""
+    header = get_row_layout(anchor_macs).header
+    writers, counts = open_parquet_writers(PARQUET_OUTPUT_DIR, list(TAG_MAC_TO_MAP_ID.keys()), header, PARQUET_POLICY)
+    csv_writers.update(writers)
+    csv_files.update(writers)  # Closing a Parquet writer writes the file footer
+    tag_message_counts.update(counts)
+    
+    existing_tags = sum(1 for count in counts.values() if count > 0)
+    print(f"✅ Parquet output: {len(header)} typed columns, row groups of {PARQUET_POLICY.max_rows} rows")
+    print(f"📁 All files in {PARQUET_OUTPUT_DIR}/<tag>/ ({existing_tags} tags with existing data)")
+    
+    # Make sure buffered rows reach disk if we are interrupted or terminated
+    install_signal_flush(csv_writers)
+
 def setup_csv_files(anchor_macs: Set[str]):
     """Initialize CSV files for each tag MAC"""
-    global csv_writers, csv_files, tag_message_counts
+    global csv_writers, csv_files, tag_message_counts, manifest, tag_samples, row_batcher
+    
+    manifest = None
+    row_batcher = None
+    tag_samples = {}
+    if SAMPLING_MODE != "truncate" and OUTPUT_FORMAT != "wide":
+        print(f"⚠️ SAMPLING_MODE {SAMPLING_MODE!r} needs the wide CSV format, truncating at MAX_LINES instead")
+    if OUTPUT_FORMAT == "sparse":
+        setup_sparse_files()
+        return
+    if FEATURE_BATCH_SIZE > 0:
+        row_batcher = BatchedRowWriter(csv_writers, MAP_IDS, get_row_layout, FEATURE_BATCH_SIZE, FEATURE_BATCH_MAX_DELAY,
+                                       after_row=after_wide_row, observe=observe_stage)
+    if OUTPUT_FORMAT == "parquet":
+        setup_parquet_files(anchor_macs)
+        return
     
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    header = generate_csv_header(anchor_macs)
+    header = get_row_layout(anchor_macs).header
     print(f"🔧 Extended CSV header has {len(header)} columns (matching old format)")
     
+    # Existing row counts come from the manifest; files are only rescanned if it is stale
+    manifest = CSVManifest(OUTPUT_DIR).load()
+    timestamp_column = header.index("position_timestamp")  # Flushed timestamps feed the manifest
+    
     for tag_mac in TAG_MAC_TO_MAP_ID.keys():
         filename = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
         
         # Check if file exists and is non-empty
-        file_exists = os.path.exists(filename)
-        write_header = True
-        existing_rows = 0
-        
-        if file_exists:
-            try:
-                with open(filename, 'r') as check_file:
-                    existing_rows = sum(1 for _ in check_file)
-                    write_header = existing_rows == 0  # Only write header if file is empty
-            except:
-                write_header = True  # If error reading, assume we need header
+        write_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
         
         # Open in append mode
         file_handle = open(filename, 'a', newline='')
-        writer = csv.writer(file_handle)
         
         # Only write header if file is new or empty
         if write_header:
-            writer.writerow(header)
+            csv.writer(file_handle).writerow(header)
+            file_handle.flush()
         
         csv_files[tag_mac] = file_handle
-        csv_writers[tag_mac] = writer
-        tag_message_counts[tag_mac] = existing_rows - 1 if existing_rows > 0 else 0  # Account for header
+        csv_writers[tag_mac] = BufferedCSVWriter(file_handle, FLUSH_POLICY, mark_column=timestamp_column)
+        tag_message_counts[tag_mac] = manifest.seed(tag_mac, filename, header)
         
     new_files = sum(1 for tag_mac in TAG_MAC_TO_MAP_ID.keys() 
                     if not os.path.exists(os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")) 
@@ -362,58 +416,120 @@ def setup_csv_files(anchor_macs: Set[str]):
     print(f"✅ Setup complete: {new_files} new CSV files, {existing_files} existing files (appending)")
     print(f"📁 All files in {OUTPUT_DIR}/")
     print(f"📋 Sample file names: {list(TAG_MAC_TO_MAP_ID.keys())[:3]}.csv, ...")
+    manifest.save(csv_writers)
+    if SAMPLING_MODE != "truncate":
+        setup_tag_samples()
+    
+    # Make sure buffered rows reach disk if we are interrupted or terminated
+    install_signal_flush(csv_writers)
+
+def setup_tag_samples():
+    """Restore each tag's sampling state, rescanning files whose saved state is stale"""
+    state = load_sampling_state(OUTPUT_DIR)
+    rescanned = 0
+    for tag_mac in TAG_MAC_TO_MAP_ID.keys():
+        filename = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
+        saved = state.get(tag_mac)
+        if saved and saved["bytes"] == os.path.getsize(filename) and saved["cell_size"] == SAMPLING_CELL_SIZE:
+            tag_samples[tag_mac] = TagSample(MAX_LINES, SAMPLING_MODE, saved["strata"], saved["seen"])
+            continue
+        row_strata = scan_strata(filename, SAMPLING_CELL_SIZE) if tag_message_counts[tag_mac] > 0 else []
+        rescanned += 1 if row_strata else 0
+        tag_samples[tag_mac] = TagSample(MAX_LINES, SAMPLING_MODE, row_strata)
+    print(f"🎲 {SAMPLING_MODE.capitalize()} sampling above {MAX_LINES} rows per tag ({rescanned} files rescanned)")
+
+def compact_tag(tag_mac: str):
+    """Drop a tag's replaced rows from its CSV and reopen the file for appending"""
+    sample = tag_samples[tag_mac]
+    writer = csv_writers[tag_mac]
+    filename = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
+    with writer.lock:
+        writer.flush()
+        writer.file_handle.close()
+        kept, first_timestamp, last_timestamp = compact_csv(filename, sample.tombstones)
+        writer.file_handle = csv_files[tag_mac] = open(filename, 'a', newline='')
+        sample.compacted()
+    if manifest is not None:
+        manifest.rebase(tag_mac, kept, writer, first_timestamp, last_timestamp)
 
-def process_position_message(position_data: Dict[str, Any], anchor_macs: Set[str]):
+def write_wide_row(tag_mac: str, base: List[Any], map_stats: Dict[str, MapStats],
+                   all_anchors: AnchorObservations, anchor_macs: Set[str]):
+    """Assemble the wide row for one position and write it to the tag's CSV or Parquet writer"""
+    started = time.perf_counter()
+    # Build CSV row from the prefilled template (absent anchors already hold database positions)
+    layout = get_row_layout(anchor_macs)
+    row = layout.new_row()
+    layout.set_base(row, base)
+    
+    # Add per-map statistics
+    for mid in MAP_IDS:
+        layout.set_map_stats(row, mid, map_stats[mid].values())
+        
+    # Scatter only the anchors heard in this message
+    all_anchors.scatter(row, layout.anchor_offsets)
+        
+    # Write to appropriate CSV file
+    assembled = observe_stage("assembly", started)
+    csv_writers[tag_mac].writerow(row)  # Buffered, flushed according to FLUSH_POLICY / PARQUET_POLICY
+    observe_stage("write", assembled)
+
+def after_wide_row(tag_mac: str, base: List[Any]):
+    """Bookkeeping once a tag's wide row was handed to its writer"""
+    sample = tag_samples.get(tag_mac)
+    if sample is not None:
+        sample.record(stratum_key(base[2], base[3], base[0], base[8], SAMPLING_CELL_SIZE))
+        tag_message_counts[tag_mac] = sample.kept
+        if len(sample.tombstones) >= SAMPLING_COMPACT_EVERY:
+            compact_tag(tag_mac)
+
+def observe_stage(stage: str, started: float) -> float:
+    """Record the time since `started` (perf_counter) for a pipeline stage; returns the end time"""
+    now = time.perf_counter()
+    if metrics is not None:
+        metrics.observe(stage, now - started)
+    return now
+
+def process_position_message(message: PositionMessage, anchor_macs: Set[str]):
     """Process a single position message and write to appropriate CSV"""
     global message_count, tag_message_counts
     
     try:
-        tag_mac = position_data["tag"]["mac"]
+        tag_mac = message.tag_mac
         
         # Only process if it's one of our 60 tags
         if tag_mac not in TAG_MAC_TO_MAP_ID:
             return
         
-        # Check if this tag has reached the maximum row limit
-        if tag_message_counts[tag_mac] >= MAX_LINES:
+        # Check if this tag has reached the maximum row limit (sampled tags replace rows instead)
+        sample = tag_samples.get(tag_mac)
+        if sample is None and tag_message_counts[tag_mac] >= MAX_LINES:
             # Skip processing for this tag to allow others to catch up
             #if tag_message_counts[tag_mac] == MAX_LINES:
                 #print(f"⏸️  Tag {tag_mac[:6]}... reached maximum {MAX_LINES} rows - pausing to balance dataset")
             return
             
-        message_count += 1
+        with counter_lock:
+            message_count += 1
         tag_message_counts[tag_mac] += 1
         
-        # Extract basic position data
-        location = position_data["location"]
-        map_id = location["map_id"]
-        timestamp = position_data["timestamp"]
-        pos = location["position"]
-        tag_x = pos["x"]
-        tag_y = pos["y"]
+        started = time.perf_counter()
         
-        # Extract covariance matrix
-        cov = pos["covariance"]
-        cov_xx = cov[0][0]
-        cov_xy = cov[0][1] 
-        cov_yx = cov[1][0]
-        cov_yy = cov[1][1]
+        # Basic position data and covariance matrix
+        map_id = message.map_id
+        timestamp = message.timestamp
+        tag_x = message.x
+        tag_y = message.y
+        cov_xx, cov_xy, cov_yx, cov_yy = message.covariance
         
         true_map_id = TAG_MAC_TO_MAP_ID[tag_mac]
         
-        # Collect all anchors (used + unused) - following new MQTT format
-        all_anchors = {}
-        
-        # Process used anchors
-        for anchor in pos.get("used_anchors", []):
-            anchor_mac = anchor["mac"]
-            distance = anchor.get("cart_d", 0)
-            
-            # Get x,y from MQTT if available, otherwise use database
-            anchor_x = anchor.get("x", None)
-            anchor_y = anchor.get("y", None)
-            anchor_map_id = anchor.get("map_id", "")
-            
+        # Collect all anchors (used first, then unused) - following new MQTT format
+        all_anchors = AnchorObservations(map_codes)
+        for anchor_mac, used, rssi, anchor_x, anchor_y, anchor_map_id, distance, signal_quality in message.anchors():
+            # Keep the registry current from coordinates the message carries
+            if anchor_registry is not None and anchor_x is not None and anchor_x != 0 and anchor_y is not None:
+                anchor_registry.observe(anchor_mac, anchor_x, anchor_y, anchor_map_id, timestamp)
+                
             # If MQTT doesn't have position, use database
             if (anchor_x is None or anchor_x == 0) and anchor_mac in ANCHOR_DATABASE:
                 db_data = ANCHOR_DATABASE[anchor_mac]
@@ -422,141 +538,34 @@ def process_position_message(position_data: Dict[str, Any], anchor_macs: Set[str
                 if not anchor_map_id:
                     anchor_map_id = db_data["map_id"]
             
-            all_anchors[anchor_mac] = {
-                "rssi": anchor.get("rssi", ""),  # Handle missing RSSI
-                "used": 1,
-                "x": anchor_x if anchor_x is not None else 0,
-                "y": anchor_y if anchor_y is not None else 0,
-                "map_id": anchor_map_id,
-                "distance": distance,
-                "signal_quality": anchor.get("signal_quality", "")
-            }
-            
-        # Process unused anchors
-        for anchor in pos.get("unused_anchors", []):
-            anchor_mac = anchor["mac"]
-            distance = anchor.get("cart_d", 0)
+            all_anchors.add(anchor_mac, rssi if rssi is not None else "",  # Handle missing RSSI
+                            used, anchor_x if anchor_x is not None else 0, anchor_y if anchor_y is not None else 0,
+                            anchor_map_id, distance, signal_quality)
             
-            # Get x,y from MQTT if available, otherwise use database
-            anchor_x = anchor.get("x", None)
-            anchor_y = anchor.get("y", None)
-            anchor_map_id = anchor.get("map_id", "")
-            
-            # If MQTT doesn't have position, use database
-            if (anchor_x is None or anchor_x == 0) and anchor_mac in ANCHOR_DATABASE:
-                db_data = ANCHOR_DATABASE[anchor_mac]
-                anchor_x = db_data["x"]
-                anchor_y = db_data["y"]
-                if not anchor_map_id:
-                    anchor_map_id = db_data["map_id"]
-            
-            all_anchors[anchor_mac] = {
-                "rssi": anchor.get("rssi", ""),  # Handle missing RSSI
-                "used": 0,
-                "x": anchor_x if anchor_x is not None else 0,
-                "y": anchor_y if anchor_y is not None else 0,
-                "map_id": anchor_map_id, 
-                "distance": distance,
-                "signal_quality": ""
-            }
+        if device_inventory is not None:
+            device_inventory.note_heard(tag_mac, all_anchors.macs())
         
-        # Calculate per-map statistics
-        map_stats = {}
-        for mid in MAP_IDS:
-            anchors_for_map = [a for a in all_anchors.values() if a["map_id"] == mid]
-            
-            if anchors_for_map:
-                # Filter out empty RSSI values for statistics
-                rssi_values = [a["rssi"] for a in anchors_for_map if a["rssi"] != ""]
-                
-                if rssi_values:
-                    map_stats[mid] = {
-                        "total_anchors": len(anchors_for_map),
-                        "anchors_used": sum(1 for a in anchors_for_map if a["used"] == 1),
-                        "anchors_hearing": len(anchors_for_map),
-                        "avg_rssi": mean(rssi_values),
-                        "max_rssi": max(rssi_values),
-                        "min_rssi": min(rssi_values),
-                        "rssi_std": stdev(rssi_values) if len(rssi_values) > 1 else 0,
-                        "rssi_range": max(rssi_values) - min(rssi_values)
-                    }
-                else:
-                    # No valid RSSI values
-                    map_stats[mid] = {
-                        "total_anchors": len(anchors_for_map),
-                        "anchors_used": sum(1 for a in anchors_for_map if a["used"] == 1),
-                        "anchors_hearing": len(anchors_for_map),
-                        "avg_rssi": "",
-                        "max_rssi": "",
-                        "min_rssi": "",
-                        "rssi_std": "",
-                        "rssi_range": ""
-                    }
-            else:
-                map_stats[mid] = {
-                    "total_anchors": 0,
-                    "anchors_used": 0, 
-                    "anchors_hearing": 0,
-                    "avg_rssi": "",
-                    "max_rssi": "",
-                    "min_rssi": "",
-                    "rssi_std": "",
-                    "rssi_range": ""
-                }
-        
-        # Build CSV row
-        row = [
+        base = [
             map_id, timestamp, tag_x, tag_y,
             cov_xx, cov_xy, cov_yx, cov_yy, true_map_id
         ]
         
-        # Add per-map statistics
-        for mid in MAP_IDS:
-            stats = map_stats[mid]
-            row.extend([
-                stats["total_anchors"],
-                stats["anchors_used"],
-                stats["anchors_hearing"], 
-                stats["avg_rssi"],
-                stats["max_rssi"],
-                stats["min_rssi"],
-                stats["rssi_std"],
-                stats["rssi_range"]
-            ])
-        
-        # Add per-anchor data (in sorted order) - ALL ~240 anchors
-        for anchor_mac in sorted(anchor_macs):
-            if anchor_mac in all_anchors:
-                anchor = all_anchors[anchor_mac]
-                row.extend([
-                    anchor["rssi"],
-                    anchor["used"],
-                    anchor["x"],
-                    anchor["y"],
-                    anchor["map_id"],
-                    anchor["distance"],
-                    anchor["signal_quality"]
-                ])
+        if row_batcher is not None:
+            # Statistics, distances and row assembly are done for the whole batch with NumPy
+            observe_stage("features", started)
+            row_batcher.queue(tag_mac, base, all_anchors, anchor_macs)
+        else:
+            # Calculate per-map statistics in a single pass over the heard anchors
+            map_stats = all_anchors.map_stats(MAP_IDS)
+            features_done = observe_stage("features", started)
+            
+            if sparse_sink is not None:
+                # Sparse long format: one position row plus one row per heard anchor
+                sparse_sink.write_position(tag_mac, base, {mid: map_stats[mid].values() for mid in MAP_IDS}, all_anchors)
+                observe_stage("write", features_done)
             else:
-                # For anchors not present: get position from database, leave RSSI and signal_quality empty
-                if anchor_mac in ANCHOR_DATABASE:
-                    db_anchor = ANCHOR_DATABASE[anchor_mac]
-                    row.extend([
-                        "",  # rssi - empty
-                        0,   # used - not used
-                        db_anchor["x"],  # actual x position from database
-                        db_anchor["y"],  # actual y position from database  
-                        db_anchor["map_id"],  # actual map_id from database
-                        0,   # distance - not calculated for unused anchors
-                        ""   # signal_quality - empty
-                    ])
-                else:
-                    # Anchor not in database either - use empty values
-                    row.extend(["", 0, "", "", "", "", ""])
-        
-        # Write to appropriate CSV file
-        csv_writers[tag_mac].writerow(row)
-        csv_files[tag_mac].flush()  # Ensure data is written
+                write_wide_row(tag_mac, base, map_stats, all_anchors, anchor_macs)
+                after_wide_row(tag_mac, base)
         
         # Debug output for first few messages of each tag
         if tag_message_counts[tag_mac] <= 3:
@@ -570,76 +579,26 @@ def process_position_message(position_data: Dict[str, Any], anchor_macs: Set[str
         import traceback
         traceback.print_exc()
 
-def make_api_request():
-    """Make the API POST request to trigger tag broadcasting via SSH tunnel"""
-    import ssl
-    import urllib3
-    
-    # Disable SSL warnings for tunneled connection
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    
-    # Try each API URL
-    for url_idx, url in enumerate(API_URLS, 1):
-        print(f"🔄 Trying API URL {url_idx}/{len(API_URLS)}: {url}")
-        
-        # For SSH tunneled connections, we need to be more careful with SSL
-        approaches = [
-            {"verify": False, "timeout": 30},
-            {"verify": False, "timeout": 60, "allow_redirects": True},
-            {"verify": False, "timeout": 10, "stream": False}
-        ]
-        
-        for i, config in enumerate(approaches, 1):
-            try:
-                print(f"🔄 API Request attempt {i}/{len(approaches)} for URL {url_idx}...")
-                
-                response = requests.post(
-                    url, 
-                    headers=headers, 
-                    json=payload, 
-                    **config
-                )
-                
-                print(f"🔄 API Request - Status: {response.status_code}")
-                if response.status_code == 201:
-                    print("✅ API Request successful - Tags should start broadcasting")
-                    return True
-                else:
-                    print(f"⚠️  API Response: {response.text}")
-                    if i < len(approaches):
-                        print("💡 Trying next approach...")
-                        continue
-                    # Try next URL
-                    break
-                    
-            except requests.exceptions.SSLError as e:
-                print(f"❌ SSL Error (URL {url_idx}, attempt {i}): {e}")
-                if i < len(approaches):
-                    print("💡 Trying next approach...")
-                    continue
-                # Try next URL
-                break
-            except requests.exceptions.ConnectionError as e:
-                print(f"❌ Connection Error (URL {url_idx}, attempt {i}): {e}")
-                if i < len(approaches):
-                    print("💡 Trying next approach...")
-                    continue
-                # Try next URL
-                break
-            except requests.exceptions.RequestException as e:
-                print(f"❌ API Request failed (URL {url_idx}, attempt {i}): {e}")
-                if i < len(approaches):
-                    print("💡 Trying next approach...")
-                    continue
-                # Try next URL
-                break
-        
-        if url_idx < len(API_URLS):
-            print("💡 Trying next API URL...")
+def tag_wants_positions(tag_mac: str) -> bool:
+    """Tags below MAX_LINES, or being sampled, keep getting triggered; the rest are left to time out"""
+    return tag_mac in tag_samples or tag_message_counts.get(tag_mac, 0) < MAX_LINES
+
+def start_trigger_scheduler():
+    """Send the broadcast trigger off the MQTT thread, per tag liveness or every API_TRIGGER_INTERVAL seconds"""
+    global trigger_scheduler, tag_liveness, adv_controller
+    if API_TRIGGER_MODE == "liveness":
+        tag_liveness = TagLiveness(payload["devices"], payload["timeout"], lead=TRIGGER_LEAD, quiet_after=TRIGGER_QUIET_AFTER)
+    if ADV_RATE_CONTROL:
+        adv_controller = AdvRateController(payload["devices"], MAX_LINES, lambda tag_mac: tag_message_counts.get(tag_mac, 0),
+                                           payload["ble_settings"]["adv_interval"], ADV_INTERVAL_CHOICES)
+    trigger_scheduler = TriggerScheduler(API_URLS, headers, payload, interval=API_TRIGGER_INTERVAL,
+                                         max_failures=API_MAX_FAILURES, liveness=tag_liveness,
+                                         wanted=tag_wants_positions, controller=adv_controller)
+    trigger_scheduler.start()
     
-    print("❌ All API request attempts failed")
-    print("💡 Start tunnels with: ./start_tunnels.sh")
-    return False
+def stop_trigger_scheduler():
+    if trigger_scheduler is not None:
+        trigger_scheduler.stop()
 
 def on_connect(client, userdata, flags, rc, properties=None):
     print("🔌 on_connect rc =", rc)
@@ -653,17 +612,171 @@ def on_connect(client, userdata, flags, rc, properties=None):
 def on_subscribe(client, userdata, mid, granted_qos, properties=None):
     print("✅ Subscribed, waiting for messages…")
 
-def on_message(client, userdata, msg):
+def admit_payload(raw_payload: bytes) -> bool:
+    """Pre-decode filter: False for untracked tags, capped tags and positions the sampler passes over"""
+    global skipped_payloads
+    tag_mac = extract_tag_mac(raw_payload)
+    if tag_mac is None:
+        return True  # Let the full decode deal with it
+    if tag_liveness is not None:
+        tag_liveness.note_seen(tag_mac)
+    if adv_controller is not None:
+        adv_controller.note_position(tag_mac)
+    sample = tag_samples.get(tag_mac)
+    if tag_mac not in TAG_MAC_TO_MAP_ID:
+        admitted = False
+    elif sample is not None:
+        admitted = sample.admit()
+    else:
+        admitted = tag_message_counts.get(tag_mac, 0) < MAX_LINES
+    if not admitted:
+        with counter_lock:
+            skipped_payloads += 1
+    return admitted
+
+def handle_payload(raw_payload: bytes, anchor_macs: Set[str]):
+    """Decode one raw MQTT payload and process it"""
     try:
-        payload = msg.payload.decode("utf-8", errors="replace")
-        position_data = json.loads(payload)
-        process_position_message(position_data, userdata["anchor_macs"])
+        # Drop repeated deliveries (possibly by another broker) before admit_payload counts them towards
+        # MAX_LINES, the sampler and the adv-rate controller; the key is read off the raw bytes when possible
+        key = raw_position_key(raw_payload) if recent_positions is not None else None
+        if key is not None and recent_positions.seen(key):
+            return
+        if not admit_payload(raw_payload):
+            return
+        started = time.perf_counter()
+        message = decode_position(raw_payload)  # Fastest available JSON backend, straight from bytes
+        observe_stage("decode", started)
+        if recent_positions is not None and key is None and recent_positions.seen(message.key()):
+            return  # Key could not be read before decoding
+        process_position_message(message, anchor_macs)
     except (json.JSONDecodeError, KeyError) as e:
         print(f"❌ Error parsing message: {e}")
+        if metrics is not None:
+            metrics.count("parse_errors")
     except Exception as e:
         print(f"❌ Unexpected error: {e}")
 
-def print_periodic_stats():
+def on_message(client, userdata, msg):
+    if capture_writer is not None:
+        capture_writer.write(msg.topic, msg.payload)
+        
+    port = userdata.get("broker_port")
+    if port is not None:
+        with counter_lock:
+            broker_message_counts[port] = broker_message_counts.get(port, 0) + 1
+            
+    pipeline = userdata.get("pipeline")
+    if pipeline is not None:
+        # Queued mode: only hand the raw bytes over, the workers do the rest
+        pipeline.submit(msg.payload)
+    else:
+        handle_payload(msg.payload, userdata["anchor_macs"])
+
+def start_ingestion_pipeline(anchor_macs: Set[str]):
+    """Start the worker pool when INGESTION_MODE is "queued" or BROKER_MODE is "multi", otherwise return None"""
+    if INGESTION_MODE != "queued" and BROKER_MODE != "multi":
+        return None
+    pipeline = IngestionPipeline(lambda raw_payload: handle_payload(raw_payload, anchor_macs),
+                                 workers=INGESTION_WORKERS, queue_size=INGESTION_QUEUE_SIZE,
+                                 policy=BACKPRESSURE_POLICY)
+    pipeline.start()
+    print(f"🧵 Queued ingestion: {INGESTION_WORKERS} workers, queue size {INGESTION_QUEUE_SIZE}, policy {BACKPRESSURE_POLICY}")
+    return pipeline
+
+def create_mqtt_client(port: int, anchor_macs: Set[str], pipeline) -> mqtt.Client:
+    """Create a client for one broker port and connect it"""
+    client = mqtt.Client(protocol=mqtt.MQTTv311)
+    client.enable_logger()
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = on_message
+    client.user_data_set({"anchor_macs": anchor_macs, "pipeline": pipeline, "broker_port": port})
+    
+    client.connect(BROKER_HOST, port, keepalive=60)
+    return client
+
+def connect_all_brokers(ports: List[int], anchor_macs: Set[str], pipeline) -> List[mqtt.Client]:
+    """Connect to every port, each client with its own network thread feeding the shared pipeline"""
+    clients = []
+    for port in ports:
+        try:
+            print(f"🔄 Connecting MQTT on port {port}...")
+            client = create_mqtt_client(port, anchor_macs, pipeline)
+            client.loop_start()  # Reconnects on its own if this tunnel drops
+            clients.append(client)
+            print(f"✅ MQTT connected on port {port}")
+        except Exception as e:
+            print(f"❌ MQTT connection failed on port {port}: {e}")
+            
+    if clients:
+        print(f"🔀 Multi-broker ingestion on {len(clients)} ports, deduplicating by (tag, timestamp, map)")
+    return clients
+
+def disconnect_clients(clients: List[mqtt.Client]):
+    for client in clients:
+        client.disconnect()
+        if BROKER_MODE == "multi":
+            client.loop_stop()
+
+def start_capture():
+    """Open the raw capture log when CAPTURE_DIR is set"""
+    global capture_writer
+    
+    if CAPTURE_DIR:
+        capture_writer = CaptureWriter(CAPTURE_DIR)
+        print(f"📼 Capturing raw payloads to {CAPTURE_DIR}/")
+
+def start_metrics(pipeline=None):
+    """Create the stage metrics, register the readouts and start the local /metrics endpoint"""
+    global metrics, metrics_server
+    if not METRICS_ENABLED:
+        return
+    json_path = None
+    if METRICS_JSON_FILE:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        json_path = os.path.join(OUTPUT_DIR, METRICS_JSON_FILE)
+    metrics = PipelineMetrics(json_path=json_path, json_interval=METRICS_JSON_INTERVAL)
+    metrics.register("messages", lambda: message_count, "counter", "Position messages processed")
+    metrics.describe("parse_errors", "Payloads that failed to decode or lacked required fields")
+    metrics.register("bytes_written", lambda: buffer_totals(csv_writers)["bytes_on_disk"], "counter",
+                     "Bytes written by the data writers this session")
+    metrics.register("rows_buffered", lambda: buffer_totals(csv_writers)["rows_buffered"], "gauge",
+                     "Rows waiting in the writer buffers")
+    if recent_positions is not None:
+        metrics.register("duplicates_dropped", lambda: recent_positions.duplicates, "counter",
+                         "Positions dropped as repeated deliveries")
+    metrics.register("payloads_skipped", lambda: skipped_payloads, "counter",
+                     "Payloads dropped before decoding (untracked, capped or not sampled tags)")
+    if pipeline is not None:
+        metrics.register("queue_depth", pipeline.depth, "gauge", "Payloads waiting in the ingestion queues")
+        metrics.register("dropped", lambda: pipeline.dropped_oldest + pipeline.dropped_newest, "counter",
+                         "Payloads dropped by the backpressure policy")
+        metrics.register("ingestion_errors", lambda: pipeline.errors, "counter", "Payloads that raised in a worker")
+    if METRICS_PORT is not None:
+        try:
+            metrics_server = MetricsServer(metrics, METRICS_PORT).start()
+            print(f"📈 Metrics at http://127.0.0.1:{metrics_server.port}/metrics")
+        except OSError as e:
+            print(f"⚠️ Could not start the metrics endpoint on port {METRICS_PORT}: {e}")
+
+def stop_metrics():
+    """Write the final JSON dump and stop the endpoint"""
+    global metrics_server
+    if metrics is not None:
+        metrics.dump_json()
+    if metrics_server is not None:
+        metrics_server.stop()
+        metrics_server = None
+
+def stop_ingestion_pipeline(pipeline):
+    """Process whatever is still queued, then stop the workers"""
+    if pipeline is not None:
+        print(f"🧵 Draining ingestion queue ({pipeline.depth()} payloads)...")
+        pipeline.stop(drain=True)
+        pipeline.print_stats()
+
+def print_periodic_stats(pipeline=None):
     """Print detailed statistics every few minutes"""
     global last_stats_print
     
@@ -709,20 +822,43 @@ def print_periodic_stats():
                 print("🎯 ALL TAGS HAVE REACHED THE CAP - Dataset is fully balanced!")
                 print("   Consider stopping data collection or increasing MAX_LINES if more data is needed.")
         
-        # File size check
-        try:
-            total_size = 0
-            for tag_mac in csv_files.keys():
-                filepath = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
-                if os.path.exists(filepath):
-                    size = os.path.getsize(filepath)
-                    total_size += size
+        # Data written, from the writers' own counters instead of stat-ing every file (Parquet sizes are known once closed)
+        totals = buffer_totals(csv_writers)
+        print(f"Data written this session: {totals['bytes_on_disk'] / (1024 * 1024):.1f} MB")
+        print(f"Rows on disk: {totals['rows_on_disk']} | Rows buffered: {totals['rows_buffered']} ({totals['bytes_buffered'] / 1024:.1f} KB)")
             
-            total_size_mb = total_size / (1024 * 1024)
-            print(f"Total data written: {total_size_mb:.1f} MB")
-        except Exception as e:
-            print(f"Could not calculate file sizes: {e}")
+    if pipeline is not None:
+        pipeline.print_stats()
+    if metrics is not None:
+        metrics.print_stats()
+    if trigger_scheduler is not None:
+        trigger_scheduler.print_stats()
+    if adv_controller is not None:
+        adv_controller.print_status()
+    if BROKER_MODE == "multi":
+        per_port = ", ".join(f"{port}: {count}" for port, count in sorted(broker_message_counts.items()))
+        print(f"Brokers - Received: {per_port}")
+    if recent_positions is not None:
+        print(f"Duplicate filter: {recent_positions.summary()}")
     
+    if tag_samples:
+        admitted = sum(sample.admitted for sample in tag_samples.values())
+        replaced = sum(len(sample.tombstones) for sample in tag_samples.values())
+        print(f"Sampling ({SAMPLING_MODE}): {admitted} admitted | {skipped_payloads} payloads skipped before decoding | {replaced} rows awaiting compaction")
+    elif skipped_payloads:
+        print(f"Payloads skipped before decoding (untracked or capped tags): {skipped_payloads}")
+    if device_inventory is not None:
+        device_inventory.print_reconciliation()
+        
+    # Persist flushed row counts so a restart does not have to count lines
+    if manifest is not None:
+        manifest.save(csv_writers)
+    elif sparse_sink is not None:
+        sparse_sink.save()
+    if anchor_registry is not None:
+        print(f"Anchor registry: {len(anchor_registry.entries)} anchors, {anchor_registry.moved} moved this session")
+        anchor_registry.save()
+        
     print(f"{'='*60}\n")
     
     # Visualization generation removed
@@ -730,7 +866,26 @@ def print_periodic_stats():
     last_stats_print = current_time
 
 def cleanup_files():
-    """Close all CSV files"""
+    """Flush buffered rows and close all CSV files"""
+    if row_batcher is not None:
+        row_batcher.flush(force=True)
+    totals = buffer_totals(csv_writers)
+    flush_all(csv_writers, sync=True)
+    stop_metrics()
+    for tag_mac, sample in tag_samples.items():
+        if sample.tombstones:
+            compact_tag(tag_mac)
+    if manifest is not None:
+        manifest.save(csv_writers)
+    elif sparse_sink is not None:
+        sparse_sink.save()
+    if tag_samples:
+        file_sizes = {tag_mac: os.fstat(csv_files[tag_mac].fileno()).st_size for tag_mac in tag_samples}
+        save_sampling_state(OUTPUT_DIR, tag_samples, file_sizes, SAMPLING_CELL_SIZE)
+    if capture_writer is not None:
+        capture_writer.close()
+    if anchor_registry is not None:
+        anchor_registry.save(final=True)
     for file_handle in csv_files.values():
         file_handle.close()
     
@@ -740,6 +895,9 @@ def cleanup_files():
     print(f"{'='*60}")
     print(f"Total messages processed: {message_count}")
     print(f"CSV files closed: {len(csv_files)}")
+    print(f"Buffered rows flushed on close: {totals['rows_buffered']}")
+    if device_inventory is not None:
+        device_inventory.print_reconciliation()
     
     # Count lines in each file and show balance status
     try:
@@ -749,15 +907,22 @@ def cleanup_files():
         
         for tag_mac in csv_files.keys():
             filepath = os.path.join(OUTPUT_DIR, f"{tag_mac}.csv")
-            if os.path.exists(filepath):
+            if OUTPUT_FORMAT == "parquet":
+                filepath = os.path.join(PARQUET_OUTPUT_DIR, tag_mac)
+                lines = existing_row_count(filepath)  # Row counts from the Parquet footers
+            elif manifest is not None and tag_mac in manifest.entries:
+                lines = manifest.entries[tag_mac]["rows"]  # Saved above, no need to re-read the file
+            elif os.path.exists(filepath):
                 with open(filepath, 'r') as f:
                     lines = sum(1 for _ in f) - 1  # Subtract header
-                total_lines += lines
-                tag_counts.append(lines)
-                if lines >= MAX_LINES:
-                    capped_tags += 1
-                if lines > 0:
-                    print(f"  {tag_mac}.csv: {lines} data rows")
+            else:
+                continue
+            total_lines += lines
+            tag_counts.append(lines)
+            if lines >= MAX_LINES:
+                capped_tags += 1
+            if lines > 0:
+                print(f"  {os.path.basename(filepath)}: {lines} data rows")
         
         print(f"Total data rows written: {total_lines}")
         
@@ -779,21 +944,24 @@ def cleanup_files():
     
     print(f"{'='*60}")
 
-def runner():
-    global start_time, ANCHOR_DATABASE
+def load_anchors() -> Set[str]:
+    """Device inventory, ANCHOR_DATABASE from the registry and the anchor MACs for the column layout"""
+    global ANCHOR_DATABASE, anchor_registry, device_inventory
     
-    print("🚀 Starting Extended ML data generation...")
-    print("📊 Using existing extended format with all anchor MACs")
-    
-    # Check SSH tunnel connections first
-    active_api_ports, active_mqtt_ports = check_tunnel_connections()
+    device_inventory = load_inventory()
     
-    if not active_mqtt_ports:
-        print("❌ No MQTT tunnels are active. Cannot proceed.")
-        print("💡 Start tunnels with: ./start_tunnels.sh")
-        return
+    # Load the anchor registry; scanning the existing CSV files is only a one-time bootstrap
+    anchor_registry = AnchorRegistry(ANCHOR_REGISTRY_FILE).load()
+    if anchor_registry.entries:
+        print(f"📍 Loaded anchor registry {ANCHOR_REGISTRY_FILE}")
+    else:
+        anchor_registry.bootstrap(build_anchor_database())
+        anchor_registry.save()
+    ANCHOR_DATABASE = anchor_registry.entries  # Updated in place as messages arrive
+    if not ANCHOR_DATABASE:
+        print("⚠️  Starting with empty anchor database. Will be populated as data arrives.")
     
-    # Get anchor MACs from existing extended data or create basic set
+    # Get anchor MACs from existing extended data, the inventory and registry, or create basic set
     anchor_macs = get_all_anchor_macs()
     if not anchor_macs:
         print("⚠️  No existing files found. Creating basic anchor set for first run...")
@@ -804,93 +972,112 @@ def runner():
         ])
         print(f"📡 Using {len(anchor_macs)} basic anchor MACs for first run")
     
-    # Build anchor database from existing files (or start empty for first run)
-    ANCHOR_DATABASE = build_anchor_database()
-    if not ANCHOR_DATABASE:
-        print("⚠️  Starting with empty anchor database. Will be populated as data arrives.")
-        ANCHOR_DATABASE = {}
-    
     print(f"📡 Using {len(anchor_macs)} anchor MACs for data generation")
     print(f"🎯 Anchor database contains {len(ANCHOR_DATABASE)} anchors with position data")
+    return anchor_macs
+
+def replay_runner(capture_dir: str, speed: float = None) -> int:
+    """Rebuild the extended data from a raw capture log instead of live MQTT (see mqtt_capture.py)"""
+    global recent_positions
+    
+    print(f"📼 Replaying {capture_dir} into Extended ML data generation...")
+    anchor_macs = load_anchors()
+    setup_csv_files(anchor_macs)
+    
+    # Captures taken in multi-broker mode contain every duplicate delivery
+    recent_positions = RecentKeyIndex(DEDUP_CAPACITY, DEDUP_WINDOW)
+    
+    # Inline processing keeps replays lossless and deterministic
+    count = replay(capture_dir, lambda topic, payload: handle_payload(payload, anchor_macs), speed)
+    cleanup_files()
+    return count
+
+def runner():
+    global start_time, recent_positions
+    
+    print("🚀 Starting Extended ML data generation...")
+    print("📊 Using existing extended format with all anchor MACs")
+    
+    # Check SSH tunnel connections first
+    active_api_ports, active_mqtt_ports = check_tunnel_connections()
+    
+    if not active_mqtt_ports:
+        print("❌ No MQTT tunnels are active. Cannot proceed.")
+        print("💡 Start tunnels with: ./start_tunnels.sh")
+        return
+        
+    anchor_macs = load_anchors()
     
     # Setup CSV files
     setup_csv_files(anchor_macs)
     
-    # Initial visualization generation removed
+    # Drop repeated deliveries before any feature extraction
+    recent_positions = RecentKeyIndex(DEDUP_CAPACITY, DEDUP_WINDOW)
+    
+    # Start ingestion workers (queued mode, and always in multi-broker mode so each tag is processed by one thread)
+    pipeline = start_ingestion_pipeline(anchor_macs)
+    start_capture()
+    start_metrics(pipeline)
     
-    # Track when we last made an API request
-    last_api_request = 0
-    api_interval = 100  # Make API request every 100 seconds
-    api_failures = 0  # Track consecutive API failures
-    max_api_failures = 5  # Stop trying after 5 consecutive failures
+    # Initial visualization generation removed
     
     # Try to connect to MQTT using available ports
-    mqtt_connected = False
-    for port in active_mqtt_ports:
-        try:
-            print(f"🔄 Trying MQTT connection on port {port}...")
-            client = mqtt.Client(protocol=mqtt.MQTTv311)
-            client.enable_logger()
-            client.on_connect = on_connect
-            client.on_subscribe = on_subscribe
-            client.on_message = on_message
-            client.user_data_set({"anchor_macs": anchor_macs})
-            
-            client.connect(BROKER_HOST, port, keepalive=60)
-            mqtt_connected = True
-            print(f"✅ MQTT connected on port {port}")
-            break
-        except Exception as e:
-            print(f"❌ MQTT connection failed on port {port}: {e}")
-            continue
+    clients = []
+    if BROKER_MODE == "multi":
+        clients = connect_all_brokers(active_mqtt_ports, anchor_macs, pipeline)
+    else:
+        for port in active_mqtt_ports:
+            try:
+                print(f"🔄 Trying MQTT connection on port {port}...")
+                client = create_mqtt_client(port, anchor_macs, pipeline)
+                clients.append(client)
+                print(f"✅ MQTT connected on port {port}")
+                break
+            except Exception as e:
+                print(f"❌ MQTT connection failed on port {port}: {e}")
+                continue
+    mqtt_connected = bool(clients)
     
     if not mqtt_connected:
         print("❌ Could not connect to MQTT on any available port")
         print("💡 Start tunnels with: ./start_tunnels.sh")
+        stop_ingestion_pipeline(pipeline)
         return
     
     try:
-        # Make initial API request
-        print("🚀 Making initial API request...")
-        if make_api_request():
-            api_failures = 0  # Reset failure counter on success
-        else:
-            api_failures += 1
-        last_api_request = time.time()
+        # Broadcast triggers run on their own thread so a slow API never stalls the MQTT loop
+        print("🚀 Starting API trigger scheduler...")
+        start_trigger_scheduler()
         
-        # Start the loop with periodic API requests
-        print("🔄 Starting MQTT loop with periodic API requests...")
+        # Start the loop
+        print("🔄 Starting MQTT loop (API requests run in the background)...")
         while True:
             current_time = time.time()
             
-            # Check if we need to make another API request
-            if current_time - last_api_request >= api_interval and api_failures < max_api_failures:
-                print(f"⏰ {api_interval}s elapsed, making another API request...")
-                if make_api_request():
-                    api_failures = 0  # Reset failure counter on success
-                    print("✅ API request successful - tags should be broadcasting")
-                else:
-                    api_failures += 1
-                    print(f"❌ API request failed ({api_failures}/{max_api_failures} consecutive failures)")
-                    if api_failures >= max_api_failures:
-                        print("🛑 Too many API failures - continuing with MQTT only (tags may already be broadcasting)")
-                last_api_request = current_time
-            elif api_failures >= max_api_failures:
-                # Still print periodic stats even if API is failing
-                if current_time - last_api_request >= api_interval:
-                    print(f"⏰ {api_interval}s elapsed, but API requests disabled due to failures")
-                    last_api_request = current_time
-            
             # Print periodic stats every 5 minutes
             if current_time - last_stats_print >= 300:  # 5 minutes
-                print_periodic_stats()
+                print_periodic_stats(pipeline)
             
             # Process MQTT messages for a short time
-            client.loop(timeout=1.0)
+            if BROKER_MODE == "multi":
+                time.sleep(1.0)  # Every client runs its own network thread
+            else:
+                client.loop(timeout=1.0)
+            
+            # Flush tags whose buffered rows have waited past FLUSH_POLICY.max_interval
+            if row_batcher is not None:
+                row_batcher.flush()
+            started = time.perf_counter()
+            if flush_due(csv_writers):
+                observe_stage("flush", started)
+            if metrics is not None:
+                metrics.dump_due()
             
     except KeyboardInterrupt:
         print("\n🛑 Stopping...")
-        client.disconnect()
+        stop_trigger_scheduler()
+        disconnect_clients(clients)
+        stop_ingestion_pipeline(pipeline)
         cleanup_files()
         
         # Print final stats
@@ -901,7 +1088,9 @@ def runner():
         
     except Exception as e:
         print(f"❌ Connection error: {e}")
-        client.disconnect()
+        stop_trigger_scheduler()
+        disconnect_clients(clients)
+        stop_ingestion_pipeline(pipeline)
         cleanup_files()
 
 if __name__ == "__main__":
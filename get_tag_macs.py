@@ -2,6 +2,8 @@ from typing import Dict, Any, Tuple, List
 import logging, paho.mqtt.client as mqtt
 import time, urllib3, requests, json
 
+from tag_registry import TAGS
+
 """
 Anchor lists:
 Tags downstairs: {62398, 33655, 34487, 27666, 42322, 16915, 45527, 21342, 37133, 4468, 54577, 15826, 47621, 43668, 19465, 42966, 4820, 62994, 24904, 28567, 34114, 13077, 1758, 44900, 28565, 25272, 49874, 18821, 23550, 59518}
@@ -25,24 +27,8 @@ tag_id_to_mac: Dict[str, str] = {}
 # Track start time for runtime calculation
 start_time = time.time()
 
-# Dictionary to track message counts for each tag ID
-tag_message_counts: Dict[str, int] = {
-    # Downstairs tags
-    "62398": 0, "33055": 0, "34487": 0, "27666": 0, "4232": 0,
-    "16915": 0, "45527": 0, "21342": 0, "37133": 0, "4468": 0,
-    "54577": 0, "15826": 0, "47621": 0, "43660": 0, "19466": 0,
-    "42966": 0, "4820": 0, "62994": 0, "24904": 0, "20567": 0,
-    "34114": 0, "13077": 0, "1758": 0, "44900": 0, "28565": 0,
-    "25272": 0, "49074": 0, "18821": 0, "23550": 0, "59518": 0,
-    
-    # Mezzanine tags
-    "53934": 0, "40172": 0, "52711": 0, "24129": 0, "13485": 0,
-    "28064": 0, "1989": 0, "56876": 0, "47397": 0, "32140": 0,
-    "60967": 0, "6555": 0, "64669": 0, "20869": 0, "28152": 0,
-    "35464": 0, "62212": 0, "55738": 0, "29288": 0, "20689": 0,
-    "6667": 0, "59660": 0, "47437": 0, "64033": 0, "52919": 0,
-    "2460": 0, "38511": 0, "62524": 0, "62920": 0, "34465": 0
-}
+# Dictionary to track message counts for each registered tag ID
+tag_message_counts: Dict[str, int] = {tag_id: 0 for tag_id in TAGS.ids}
 
 all_tag_ids: List[str] = list(tag_message_counts.keys())
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Queued ingestion for the MQTT position stream
+The paho network thread only enqueues raw payloads; a pool of workers,
+partitioned by tag MAC to keep per-tag ordering, does the decoding,
+feature extraction and CSV writing
+"""
+
+from typing import Dict, Any, Callable, List, Optional
+import queue, re, threading, time, zlib
+
+# Backpressure policies when a worker queue is full
+BLOCK = "block"              # Network thread waits for space (nothing lost, broker may back up)
+DROP_OLDEST = "drop-oldest"  # Discard the oldest queued payload to make room
+DROP_NEWEST = "drop-newest"  # Discard the incoming payload
+BACKPRESSURE_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+# Cheap scan of the raw payload for the tag MAC, so partitioning needs no JSON decode
+TAG_MAC_PATTERN = re.compile(rb'"tag"\s*:\s*\{[^{}]*?"mac"\s*:\s*"([0-9A-Fa-f]{12})"')
+
+STOP = object()  # Sentinel telling a worker to exit
+
+def extract_tag_mac(payload: bytes) -> Optional[str]:
+    """Return the tag MAC from a raw engine/+/positions payload, or None if not found"""
+    match = TAG_MAC_PATTERN.search(payload)
+    return match.group(1).decode("ascii").lower() if match else None
+
+class IngestionPipeline:
+    """Bounded per-partition queues drained by one worker thread each"""
+
+    def __init__(self, handler: Callable[[bytes], None], workers: int = 4,
+                 queue_size: int = 10000, policy: str = DROP_OLDEST, name: str = "ingest"):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {BACKPRESSURE_POLICIES}")
+        self.handler = handler
+        self.policy = policy
+        self.name = name
+        self.queue_size = queue_size
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=max(1, queue_size // max(1, workers)))
+                                          for _ in range(max(1, workers))]
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.enqueued = 0
+        self.processed = 0
+        self.errors = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start one worker per partition"""
+        for i, partition in enumerate(self.queues):
+            thread = threading.Thread(target=self.worker, args=(partition,), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def partition_for(self, payload: bytes) -> queue.Queue:
+        """Same tag MAC -> same worker, so each tag's rows stay in arrival order"""
+        tag_mac = extract_tag_mac(payload)
+        if tag_mac is None:
+            return self.queues[0]
+        return self.queues[zlib.crc32(tag_mac.encode("ascii")) % len(self.queues)]
+
+    def submit(self, payload: bytes) -> bool:
+        """Enqueue a raw payload from the network thread; returns False if it was dropped"""
+        partition = self.partition_for(payload)
+
+        if self.policy == BLOCK:
+            partition.put(payload)
+        elif self.policy == DROP_NEWEST:
+            try:
+                partition.put_nowait(payload)
+            except queue.Full:
+                with self.lock:
+                    self.dropped_newest += 1
+                return False
+        else:
+            while True:
+                try:
+                    partition.put_nowait(payload)
+                    break
+                except queue.Full:
+                    try:
+                        partition.get_nowait()
+                        partition.task_done()
+                        with self.lock:
+                            self.dropped_oldest += 1
+                    except queue.Empty:
+                        pass
+
+        with self.lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, partition.qsize())
+        return True
+
+    def worker(self, partition: queue.Queue):
+        while True:
+            payload = partition.get()
+            try:
+                if payload is STOP:
+                    return
+                self.handler(payload)
+                with self.lock:
+                    self.processed += 1
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                print(f"❌ Worker error: {e}")
+            finally:
+                partition.task_done()
+
+    def depth(self) -> int:
+        return sum(partition.qsize() for partition in self.queues)
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = 30.0):
+        """Stop the workers, by default after processing everything still queued"""
+        if drain:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for partition in self.queues:
+                while partition.unfinished_tasks and (deadline is None or time.monotonic() < deadline):
+                    time.sleep(0.05)
+        for partition in self.queues:
+            partition.put(STOP)
+        for thread in self.threads:
+            thread.join(timeout=5.0)
+        self.threads = []
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "workers": len(self.queues),
+                "policy": self.policy,
+                "queue_depth": self.depth(),
+                "max_queue_depth": self.max_depth,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "errors": self.errors,
+                "dropped_oldest": self.dropped_oldest,
+                "dropped_newest": self.dropped_newest,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Ingestion queue: depth {stats['queue_depth']} (max {stats['max_queue_depth']}) | "
+              f"{stats['workers']} workers, policy {stats['policy']} | "
+              f"enqueued {stats['enqueued']}, processed {stats['processed']}, errors {stats['errors']} | "
+              f"dropped oldest {stats['dropped_oldest']}, newest {stats['dropped_newest']}")
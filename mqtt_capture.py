@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Raw MQTT capture log and replay
+Captured engine/+/positions payloads are appended with their receive time to
+gzip-compressed, size-rolled segments. Replay feeds them back into either
+generator or floor_success_rate, as fast as possible or at N times real time.
+
+Usage:
+  python mqtt_capture.py info <capture_dir>
+  python mqtt_capture.py replay <capture_dir> <generate_ml_data|generate_ml_data_exte|floor_success_rate> [--speed N]
+"""
+
+from typing import Callable, Iterator, Optional, Tuple
+import argparse, gzip, glob, importlib, os, struct, threading, time, zlib
+
+RECORD_HEADER = struct.Struct("<dHI")  # receive time, topic length, payload length
+SEGMENT_PATTERN = "positions-*.bin.gz"
+
+class CaptureWriter:
+    """Append-only writer rolling to a new compressed segment every segment_bytes of payload"""
+
+    def __init__(self, capture_dir: str, segment_bytes: int = 64 * 1024 * 1024, flush_interval: float = 5.0):
+        self.capture_dir = capture_dir
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval  # Sync-flush the compressor at most this often (seconds)
+        self.segment = None
+        self.segment_path = None
+        self.segment_size = 0
+        self.segment_index = 0
+        self.session = time.strftime("%Y%m%d-%H%M%S")
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.lock = threading.Lock()  # Several broker clients may capture at once
+        os.makedirs(capture_dir, exist_ok=True)
+
+    def open_segment(self):
+        self.segment_path = os.path.join(self.capture_dir, f"positions-{self.session}-{self.segment_index:04d}.bin.gz")
+        self.segment = gzip.open(self.segment_path, "ab", compresslevel=6)
+        self.segment_size = 0
+        self.segment_index += 1
+
+    def write(self, topic: str, payload: bytes, received_at: Optional[float] = None):
+        """Append one message; received_at defaults to the current wall-clock time"""
+        topic_bytes = topic.encode("utf-8")
+        record = RECORD_HEADER.pack(time.time() if received_at is None else received_at,
+                                    len(topic_bytes), len(payload)) + topic_bytes + payload
+        with self.lock:
+            if self.segment is None or self.segment_size >= self.segment_bytes:
+                self.close_segment()
+                self.open_segment()
+            self.segment.write(record)
+            self.segment_size += len(record)
+            self.records += 1
+
+            now = time.monotonic()
+            if now - self.last_flush >= self.flush_interval:
+                self.segment.flush()  # Z_SYNC_FLUSH: everything so far is readable after a crash
+                self.last_flush = now
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def close(self):
+        with self.lock:
+            self.close_segment()
+
+def read_segment(path: str) -> Iterator[Tuple[float, str, bytes]]:
+    """Records of one segment; a truncated tail (crash while writing) ends the segment quietly"""
+    with gzip.open(path, "rb") as f:
+        try:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                received_at, topic_length, payload_length = RECORD_HEADER.unpack(header)
+                topic = f.read(topic_length)
+                payload = f.read(payload_length)
+                if len(topic) < topic_length or len(payload) < payload_length:
+                    return
+                yield received_at, topic.decode("utf-8"), payload
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            print(f"⚠️ {os.path.basename(path)} ends with an incomplete record ({e})")
+
+def read_capture(capture_dir: str) -> Iterator[Tuple[float, str, bytes]]:
+    """All records of a capture directory in segment order"""
+    for path in sorted(glob.glob(os.path.join(capture_dir, SEGMENT_PATTERN))):
+        yield from read_segment(path)
+
+class ReplayMessage:
+    """Stand-in for paho's MQTTMessage (topic and payload only)"""
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+class ReplayClient:
+    """Stand-in client so on_message handlers can call disconnect() to end the replay"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+def replay(capture_dir: str, on_payload: Callable[[str, bytes], None], speed: Optional[float] = None,
+           client: Optional[ReplayClient] = None) -> int:
+    """Feed captured messages to on_payload(topic, payload)
+
+    speed None replays as fast as possible, otherwise the original receive
+    intervals are kept, divided by speed. Returns the number of messages fed.
+    """
+    count = 0
+    first_received = None
+    replay_start = time.monotonic()
+    for received_at, topic, payload in read_capture(capture_dir):
+        if client is not None and client.disconnected:
+            break
+        if speed:
+            if first_received is None:
+                first_received = received_at
+            delay = (received_at - first_received) / speed - (time.monotonic() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+        on_payload(topic, payload)
+        count += 1
+    return count
+
+def print_info(capture_dir: str):
+    segments = sorted(glob.glob(os.path.join(capture_dir, SEGMENT_PATTERN)))
+    count = 0
+    payload_bytes = 0
+    first = last = None
+    for received_at, _, payload in read_capture(capture_dir):
+        count += 1
+        payload_bytes += len(payload)
+        first = received_at if first is None else first
+        last = received_at
+    compressed = sum(os.path.getsize(path) for path in segments)
+    print(f"📼 {capture_dir}: {len(segments)} segments, {count} messages")
+    if count:
+        print(f"   Span: {time.ctime(first)} → {time.ctime(last)} ({(last - first) / 60:.1f} minutes)")
+        print(f"   Payload: {payload_bytes / 1024 / 1024:.1f} MB raw, {compressed / 1024 / 1024:.1f} MB compressed")
+
+def replay_into_floor_success_rate(capture_dir: str, speed: Optional[float] = None) -> int:
+    """Re-evaluate floor success offline from a capture"""
+    import floor_success_rate
+
+    client = ReplayClient()
+    count = replay(capture_dir,
+                   lambda topic, payload: floor_success_rate.on_message(client, None, ReplayMessage(topic, payload)),
+                   speed, client)
+    floor_success_rate.print_final_stats()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay raw MQTT capture logs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info")
+    info_parser.add_argument("capture_dir")
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("capture_dir")
+    replay_parser.add_argument("target", choices=["generate_ml_data", "generate_ml_data_exte", "floor_success_rate"])
+    replay_parser.add_argument("--speed", type=float, default=None,
+                               help="Multiple of real time (default: as fast as possible)")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print_info(args.capture_dir)
+        return
+
+    started = time.monotonic()
+    if args.target == "floor_success_rate":
+        count = replay_into_floor_success_rate(args.capture_dir, args.speed)
+    else:
+        count = importlib.import_module(args.target).replay_runner(args.capture_dir, args.speed)
+    elapsed = time.monotonic() - started
+    print(f"📼 Replayed {count} messages in {elapsed:.1f}s ({count / elapsed if elapsed > 0 else 0:.0f} msg/s)")
+
+if __name__ == "__main__":
+    main()
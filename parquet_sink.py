@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Columnar Parquet sink for the extended training data
+Wide rows are batched per tag and written as Parquet row groups with typed
+columns (float32 RSSI, int8 used flags, dictionary-encoded map IDs), so
+readers can load only the columns they need. Requires pyarrow.
+"""
+
+from typing import Dict, Any, List, Optional, Sequence
+import glob, os, threading, time
+
+from buffered_csv import FlushPolicy
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Position columns that keep full double precision
+FLOAT64_COLUMNS = {"tag_x", "tag_y", "cov_xx", "cov_xy", "cov_yx", "cov_yy"}
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet output needs pyarrow: pip install pyarrow")
+
+def column_type(name: str):
+    """Arrow type for a wide-layout column name"""
+    if name in ("map_id", "true_map_id") or name.endswith("_map_id") or name.endswith("_signal_quality"):
+        return pa.dictionary(pa.int16(), pa.string())
+    if name == "position_timestamp":
+        return pa.int64()
+    if name in FLOAT64_COLUMNS:
+        return pa.float64()
+    if name.endswith("_used") and not name.endswith("_anchors_used"):
+        return pa.int8()
+    if name.endswith("_total_anchors") or name.endswith("_anchors_used") or name.endswith("_anchors_hearing"):
+        return pa.int16()
+    return pa.float32()
+
+def build_schema(header: Sequence[str]):
+    """Arrow schema matching the CSV header column for column"""
+    require_pyarrow()
+    return pa.schema([pa.field(name, column_type(name)) for name in header])
+
+def to_arrow_column(values: Sequence[Any], arrow_type):
+    """Convert one column of CSV-style cells ("" = missing) to an Arrow array"""
+    cleaned = [None if value == "" else value for value in values]
+    if pa.types.is_dictionary(arrow_type):
+        return pa.array([None if value is None else str(value) for value in cleaned], type=arrow_type)
+    return pa.array(cleaned, type=arrow_type)
+
+class ParquetTagWriter:
+    """Buffers one tag's rows and appends them to a Parquet file one row group at a time
+
+    Uses the same FlushPolicy as the CSV writers: max_rows is the row group
+    size and max_interval bounds how long rows wait in memory. The file is
+    only readable once close() has written the footer.
+    """
+
+    def __init__(self, path: str, schema, policy: Optional[FlushPolicy] = None):
+        require_pyarrow()
+        self.path = path
+        self.schema = schema
+        self.policy = policy or FlushPolicy(max_rows=256, max_interval=60.0)
+        self.rows: List[List[Any]] = []
+        self.writer = None
+        self.closed = False
+        self.rows_on_disk = 0
+        self.rows_synced = 0
+        self.bytes_on_disk = 0
+        self.first_buffered_at: Optional[float] = None
+        self.lock = threading.RLock()
+
+    @property
+    def rows_buffered(self) -> int:
+        return len(self.rows)
+
+    @property
+    def bytes_buffered(self) -> int:
+        return 0  # Rows are held as Python lists until the row group is written
+
+    def writerow(self, row: List[Any]):
+        """Buffer one row and write a row group once max_rows are buffered"""
+        with self.lock:
+            self.rows.append(row)
+            if self.first_buffered_at is None:
+                self.first_buffered_at = time.monotonic()
+            if len(self.rows) >= self.policy.max_rows:
+                self.flush()
+
+    def flush_due(self, now: Optional[float] = None) -> bool:
+        """Write a (smaller) row group if rows have waited longer than max_interval"""
+        if self.first_buffered_at is None:
+            return False
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.first_buffered_at is not None and now - self.first_buffered_at >= self.policy.max_interval:
+                self.flush()
+                return True
+        return False
+
+    def flush(self, sync: bool = False):
+        """Write buffered rows as one row group"""
+        with self.lock:
+            if not self.rows or self.closed:
+                return
+            columns = list(zip(*self.rows))
+            table = pa.Table.from_arrays(
+                [to_arrow_column(column, field.type) for column, field in zip(columns, self.schema)],
+                schema=self.schema
+            )
+            if self.writer is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+            self.writer.write_table(table)
+            self.rows_on_disk += len(self.rows)
+            self.rows = []
+            self.first_buffered_at = None
+
+    def close(self):
+        """Write remaining rows and the Parquet footer"""
+        with self.lock:
+            if self.closed:
+                return
+            self.flush()
+            if self.writer is not None:
+                self.writer.close()
+                self.bytes_on_disk = os.path.getsize(self.path)
+            self.rows_synced = self.rows_on_disk
+            self.closed = True
+
+def existing_row_count(tag_dir: str) -> int:
+    """Rows already stored for a tag, read from the Parquet footers only"""
+    require_pyarrow()
+    total = 0
+    for path in glob.glob(os.path.join(tag_dir, "*.parquet")):
+        try:
+            total += pq.ParquetFile(path).metadata.num_rows
+        except Exception as e:
+            print(f"Warning: Could not read Parquet metadata from {path}: {e}")
+    return total
+
+def open_parquet_writers(output_dir: str, tag_macs: Sequence[str], header: Sequence[str],
+                         policy: Optional[FlushPolicy] = None):
+    """One new part file per tag for this session: <output_dir>/<tag>/part-<start time>.parquet
+
+    Returns (writers, existing row counts per tag).
+    """
+    schema = build_schema(header)
+    part_name = f"part-{time.strftime('%Y%m%d-%H%M%S')}.parquet"
+    writers: Dict[str, ParquetTagWriter] = {}
+    counts: Dict[str, int] = {}
+    for tag_mac in tag_macs:
+        tag_dir = os.path.join(output_dir, tag_mac)
+        counts[tag_mac] = existing_row_count(tag_dir) if os.path.isdir(tag_dir) else 0
+        writers[tag_mac] = ParquetTagWriter(os.path.join(tag_dir, part_name), schema, policy)
+    return writers, counts
+
+def read_tag_columns(tag_dir: str, columns: Optional[List[str]] = None):
+    """Load only the requested columns of every part file of one tag as a DataFrame"""
+    require_pyarrow()
+    import pandas as pd
+
+    parts = sorted(glob.glob(os.path.join(tag_dir, "*.parquet")))
+    if not parts:
+        return pd.DataFrame(columns=columns or [])
+    table = pa.concat_tables([pq.read_table(path, columns=columns) for path in parts], promote_options="default")
+    frame = table.to_pandas()
+    # Dictionary columns come back as categoricals; CSV readers expect plain strings
+    for name in frame.columns:
+        if isinstance(frame[name].dtype, pd.CategoricalDtype):
+            frame[name] = frame[name].astype(object)
+    return frame
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Low-overhead hot-path metrics for the ingestion pipeline
+Per-stage latency histograms (fixed log-spaced buckets and per-thread
+counts, so recording is a bisect and two additions without a lock),
+counters bumped as events happen, and callback metrics (queue depth,
+buffered rows, bytes written) read only when someone looks. Exposed as
+Prometheus text on a local HTTP port and as a periodically rewritten JSON
+file.
+"""
+
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
+import bisect, json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("decode", "features", "assembly", "write", "flush")
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 5 µs ... ~10.5 s, doubling
+DEFAULT_BOUNDS: List[float] = [5e-6 * 2 ** i for i in range(22)]
+
+class LatencyHistogram:
+    """Cumulative latency histogram with interpolated quantiles
+
+    Each recording thread gets its own bucket counts (a shard), so observe()
+    takes no lock; readers merge the shards.
+    """
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = list(bounds)
+        self.local = threading.local()
+        self.shards: List[Tuple[List[int], List[float]]] = []  # (bucket counts, [sum, max]) per thread
+        self.lock = threading.Lock()  # Guards the shard list only
+
+    def new_shard(self) -> Tuple[List[int], List[float]]:
+        shard = ([0] * (len(self.bounds) + 1), [0.0, 0.0])  # Last bucket is +Inf
+        with self.lock:
+            self.shards.append(shard)
+        self.local.shard = shard
+        return shard
+
+    def observe(self, seconds: float):
+        try:
+            counts, totals = self.local.shard
+        except AttributeError:
+            counts, totals = self.new_shard()
+        counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        totals[0] += seconds
+        if seconds > totals[1]:
+            totals[1] = seconds
+
+    def merged(self) -> Tuple[List[int], int, float, float]:
+        """(bucket counts, count, sum, max) over all threads"""
+        with self.lock:
+            shards = list(self.shards)
+        counts = [0] * (len(self.bounds) + 1)
+        total_sum = largest = 0.0
+        for shard_counts, (shard_sum, shard_max) in shards:
+            counts = [a + b for a, b in zip(counts, shard_counts)]
+            total_sum += shard_sum
+            largest = max(largest, shard_max)
+        return counts, sum(counts), total_sum, largest
+
+    @property
+    def count(self) -> int:
+        return self.merged()[1]
+
+    def quantile(self, q: float, merged: Optional[Tuple[List[int], int, float, float]] = None) -> Optional[float]:
+        """Estimated q-quantile (linear within the bucket), None before any observation"""
+        counts, total, _, largest = self.merged() if merged is None else merged
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else largest
+                return min(largest, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return largest
+
+    def summary(self) -> Dict[str, Any]:
+        merged = self.merged()
+        _, total, total_sum, largest = merged
+        summary = {"count": total, "sum": total_sum, "max": largest}
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = self.quantile(q, merged)
+        return summary
+
+class PipelineMetrics:
+    """Stage histograms, counters and callback metrics of one generator process"""
+
+    def __init__(self, stages: Sequence[str] = STAGES, prefix: str = "rtls_",
+                 json_path: Optional[str] = None, json_interval: float = 60.0):
+        self.prefix = prefix
+        self.json_path = json_path  # Periodic JSON dump, None disables
+        self.json_interval = json_interval
+        self.started = time.time()
+        self.stages: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in stages}
+        self.counters: Dict[str, int] = {}
+        self.help: Dict[str, str] = {}
+        self.callbacks: Dict[str, Tuple[str, Callable[[], float]]] = {}  # name -> ("counter"|"gauge", read)
+        self.lock = threading.Lock()
+        self.last_dump = time.monotonic()
+
+    def observe(self, stage: str, seconds: float):
+        self.stages[stage].observe(seconds)
+
+    def count(self, name: str, amount: int = 1):
+        """Increment a counter (name without the _total suffix)"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def describe(self, name: str, help_text: str):
+        self.help[name] = help_text
+
+    def register(self, name: str, read: Callable[[], float], kind: str = "gauge", help_text: str = ""):
+        """Metric read from `read()` at scrape/dump time; kind "counter" for values that only grow"""
+        self.callbacks[name] = (kind, read)
+        if help_text:
+            self.help[name] = help_text
+
+    def read_callbacks(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        values = {}
+        for name, (kind, read) in list(self.callbacks.items()):
+            try:
+                values[name] = (kind, float(read()))
+            except Exception:
+                values[name] = (kind, None)  # A component that went away must not break the endpoint
+        return values
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything as plain JSON-able values"""
+        with self.lock:
+            counters = dict(self.counters)
+        callbacks = self.read_callbacks()
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": time.time() - self.started,
+            "stages": {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            "counters": dict(counters, **{name: value for name, (kind, value) in callbacks.items() if kind == "counter"}),
+            "gauges": {name: value for name, (kind, value) in callbacks.items() if kind == "gauge"},
+        }
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        p = self.prefix
+        lines = [f"# HELP {p}stage_seconds Processing time per pipeline stage",
+                 f"# TYPE {p}stage_seconds histogram"]
+        quantile_lines = []
+        for stage, histogram in self.stages.items():
+            merged = histogram.merged()
+            counts, total, total_sum, _ = merged
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + [None], counts):
+                cumulative += count
+                le = "+Inf" if bound is None else repr(bound)
+                lines.append(f'{p}stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{p}stage_seconds_sum{{stage="{stage}"}} {total_sum!r}')
+            lines.append(f'{p}stage_seconds_count{{stage="{stage}"}} {total}')
+            for q in QUANTILES:
+                value = histogram.quantile(q, merged)
+                if value is not None:
+                    quantile_lines.append(f'{p}stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {value!r}')
+        if quantile_lines:
+            lines += [f"# HELP {p}stage_latency_seconds Estimated per-stage latency quantiles (from the histogram buckets)",
+                      f"# TYPE {p}stage_latency_seconds gauge"] + quantile_lines
+
+        with self.lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            lines += [f"# HELP {p}{name}_total {self.help.get(name, name)}", f"# TYPE {p}{name}_total counter",
+                      f"{p}{name}_total {value}"]
+        for name, (kind, value) in sorted(self.read_callbacks().items()):
+            if value is None:
+                continue
+            metric = f"{p}{name}_total" if kind == "counter" else f"{p}{name}"
+            lines += [f"# HELP {metric} {self.help.get(name, name)}", f"# TYPE {metric} {kind}", f"{metric} {value!r}"]
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self):
+        """Atomically rewrite json_path with the current snapshot"""
+        if self.json_path is None:
+            return
+        temp_path = self.json_path + ".tmp"
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f, indent=1)
+            os.replace(temp_path, self.json_path)
+        except OSError as e:
+            print(f"⚠️ Could not write metrics to {self.json_path}: {e}")
+
+    def dump_due(self, now: Optional[float] = None) -> bool:
+        """Rewrite the JSON dump if json_interval seconds passed since the last one"""
+        now = time.monotonic() if now is None else now
+        if self.json_path is None or now - self.last_dump < self.json_interval:
+            return False
+        self.last_dump = now
+        self.dump_json()
+        return True
+
+    def print_stats(self):
+        parts = []
+        for stage, histogram in self.stages.items():
+            merged = histogram.merged()
+            if merged[1]:
+                p50, p95, p99 = (histogram.quantile(q, merged) * 1000 for q in QUANTILES)
+                parts.append(f"{stage} {p50:.2f}/{p95:.2f}/{p99:.2f}")
+        if parts:
+            print(f"Stage latency p50/p95/p99 (ms): {' | '.join(parts)}")
+
+class MetricsServer:
+    """GET /metrics on a local port, served from a daemon thread"""
+
+    def __init__(self, metrics: PipelineMetrics, port: int, host: str = "127.0.0.1"):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "MetricsServer":
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the console
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]  # Resolved when started with port 0
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
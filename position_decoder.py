@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Typed fast-path decoder for engine/+/positions payloads
+Parses the raw MQTT bytes straight into a compact PositionMessage, using
+orjson (or ujson) when installed and the stdlib json module otherwise
+"""
+
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import json
+
+# Pick the fastest JSON backend available
+try:
+    import orjson
+    JSON_BACKEND = "orjson"
+    fast_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        JSON_BACKEND = "ujson"
+        fast_loads = ujson.loads
+    except ImportError:
+        JSON_BACKEND = "json"
+        fast_loads = json.loads
+
+def json_loads(raw_payload: bytes) -> Any:
+    """Parse raw payload bytes, falling back to a lenient UTF-8 decode for malformed input"""
+    try:
+        return fast_loads(raw_payload)
+    except (ValueError, UnicodeDecodeError):
+        return json.loads(raw_payload.decode("utf-8", errors="replace"))
+
+class PositionMessage:
+    """One decoded position with its anchors stored as parallel lists (used anchors first)"""
+    
+    __slots__ = (
+        "tag_mac", "tag_id", "map_id", "timestamp", "x", "y", "covariance",
+        "anchor_mac", "anchor_used", "anchor_rssi", "anchor_x", "anchor_y",
+        "anchor_map_id", "anchor_cart_d", "anchor_signal_quality", "used_count"
+    )
+    
+    def __init__(self, tag_mac: str, tag_id: str, map_id: str, timestamp: int, x: float, y: float,
+                 covariance: Tuple[float, float, float, float]):
+        self.tag_mac = tag_mac
+        self.tag_id = tag_id
+        self.map_id = map_id
+        self.timestamp = timestamp
+        self.x = x
+        self.y = y
+        self.covariance = covariance  # (xx, xy, yx, yy)
+        self.anchor_mac: List[str] = []
+        self.anchor_used: List[int] = []
+        self.anchor_rssi: List[Any] = []  # None when the anchor carried no RSSI
+        self.anchor_x: List[Optional[float]] = []  # None when the anchor carried no coordinates
+        self.anchor_y: List[Optional[float]] = []
+        self.anchor_map_id: List[str] = []
+        self.anchor_cart_d: List[float] = []
+        self.anchor_signal_quality: List[Any] = []
+        self.used_count = 0
+        
+    def __len__(self) -> int:
+        return len(self.anchor_mac)
+        
+    def key(self) -> Tuple[str, int, str]:
+        """recent_keys.position_key of the message"""
+        return self.tag_mac, self.timestamp, self.map_id
+        
+    def anchors(self) -> Iterator[Tuple[Any, ...]]:
+        """(mac, used, rssi, x, y, map_id, cart_d, signal_quality) per anchor"""
+        return zip(self.anchor_mac, self.anchor_used, self.anchor_rssi, self.anchor_x, self.anchor_y,
+                   self.anchor_map_id, self.anchor_cart_d, self.anchor_signal_quality)
+                   
+    def add_anchors(self, anchors: List[Dict[str, Any]], used: int):
+        """Append used (1) or unused (0) anchor dicts to the parallel lists"""
+        for anchor in anchors:
+            self.anchor_mac.append(anchor["mac"])
+            self.anchor_used.append(used)
+            self.anchor_rssi.append(anchor.get("rssi"))
+            self.anchor_x.append(anchor.get("x"))
+            self.anchor_y.append(anchor.get("y"))
+            self.anchor_map_id.append(anchor.get("map_id", ""))
+            self.anchor_cart_d.append(anchor.get("cart_d", 0))
+            self.anchor_signal_quality.append(anchor.get("signal_quality", "") if used else "")
+        if used:
+            self.used_count += len(anchors)
+            
+    @classmethod
+    def from_dict(cls, position_data: Dict[str, Any]) -> "PositionMessage":
+        """Build from an already decoded message dict (raises KeyError on missing fields)"""
+        location = position_data["location"]
+        pos = location["position"]
+        cov = pos["covariance"]
+        message = cls(
+            position_data["tag"]["mac"],
+            str(position_data["tag"].get("id", "")),
+            location["map_id"],
+            position_data["timestamp"],
+            pos["x"],
+            pos["y"],
+            (cov[0][0], cov[0][1], cov[1][0], cov[1][1]),
+        )
+        message.add_anchors(pos.get("used_anchors", []), 1)
+        message.add_anchors(pos.get("unused_anchors", []), 0)
+        return message
+
+def decode_position(raw_payload: bytes) -> PositionMessage:
+    """Decode raw engine/+/positions bytes into a PositionMessage"""
+    return PositionMessage.from_dict(json_loads(raw_payload))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Sliding-window floor accuracy monitor
+Keeps the last `window` seconds of floor decisions as a ring of time
+buckets. Each bucket is one flat counter list (correct/wrong per tag, then
+a true x predicted floor confusion matrix), and running window totals are
+kept next to the ring, so recording a decision is a couple of list
+increments and expiring a bucket subtracts it once. Memory is fixed by the
+window and the number of tags, however long the monitor runs. Status lines
+follow FLOOR_SELECTION_ALGORITHM.md's [QUALITY STATUS] format.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+import math, time
+
+from tag_registry import TagRegistry, TAGS, FLOOR_NAMES
+
+EXCELLENT, DEGRADED, POOR, NO_DATA = "EXCELLENT", "DEGRADED", "POOR", "NO DATA"
+STATUS_ICONS = {EXCELLENT: "🟢", DEGRADED: "🟡", POOR: "🔴", NO_DATA: "⚪"}
+STATUS_NOTES = {EXCELLENT: "Algorithm performing well ✓", DEGRADED: "Check for issues ⚠️",
+                POOR: "URGENT: Algorithm needs attention! 🚨", NO_DATA: "No ground truth decisions in window"}
+
+class QualityMonitor:
+    """Windowed accuracy, confusion counts and status of the floor decisions of registered tags
+
+    The counts()/confusion()/tag_counts() readers report the window as of
+    the last record() or status(); status() first slides it to now.
+    """
+
+    def __init__(self, registry: TagRegistry = TAGS, window: float = 300.0, bucket_seconds: float = 10.0,
+                 interval: float = 120.0, excellent: float = 0.95, degraded: float = 0.80,
+                 clock: Callable[[], float] = time.monotonic):
+        self.registry = registry
+        self.floors = len(registry.map_ids)
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(1, math.ceil(window / bucket_seconds))
+        self.window = self.buckets * bucket_seconds
+        self.interval = interval  # Seconds between status lines
+        self.excellent = excellent  # Windowed accuracy at or above this is EXCELLENT
+        self.degraded = degraded  # ... at or above this DEGRADED, below it POOR
+        self.clock = clock
+        # Counter layout: [correct, wrong] per tag index, then confusion[true floor][predicted floor or unknown]
+        self.confusion_base = 2 * len(registry)
+        self.width = self.confusion_base + self.floors * (self.floors + 1)
+        self.ring: List[List[int]] = [[0] * self.width for _ in range(self.buckets)]
+        self.totals = [0] * self.width
+        self.started = clock()
+        self.slot = int(self.started // bucket_seconds)
+        self.current = self.ring[self.slot % self.buckets]
+        self.slot_end = (self.slot + 1) * bucket_seconds
+        self.last_emit = self.started
+        self.decisions = 0  # All decisions ever recorded
+
+    def advance(self, now: float):
+        """Move to the bucket of `now`, expiring the buckets that fell out of the window"""
+        slot = int(now // self.bucket_seconds)
+        for step in range(min(slot - self.slot, self.buckets)):
+            bucket = self.ring[(self.slot + 1 + step) % self.buckets]
+            if any(bucket):
+                self.totals = [total - count for total, count in zip(self.totals, bucket)]
+                bucket[:] = [0] * self.width
+        if slot > self.slot:
+            self.slot = slot
+            self.current = self.ring[slot % self.buckets]
+            self.slot_end = (slot + 1) * self.bucket_seconds
+
+    def record(self, tag_index: int, predicted_floor: int, now: Optional[float] = None) -> bool:
+        """One floor decision of a registered tag (predicted_floor < 0: unknown map); True if correct"""
+        now = self.clock() if now is None else now
+        if now >= self.slot_end:
+            self.advance(now)
+        true_floor = self.registry.floors[tag_index]
+        correct = predicted_floor == true_floor
+        current, totals = self.current, self.totals
+        key = 2 * tag_index + (not correct)
+        current[key] += 1
+        totals[key] += 1
+        key = self.confusion_base + true_floor * (self.floors + 1) + (predicted_floor if predicted_floor >= 0 else self.floors)
+        current[key] += 1
+        totals[key] += 1
+        self.decisions += 1
+        return correct
+
+    def confusion(self) -> List[List[int]]:
+        """Window counts [true floor][predicted floor], last column for unknown maps"""
+        row = self.floors + 1
+        return [self.totals[self.confusion_base + floor * row:self.confusion_base + (floor + 1) * row]
+                for floor in range(self.floors)]
+
+    def floor_counts(self) -> List[Tuple[int, int]]:
+        """(correct, total) per true floor in the window"""
+        return [(counts[floor], sum(counts)) for floor, counts in enumerate(self.confusion())]
+
+    def counts(self) -> Tuple[int, int]:
+        """(correct, wrong) in the window"""
+        per_floor = self.floor_counts()
+        correct = sum(correct for correct, _ in per_floor)
+        return correct, sum(total for _, total in per_floor) - correct
+
+    def tag_counts(self, tag_index: int) -> Tuple[int, int]:
+        return self.totals[2 * tag_index], self.totals[2 * tag_index + 1]
+
+    def worst_tags(self, count: int = 5) -> List[Tuple[str, int, int]]:
+        """(tag MAC, wrong, total) of the tags with the most wrong decisions in the window"""
+        wrong = [(self.totals[2 * index + 1], index) for index in range(len(self.registry)) if self.totals[2 * index + 1]]
+        wrong.sort(key=lambda item: (-item[0], item[1]))  # Most misses first, then registry order
+        return [(self.registry.macs[index], misses, misses + self.totals[2 * index]) for misses, index in wrong[:count]]
+
+    def classify(self, accuracy: Optional[float]) -> str:
+        if accuracy is None:
+            return NO_DATA
+        if accuracy >= self.excellent:
+            return EXCELLENT
+        return DEGRADED if accuracy >= self.degraded else POOR
+
+    def status(self, now: Optional[float] = None) -> Dict[str, object]:
+        now = self.clock() if now is None else now
+        self.advance(now)
+        correct, wrong = self.counts()
+        accuracy = correct / (correct + wrong) if correct + wrong else None
+        return {
+            "status": self.classify(accuracy),
+            "accuracy": accuracy,
+            "correct": correct,
+            "wrong": wrong,
+            "floors": self.floor_counts(),
+            "confusion": self.confusion(),
+            "window_seconds": min(self.window, now - self.started),
+        }
+
+    def status_lines(self, now: Optional[float] = None) -> List[str]:
+        status = self.status(now)
+        label = status["status"]
+        accuracy = f"{status['accuracy'] * 100:.1f}%" if status["accuracy"] is not None else "-"
+        floors = ", ".join(f"Floor{floor}: {correct / total * 100:.1f}% ({correct}/{total})" if total else f"Floor{floor}: -"
+                           for floor, (correct, total) in enumerate(status["floors"]))
+        lines = [f"{STATUS_ICONS[label]} [QUALITY STATUS] {label}: {accuracy} accuracy "
+                 f"({status['correct']} correct, {status['wrong']} wrong) | {floors} | "
+                 f"Window: {status['window_seconds'] / 60:.1f}min | {STATUS_NOTES[label]}"]
+        if status["wrong"]:
+            names = list(FLOOR_NAMES[:self.floors]) + ["unknown"]
+            confusion = ", ".join(f"{FLOOR_NAMES[true]}→{names[predicted]} {count}"
+                                  for true, row in enumerate(status["confusion"])
+                                  for predicted, count in enumerate(row) if count and predicted != true)
+            worst = ", ".join(f"{mac[:6]} {misses}/{total}" for mac, misses, total in self.worst_tags())
+            lines.append(f"   Misclassified (true→predicted): {confusion} | Worst tags: {worst}")
+        return lines
+
+    def emit_due(self, now: Optional[float] = None) -> bool:
+        """Print the status if `interval` seconds passed since the last one"""
+        now = self.clock() if now is None else now
+        if now - self.last_emit < self.interval:
+            return False
+        self.last_emit = now
+        for line in self.status_lines(now):
+            print(line)
+        return True
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Bounded index of recently seen keys
+Used to drop positions delivered more than once, e.g. by several broker
+tunnels carrying the same stream, QoS redeliveries after a reconnect or two
+engines publishing the same position. Keys are forgotten once they are
+older than the time window or when capacity is exceeded (oldest first), so
+memory stays bounded however long the collection runs.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import re, threading, time
+
+# Cheap scans of a raw engine/+/positions payload for the parts of position_key
+RAW_TAG_MAC = re.compile(rb'"tag"\s*:\s*\{[^{}]*?"mac"\s*:\s*"([^"]*)"')
+RAW_MAP_ID = re.compile(rb'"location"\s*:\s*\{[^{}]*?"map_id"\s*:\s*"([^"]*)"')
+RAW_TIMESTAMP = re.compile(rb'"timestamp"\s*:\s*([^,}\s]+)')
+
+def position_key(position_data: Dict[str, Any]) -> Tuple[Any, Any, Any]:
+    """(tag MAC, timestamp, map ID) identifying one position across redeliveries"""
+    return position_data["tag"]["mac"], position_data["timestamp"], position_data["location"]["map_id"]
+
+def raw_position_key(payload: bytes) -> Optional[Tuple[Any, Any, Any]]:
+    """position_key of a raw payload without decoding it, None if it cannot be read off unambiguously"""
+    mac = RAW_TAG_MAC.search(payload)
+    map_id = RAW_MAP_ID.search(payload)
+    timestamps = RAW_TIMESTAMP.findall(payload)
+    if (mac is None or map_id is None or len(timestamps) != 1 or not timestamps[0].lstrip(b"-").isdigit()
+            or b"\\" in mac.group(1) + map_id.group(1)):
+        return None
+    return mac.group(1).decode("utf-8"), int(timestamps[0]), map_id.group(1).decode("utf-8")
+
+class RecentKeyIndex:
+    """Thread-safe LRU set of the last `capacity` keys seen within `window` seconds (None: no time limit)"""
+
+    def __init__(self, capacity: int = 20000, window: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.window = window
+        self.clock = clock
+        self.keys: "OrderedDict[Hashable, float]" = OrderedDict()  # key -> last seen, oldest first
+        self.lock = threading.Lock()
+        self.duplicates = 0  # Keys reported as already seen
+        self.unique = 0      # Keys seen for the first time
+        self.expired = 0     # Keys forgotten because they fell out of the window
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def duplicate_rate(self) -> float:
+        """Fraction of all keys checked that were duplicates"""
+        total = self.duplicates + self.unique
+        return self.duplicates / total if total else 0.0
+
+    def seen(self, key: Hashable) -> bool:
+        """Return True if key is already in the index, otherwise add it and return False"""
+        now = self.clock()
+        with self.lock:
+            if self.window is not None:
+                self.expire(now - self.window)
+            if key in self.keys:
+                self.keys[key] = now
+                self.keys.move_to_end(key)
+                self.duplicates += 1
+                return True
+            self.keys[key] = now
+            self.unique += 1
+            if len(self.keys) > self.capacity:
+                self.keys.popitem(last=False)
+            return False
+
+    def expire(self, cutoff: float):
+        """Drop keys last seen before cutoff (caller holds the lock)"""
+        keys = self.keys
+        while keys:
+            oldest = next(iter(keys))
+            if keys[oldest] >= cutoff:
+                return
+            del keys[oldest]
+            self.expired += 1
+
+    def summary(self) -> str:
+        return (f"{self.unique} unique, {self.duplicates} duplicates dropped "
+                f"({self.duplicate_rate * 100:.2f}%), {len(self.keys)} keys remembered")
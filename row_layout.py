@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Precompiled CSV row layout for the ML data generators
+Built once from generate_csv_header so each position message only has to
+scatter the anchors it actually heard into a copy of a prefilled row
+"""
+
+from typing import Dict, Any, List, Optional, Sequence
+
+# Columns written for every anchor, in header order
+ANCHOR_FIELDS: List[str] = ["rssi", "used", "x", "y", "map_id", "distance", "signal_quality"]
+ANCHOR_WIDTH = len(ANCHOR_FIELDS)
+
+# Columns written for every map, in header order
+MAP_STAT_FIELDS: List[str] = [
+    "total_anchors", "anchors_used", "anchors_hearing", "avg_rssi",
+    "max_rssi", "min_rssi", "rssi_std", "rssi_range"
+]
+MAP_STAT_WIDTH = len(MAP_STAT_FIELDS)
+
+# Leading position columns (map_id ... true_map_id)
+BASE_WIDTH = 9
+
+# Cells for an anchor that was not heard and has no known position
+EMPTY_ANCHOR_CELLS: List[Any] = ["", 0, "", "", "", "", ""]
+
+class RowLayout:
+    """Column offsets and default row compiled from a CSV header"""
+
+    def __init__(self, header: List[str], map_ids: Sequence[str],
+                 anchor_database: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.header = header
+        self.width = len(header)
+        column_index = {name: i for i, name in enumerate(header)}
+
+        # Offset of the first per-map statistics column for each map
+        self.map_offsets: Dict[str, int] = {
+            map_id: column_index[f"{map_id}_total_anchors"] for map_id in map_ids
+        }
+
+        # Offset of the "<mac>_rssi" column; the anchor's 7 cells follow it
+        self.anchor_offsets: Dict[str, int] = {}
+        for i, name in enumerate(header):
+            if name.endswith("_rssi") and i + 1 < self.width and header[i + 1] == f"{name[:-5]}_used":
+                self.anchor_offsets[name[:-5]] = i
+
+        # Default row: not-heard values for every anchor, database positions where known
+        self.template: List[Any] = [""] * self.width
+        for anchor_mac, offset in self.anchor_offsets.items():
+            self.template[offset:offset + ANCHOR_WIDTH] = self.default_anchor_cells(anchor_mac, anchor_database)
+
+    @staticmethod
+    def default_anchor_cells(anchor_mac: str,
+                             anchor_database: Optional[Dict[str, Dict[str, Any]]]) -> List[Any]:
+        """Cells written for an anchor that was not heard in a message"""
+        if anchor_database and anchor_mac in anchor_database:
+            db_anchor = anchor_database[anchor_mac]
+            return ["", 0, db_anchor["x"], db_anchor["y"], db_anchor["map_id"], 0, ""]
+        return list(EMPTY_ANCHOR_CELLS)
+
+    def new_row(self) -> List[Any]:
+        """Return a fresh copy of the default row"""
+        return self.template.copy()
+
+    def set_base(self, row: List[Any], values: Sequence[Any]):
+        """Write the leading position columns"""
+        row[0:BASE_WIDTH] = values
+
+    def set_map_stats(self, row: List[Any], map_id: str, values: Sequence[Any]):
+        """Write the 8 statistics columns for one map"""
+        offset = self.map_offsets[map_id]
+        row[offset:offset + MAP_STAT_WIDTH] = values
+
+    def set_anchor(self, row: List[Any], anchor_mac: str, values: Sequence[Any]) -> bool:
+        """Write the 7 cells of a heard anchor; anchors outside the header are skipped"""
+        offset = self.anchor_offsets.get(anchor_mac)
+        if offset is None:
+            return False
+        row[offset:offset + ANCHOR_WIDTH] = values
+        return True
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+One-pass per-map RSSI statistics
+A single sweep over the heard anchors fills an accumulator (count, used
+count, mean/variance, min/max) for every map ID. Integer RSSI is summed
+exactly, so avg and std equal statistics.mean/stdev to the last digit;
+float RSSI goes through a Welford update.
+"""
+
+from typing import Dict, Any, Iterable, List, Sequence, Union
+import math, sys
+
+SQRT_BIT_WIDTH = 2 * sys.float_info.mant_dig + 3  # Bits of the integer root that make rounding to float exact
+
+def exact_mean(total: int, count: int) -> Union[int, float]:
+    """statistics.mean of `count` ints summing to `total`: an int when it divides evenly"""
+    return total // count if total % count == 0 else total / count  # int / int is correctly rounded
+
+def exact_stdev(total: int, squares: int, count: int) -> float:
+    """statistics.stdev of `count` (>= 2) ints from their exact sum and sum of squares"""
+    return sqrt_of_fraction(count * squares - total * total, count * (count - 1))
+
+def sqrt_of_fraction(numerator: int, denominator: int) -> float:
+    """Square root of numerator / denominator, correctly rounded (the way statistics.stdev rounds)"""
+    shift = (numerator.bit_length() - denominator.bit_length() - SQRT_BIT_WIDTH) // 2
+    if shift >= 0:
+        return float(integer_sqrt_of_fraction(numerator, denominator << 2 * shift) << shift)
+    return integer_sqrt_of_fraction(numerator << -2 * shift, denominator) / (1 << -shift)
+
+def integer_sqrt_of_fraction(numerator: int, denominator: int) -> int:
+    """Integer square root of numerator / denominator, rounded to odd so the final float rounding is exact"""
+    root = math.isqrt(numerator // denominator)
+    return root | (root * root * denominator != numerator)
+
+class MapStats:
+    """Streaming RSSI statistics for the anchors of one map"""
+
+    __slots__ = ("total", "used", "rssi_count", "sum", "squares", "mean", "m2", "min", "max", "all_int")
+
+    def __init__(self):
+        self.total = 0        # Anchors heard on this map
+        self.used = 0         # ...of which used for the position
+        self.rssi_count = 0   # ...of which carried an RSSI value
+        self.sum = 0          # Exact sum and sum of squares, while every RSSI is an int
+        self.squares = 0
+        self.mean = 0.0       # Welford mean and sum of squared deviations, used once a float shows up
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.all_int = True   # statistics.mean returns an int for integral means of ints
+
+    def add(self, rssi: Any, used: int):
+        """Add one anchor; empty or missing RSSI only counts towards the anchor totals"""
+        self.total += 1
+        if used == 1:
+            self.used += 1
+        if rssi == "" or rssi is None:
+            return
+
+        self.rssi_count += 1
+        if self.all_int:
+            if isinstance(rssi, int):
+                self.sum += rssi
+                self.squares += rssi * rssi
+            else:
+                self.all_int = False
+        delta = rssi - self.mean
+        self.mean += delta / self.rssi_count
+        self.m2 += delta * (rssi - self.mean)
+        if self.min is None or rssi < self.min:
+            self.min = rssi
+        if self.max is None or rssi > self.max:
+            self.max = rssi
+            
+    @property
+    def avg(self) -> Union[int, float]:
+        return exact_mean(self.sum, self.rssi_count) if self.all_int else self.mean
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (0 for a single value, like the CSV columns)"""
+        if self.rssi_count < 2:
+            return 0
+        if self.all_int:
+            return exact_stdev(self.sum, self.squares, self.rssi_count)
+        return math.sqrt(self.m2 / (self.rssi_count - 1))
+
+    def values(self) -> List[Any]:
+        """The 8 per-map CSV cells: total, used, hearing, avg, max, min, std, range"""
+        if self.rssi_count == 0:
+            return [self.total, self.used, self.total, "", "", "", "", ""]
+
+        return [self.total, self.used, self.total, self.avg, self.max, self.min, self.std, self.max - self.min]
+
+def sweep_map_stats(anchors: Iterable[Dict[str, Any]], map_ids: Sequence[str]) -> Dict[str, MapStats]:
+    """Accumulate statistics for every map in one pass; anchors on other maps are ignored"""
+    stats = {map_id: MapStats() for map_id in map_ids}
+    for anchor in anchors:
+        map_stats = stats.get(anchor["map_id"])
+        if map_stats is not None:
+            map_stats.add(anchor["rssi"], anchor["used"])
+    return stats
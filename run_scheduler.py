@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Run bookkeeping for the floor success evaluation
+A run samples the first message of each tag. It closes once `quorum`
+different tags were sampled, or when its deadline passes, so one or two
+silent tags cannot stall the evaluation; the tags a run closed without are
+counted as stragglers. Up to `depth` runs can be open at once: a tag
+already sampled in the oldest open run goes into the next one instead of
+being discarded. A tag is sampled at most once per run and in run order, so
+with depth 1 and no deadline this is the original wait-for-N-tags rule.
+"""
+
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+import time
+
+from tag_registry import TagRegistry, TAGS
+
+QUORUM, DEADLINE = "quorum", "deadline"
+
+class Run:
+    """One run: which tags were sampled, when it opened and why it closed"""
+    __slots__ = ("number", "opened", "published", "count", "closed_by", "closed")
+    
+    def __init__(self, number: int, opened: float, tag_count: int):
+        self.number = number
+        self.opened = opened
+        self.published = bytearray(tag_count)  # 1 for each tag index sampled in this run
+        self.count = 0
+        self.closed_by: Optional[str] = None  # QUORUM or DEADLINE once closed
+        self.closed = 0.0
+        
+    def stragglers(self) -> List[int]:
+        """Indices of the tags not sampled in this run"""
+        return [index for index, sampled in enumerate(self.published) if not sampled]
+
+class RunScheduler:
+    """Assigns tag messages to open runs and closes runs on quorum or deadline (deadline None: quorum only)"""
+    
+    def __init__(self, registry: TagRegistry = TAGS, total_runs: int = 20, quorum: int = 56,
+                 deadline: Optional[float] = None, depth: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.registry = registry
+        self.total_runs = total_runs
+        self.quorum = min(quorum, len(registry))
+        self.deadline = deadline  # Seconds a run stays open without reaching the quorum
+        self.depth = max(1, depth)  # Runs open at the same time
+        self.clock = clock
+        self.open_runs: Deque[Run] = deque()  # Oldest first, numbers consecutive
+        self.last_run = [0] * len(registry)  # Last run number each tag was sampled in (runs count from 1)
+        self.missed = registry.counters()  # Closed runs each tag was not sampled in
+        self.opened = 0
+        self.closed = 0
+        self.closed_by_quorum = 0
+        self.closed_by_deadline = 0
+        self.sampled = 0    # Messages assigned to a run
+        self.discarded = 0  # Messages of tags already sampled in every run that could be open
+        
+    @property
+    def finished(self) -> bool:
+        return self.closed >= self.total_runs
+        
+    def assign(self, tag_index: int, now: Optional[float] = None) -> Optional[Run]:
+        """Sample the tag into the oldest open run it is not in yet (opening one if allowed), None to discard"""
+        now = self.clock() if now is None else now
+        open_runs = self.open_runs
+        oldest = open_runs[0].number if open_runs else self.opened + 1
+        target = max(self.last_run[tag_index] + 1, oldest)  # Runs closed without the tag are skipped
+        if target <= self.opened:
+            run = open_runs[target - oldest]
+        elif len(open_runs) < self.depth and self.opened < self.total_runs:
+            self.opened += 1
+            run = Run(self.opened, now, len(self.registry))
+            open_runs.append(run)
+        else:
+            self.discarded += 1
+            return None
+        run.published[tag_index] = 1
+        run.count += 1
+        self.last_run[tag_index] = run.number
+        self.sampled += 1
+        return run
+        
+    def close_due(self, now: Optional[float] = None) -> List[Run]:
+        """Close the leading runs that reached the quorum or their deadline, oldest first
+        
+        A later run never has more tags than an earlier open one, and opened
+        later, so only the oldest open run can be due.
+        """
+        now = self.clock() if now is None else now
+        closed = []
+        open_runs = self.open_runs
+        while open_runs:
+            run = open_runs[0]
+            if run.count >= self.quorum:
+                run.closed_by = QUORUM
+                self.closed_by_quorum += 1
+            elif self.deadline is not None and now - run.opened >= self.deadline:
+                run.closed_by = DEADLINE
+                self.closed_by_deadline += 1
+            else:
+                break
+            open_runs.popleft()
+            run.closed = now
+            self.closed += 1
+            for index in run.stragglers():
+                self.missed[index] += 1
+            closed.append(run)
+        return closed
+        
+    def worst_stragglers(self, count: int = 5) -> List[Tuple[str, int]]:
+        """(tag ID, runs missed) of the tags missing from the most closed runs"""
+        missed = sorted((-misses, index) for index, misses in enumerate(self.missed) if misses)
+        return [(self.registry.ids[index], -misses) for misses, index in missed[:count]]
+        
+    def summary(self) -> str:
+        return (f"{self.closed}/{self.total_runs} runs closed ({self.closed_by_quorum} by quorum of {self.quorum}, "
+                f"{self.closed_by_deadline} by deadline), {self.sampled} messages sampled, {self.discarded} discarded")
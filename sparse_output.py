@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Sparse long-format output for the ML training data
+Instead of 7 mostly-empty cells for each of ~240 anchors, every position is
+written as one row in <tag>.positions.csv plus one row per heard anchor in
+<tag>.anchors.csv. Anchor coordinates live once in anchor_table.csv.
+load_wide() re-pivots a tag back to the wide layout on demand.
+
+The two files of a tag are flushed independently, so after a crash either
+can hold seqs the other lost. Numbering resumes after the highest seq in
+either file (kept in the directory's manifest.json, rescanned only when
+stale), so a seq is never handed out twice.
+"""
+
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+import csv, os
+
+from buffered_csv import BufferedCSVWriter, FlushPolicy
+from csv_manifest import CSVManifest
+from row_layout import MAP_STAT_FIELDS
+from anchor_observations import AnchorObservations
+
+BASE_COLUMNS: List[str] = [
+    "map_id", "position_timestamp", "tag_x", "tag_y",
+    "cov_xx", "cov_xy", "cov_yx", "cov_yy", "true_map_id"
+]
+OBSERVATION_COLUMNS: List[str] = ["seq", "anchor", "rssi", "used", "distance", "signal_quality"]
+ANCHOR_TABLE_COLUMNS: List[str] = ["anchor", "x", "y", "map_id"]
+ANCHOR_TABLE_FILE = "anchor_table.csv"
+
+def position_columns(map_ids: Sequence[str]) -> List[str]:
+    """Header of <tag>.positions.csv: sequence number, position columns, per-map statistics"""
+    header = ["seq"] + BASE_COLUMNS
+    for map_id in map_ids:
+        header.extend(f"{map_id}_{field}" for field in MAP_STAT_FIELDS)
+    return header
+
+class SparseSink:
+    """Per-tag position/observation writers plus the shared anchor table"""
+
+    def __init__(self, output_dir: str, map_ids: Sequence[str], policy: Optional[FlushPolicy] = None):
+        self.output_dir = output_dir
+        self.map_ids = list(map_ids)
+        self.policy = policy
+        self.writers: Dict[str, BufferedCSVWriter] = {}
+        self.next_seq: Dict[str, int] = {}
+        self.anchor_table: Dict[str, Tuple[Any, Any, Any]] = {}
+        self.anchor_writer: Optional[BufferedCSVWriter] = None
+        self.manifest = CSVManifest(output_dir)  # Rows and last seq per file, keyed by writer name
+
+    def open_writer(self, filename: str, header: List[str], mark_column: Optional[int] = None) -> BufferedCSVWriter:
+        write_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        file_handle = open(filename, 'a', newline='')
+        if write_header:
+            csv.writer(file_handle).writerow(header)
+            file_handle.flush()
+        return BufferedCSVWriter(file_handle, self.policy, mark_column=mark_column)
+
+    def open(self, tag_macs: Sequence[str]) -> Dict[str, int]:
+        """Open all files for appending; returns the positions already stored per tag"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest.load()
+
+        table_path = os.path.join(self.output_dir, ANCHOR_TABLE_FILE)
+        if os.path.exists(table_path):
+            with open(table_path, 'r', newline='') as f:
+                for record in csv.DictReader(f):
+                    self.anchor_table[record["anchor"]] = (record["x"], record["y"], record["map_id"])
+        self.anchor_writer = self.open_writer(table_path, ANCHOR_TABLE_COLUMNS)
+        self.writers["anchor_table"] = self.anchor_writer
+
+        counts = {}
+        for tag_mac in tag_macs:
+            last_seq = -1
+            for name, header in ((f"{tag_mac}.positions", position_columns(self.map_ids)),
+                                 (f"{tag_mac}.anchors", OBSERVATION_COLUMNS)):
+                path = os.path.join(self.output_dir, f"{name}.csv")
+                self.writers[name] = self.open_writer(path, header, mark_column=0)  # seq is column 0
+                rows = self.manifest.seed(name, path, header)
+                if rows and self.manifest.entries[name].get("last_seq") is not None:
+                    last_seq = max(last_seq, self.manifest.entries[name]["last_seq"])
+                if name.endswith(".positions"):
+                    counts[tag_mac] = rows
+            self.next_seq[tag_mac] = last_seq + 1
+        self.save()
+        return counts
+
+    def save(self):
+        """Rewrite manifest.json from what the writers have flushed"""
+        self.manifest.save(self.writers)
+
+    def record_anchor(self, anchor_mac: str, x: Any, y: Any, map_id: Any):
+        """Append to the anchor table when an anchor's known position changes"""
+        if x in ("", None) or y in ("", None) or (x == 0 and y == 0):
+            if anchor_mac in self.anchor_table:
+                return
+            x, y = "", ""
+        entry = (str(x), str(y), str(map_id))
+        if self.anchor_table.get(anchor_mac) != entry:
+            self.anchor_table[anchor_mac] = entry
+            self.anchor_writer.writerow([anchor_mac, x, y, map_id])
+
+    def write_position(self, tag_mac: str, base: Sequence[Any], map_stats: Dict[str, Sequence[Any]],
+                       anchors: AnchorObservations):
+        """Write one position row and one observation row per heard anchor"""
+        seq = self.next_seq[tag_mac]
+        self.next_seq[tag_mac] = seq + 1
+
+        row = [seq]
+        row.extend(base)
+        for map_id in self.map_ids:
+            row.extend(map_stats[map_id])
+        self.writers[f"{tag_mac}.positions"].writerow(row)
+
+        observations = self.writers[f"{tag_mac}.anchors"]
+        for anchor_mac, rssi, used, x, y, map_id, distance, signal_quality in anchors.entries():
+            observations.writerow([seq, anchor_mac, rssi, used, distance, signal_quality])
+            self.record_anchor(anchor_mac, x, y, map_id)
+
+    def file_handles(self) -> Dict[str, Any]:
+        return {name: writer.file_handle for name, writer in self.writers.items()}
+
+def load_anchor_table(sparse_dir: str):
+    """Anchor table as a DataFrame indexed by anchor MAC (last known position wins)"""
+    import pandas as pd
+
+    table = pd.read_csv(os.path.join(sparse_dir, ANCHOR_TABLE_FILE), dtype={"anchor": str, "map_id": str})
+    return table.drop_duplicates("anchor", keep="last").set_index("anchor")
+
+def load_wide(sparse_dir: str, tag_mac: str, anchor_macs: Optional[Sequence[str]] = None):
+    """Re-pivot one tag's sparse files into the wide per-anchor layout
+
+    Anchors that were not heard get an empty RSSI, used = 0 and their
+    anchor-table coordinates; anchor_macs defaults to every anchor in the table.
+    """
+    import pandas as pd
+
+    positions = pd.read_csv(os.path.join(sparse_dir, f"{tag_mac}.positions.csv"), dtype={"map_id": str, "true_map_id": str})
+    observations = pd.read_csv(os.path.join(sparse_dir, f"{tag_mac}.anchors.csv"), dtype={"anchor": str})
+    anchor_table = load_anchor_table(sparse_dir)
+    anchor_macs = sorted(anchor_macs if anchor_macs is not None else anchor_table.index)
+
+    observations = observations[observations["anchor"].isin(anchor_macs)]
+    pivoted = observations.pivot_table(index="seq", columns="anchor",
+                                       values=["rssi", "used", "distance", "signal_quality"],
+                                       aggfunc="last")
+
+    wide = positions.set_index("seq")
+    columns = {}
+    for anchor_mac in anchor_macs:
+        def heard(field):
+            if (field, anchor_mac) in pivoted.columns:
+                return pivoted[(field, anchor_mac)].reindex(wide.index)
+            return pd.Series(float("nan"), index=wide.index)
+
+        coords = anchor_table.loc[anchor_mac] if anchor_mac in anchor_table.index else None
+        columns[f"{anchor_mac}_rssi"] = heard("rssi")
+        columns[f"{anchor_mac}_used"] = heard("used").fillna(0).astype(int)
+        columns[f"{anchor_mac}_x"] = coords["x"] if coords is not None else float("nan")
+        columns[f"{anchor_mac}_y"] = coords["y"] if coords is not None else float("nan")
+        columns[f"{anchor_mac}_map_id"] = coords["map_id"] if coords is not None else float("nan")
+        columns[f"{anchor_mac}_distance"] = heard("distance")
+        columns[f"{anchor_mac}_signal_quality"] = heard("signal_quality")
+
+    wide = pd.concat([wide, pd.DataFrame(columns, index=wide.index)], axis=1)
+    return wide.reset_index(drop=True)
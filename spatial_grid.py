@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Fixed-size spatial accumulators for floor decisions
+Success and failure counts per square cell over fixed floor bounds, updated
+one position at a time (or a whole array at once), instead of keeping every
+position. Memory is set by the bounds and the cell size, and rendering the
+per-cell failure rate costs the same however many positions were counted.
+Positions outside the bounds are only counted.
+"""
+
+from typing import List, Sequence, Tuple
+import math
+import numpy as np
+
+class SpatialGrid:
+    """Success/failure counts per cell_size x cell_size cell of [x_min, x_max) x [y_min, y_max)"""
+    
+    def __init__(self, x_min: float, y_min: float, x_max: float, y_max: float, cell_size: float = 1.0):
+        self.cell_size = cell_size
+        self.x_min, self.y_min = x_min, y_min
+        self.columns = max(1, math.ceil((x_max - x_min) / cell_size))
+        self.rows = max(1, math.ceil((y_max - y_min) / cell_size))
+        self.x_max = x_min + self.columns * cell_size
+        self.y_max = y_min + self.rows * cell_size
+        self.success = np.zeros((self.rows, self.columns), np.int64)
+        self.failure = np.zeros((self.rows, self.columns), np.int64)
+        self.outside = [0, 0]  # [success, failure] of positions outside the bounds (or not finite)
+        
+    @classmethod
+    def around(cls, vertices: Sequence[Sequence[float]], cell_size: float = 1.0, margin: float = 0.0) -> "SpatialGrid":
+        """Grid over a floor outline's bounding box, widened by margin on every side"""
+        xs = [vertex[0] for vertex in vertices]
+        ys = [vertex[1] for vertex in vertices]
+        return cls(min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin, cell_size)
+        
+    def add(self, x: float, y: float, success: bool):
+        try:
+            column = int((x - self.x_min) // self.cell_size)
+            row = int((y - self.y_min) // self.cell_size)
+        except (ValueError, OverflowError):  # NaN or infinite coordinates
+            column = row = -1
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            (self.success if success else self.failure)[row, column] += 1
+        else:
+            self.outside[0 if success else 1] += 1
+            
+    def add_many(self, xs: np.ndarray, ys: np.ndarray, success: np.ndarray):
+        """Vectorized add() of whole coordinate arrays"""
+        xs, ys, success = np.asarray(xs, np.float64), np.asarray(ys, np.float64), np.asarray(success, bool)
+        with np.errstate(invalid="ignore"):
+            columns = np.floor((xs - self.x_min) / self.cell_size)
+            rows = np.floor((ys - self.y_min) / self.cell_size)
+        inside = (columns >= 0) & (columns < self.columns) & (rows >= 0) & (rows < self.rows)
+        cells = rows[inside].astype(np.int64) * self.columns + columns[inside].astype(np.int64)
+        size = self.rows * self.columns
+        hits = success[inside]
+        self.success += np.bincount(cells[hits], minlength=size).reshape(self.rows, self.columns)
+        self.failure += np.bincount(cells[~hits], minlength=size).reshape(self.rows, self.columns)
+        self.outside[0] += int(np.count_nonzero(success[~inside]))
+        self.outside[1] += int(np.count_nonzero(~success[~inside]))
+        
+    def totals(self) -> Tuple[int, int]:
+        """(success, failure) of every position counted, outside the bounds included"""
+        return int(self.success.sum()) + self.outside[0], int(self.failure.sum()) + self.outside[1]
+        
+    def failure_rate(self) -> np.ma.MaskedArray:
+        """Failures / positions per cell, masked where nothing was counted"""
+        counted = self.success + self.failure
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.ma.masked_where(counted == 0, self.failure / counted)
+            
+    def extent(self) -> List[float]:
+        """[left, right, bottom, top] for imshow"""
+        return [self.x_min, self.x_max, self.y_min, self.y_max]
+        
+    def reset(self):
+        self.success[:] = 0
+        self.failure[:] = 0
+        self.outside = [0, 0]
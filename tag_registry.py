@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Compiled registry of the positioning tags
+The one table of tag ID, tag MAC and floor that the generators, the floor
+evaluation and the visualizers all import. Tags get dense integer indices
+(their row in the table) and floors small integer codes, so hot paths can
+keep per-tag counters in flat lists and resolve a MAC or an ID to its tag
+with one dict lookup, in either direction.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DOWNSTAIRS, MEZZANINE = 0, 1  # Floor codes
+UNKNOWN_FLOOR = -1
+FLOOR_NAMES = ("Downstairs", "Mezzanine")
+MAP_IDS = ["682c66de8cde618ce1270230", "682c66f08cde618ce127025e"]  # Indexed by floor code
+
+# (tag ID, tag MAC, floor code)
+TAG_TABLE: List[Tuple[str, str, int]] = [
+    # Downstairs
+    ("62398", "f260a59af3be", DOWNSTAIRS),
+    ("33055", "e45428cd811f", DOWNSTAIRS),
+    ("34487", "eaf519e486b7", DOWNSTAIRS),
+    ("27666", "e71ebc086c12", DOWNSTAIRS),
+    ("4232", "db87600e1088", DOWNSTAIRS),
+    ("16915", "e75675d44213", DOWNSTAIRS),
+    ("45527", "ea0efa76b1d7", DOWNSTAIRS),
+    ("21342", "e3c858bb535e", DOWNSTAIRS),
+    ("37133", "f9cf5a96910d", DOWNSTAIRS),
+    ("4468", "e9ee05861174", DOWNSTAIRS),
+    ("54577", "c5d89d98d531", DOWNSTAIRS),
+    ("15826", "f17508753dd2", DOWNSTAIRS),
+    ("47621", "ccd6b409ba05", DOWNSTAIRS),
+    ("43660", "cfcba5a4aa8c", DOWNSTAIRS),
+    ("19466", "dfe232164c0a", DOWNSTAIRS),
+    ("42966", "ea130331a7d6", DOWNSTAIRS),
+    ("4820", "fe916ad112d4", DOWNSTAIRS),
+    ("62994", "cbafa76ff612", DOWNSTAIRS),
+    ("24904", "d31e40a36148", DOWNSTAIRS),
+    ("20567", "ed3dc76b5057", DOWNSTAIRS),
+    ("34114", "f7fb6d248542", DOWNSTAIRS),
+    ("13077", "e5618db03315", DOWNSTAIRS),
+    ("1758", "c48718b206de", DOWNSTAIRS),
+    ("44900", "ced95ba5af64", DOWNSTAIRS),
+    ("28565", "e80511ee6f95", DOWNSTAIRS),
+    ("25272", "f8e68ad462b8", DOWNSTAIRS),
+    ("49074", "c07f2aebbfb2", DOWNSTAIRS),
+    ("18821", "dc6fd1014985", DOWNSTAIRS),
+    ("23550", "dbdfe63c5bfe", DOWNSTAIRS),
+    ("59518", "f53d908ae87e", DOWNSTAIRS),
+    
+    # Mezzanine
+    ("53934", "eacbbb80d2ae", MEZZANINE),
+    ("40172", "d55a17359cec", MEZZANINE),
+    ("52711", "c3fdcfc7cde7", MEZZANINE),
+    ("24129", "dd35e8065e41", MEZZANINE),
+    ("13485", "f1465d4b34ad", MEZZANINE),
+    ("28064", "d2433d346da0", MEZZANINE),
+    ("1989", "de8a7eb407c5", MEZZANINE),
+    ("56876", "fbde6b71de2c", MEZZANINE),
+    ("47397", "eed4934cb925", MEZZANINE),
+    ("32140", "c694e5297d8c", MEZZANINE),
+    ("60967", "dcb814adee27", MEZZANINE),
+    ("6555", "ee1ae8c0199b", MEZZANINE),
+    ("64669", "e12a0889fc9d", MEZZANINE),
+    ("20869", "ca70faad5185", MEZZANINE),
+    ("28152", "e1221fc96df8", MEZZANINE),
+    ("35464", "eabf49388a88", MEZZANINE),
+    ("62212", "faebae16f304", MEZZANINE),
+    ("55738", "e6a1121bd9ba", MEZZANINE),
+    ("29288", "ebc3d8c27268", MEZZANINE),
+    ("20689", "c0c28a5250d1", MEZZANINE),
+    ("6667", "eb7dd4251a0b", MEZZANINE),
+    ("59660", "dbd8f214e90c", MEZZANINE),
+    ("47437", "f8c6e10eb94d", MEZZANINE),
+    ("64033", "c61444ecfa21", MEZZANINE),
+    ("52919", "e6dee509ceb7", MEZZANINE),
+    ("2460", "e0187539099c", MEZZANINE),
+    ("38511", "cfa33b8f966f", MEZZANINE),
+    ("62524", "d1162b91f43c", MEZZANINE),
+    ("62920", "d908a64ff5c8", MEZZANINE),
+    ("34465", "e0179d3286a1", MEZZANINE),
+]
+
+class TagRegistry:
+    """Dense tag indices with constant-time lookups by MAC and by ID"""
+    
+    def __init__(self, entries: Iterable[Tuple[str, str, int]], map_ids: Iterable[str] = MAP_IDS):
+        self.map_ids = list(map_ids)
+        self.floor_codes: Dict[str, int] = {map_id: floor for floor, map_id in enumerate(self.map_ids)}
+        self.ids: List[str] = []
+        self.macs: List[str] = []
+        self.floors: List[int] = []
+        self.index_by_mac: Dict[str, int] = {}
+        self.index_by_id: Dict[str, int] = {}
+        for tag_id, tag_mac, floor in entries:
+            if tag_mac in self.index_by_mac or tag_id in self.index_by_id:
+                raise ValueError(f"Tag {tag_id} ({tag_mac}) is listed twice")
+            self.index_by_mac[tag_mac] = self.index_by_id[tag_id] = len(self.macs)
+            self.ids.append(tag_id)
+            self.macs.append(tag_mac)
+            self.floors.append(floor)
+            
+    def __len__(self) -> int:
+        return len(self.macs)
+        
+    def __contains__(self, tag_mac: str) -> bool:
+        return tag_mac in self.index_by_mac
+        
+    def index(self, tag_mac: str) -> Optional[int]:
+        return self.index_by_mac.get(tag_mac)
+        
+    def index_of_id(self, tag_id: str) -> Optional[int]:
+        return self.index_by_id.get(tag_id)
+        
+    def mac_of(self, tag_id: str) -> Optional[str]:
+        index = self.index_by_id.get(tag_id)
+        return None if index is None else self.macs[index]
+        
+    def id_of(self, tag_mac: str) -> Optional[str]:
+        index = self.index_by_mac.get(tag_mac)
+        return None if index is None else self.ids[index]
+        
+    def floor(self, tag_mac: str) -> int:
+        """Floor code of the tag, UNKNOWN_FLOOR for MACs not in the registry"""
+        index = self.index_by_mac.get(tag_mac)
+        return UNKNOWN_FLOOR if index is None else self.floors[index]
+        
+    def floor_of_map(self, map_id: str) -> int:
+        return self.floor_codes.get(map_id, UNKNOWN_FLOOR)
+        
+    def counters(self) -> List[int]:
+        """A zeroed per-tag counter array, indexed like the registry"""
+        return [0] * len(self.macs)
+        
+    def mac_to_map_id(self) -> Dict[str, str]:
+        return {tag_mac: self.map_ids[floor] for tag_mac, floor in zip(self.macs, self.floors)}
+        
+    def mac_to_floor(self) -> Dict[str, int]:
+        return dict(zip(self.macs, self.floors))
+        
+    def id_to_mac(self) -> Dict[str, str]:
+        return dict(zip(self.ids, self.macs))
+        
+    def id_to_map_id(self) -> Dict[str, str]:
+        return {tag_id: self.map_ids[floor] for tag_id, floor in zip(self.ids, self.floors)}
+
+TAGS = TagRegistry(TAG_TABLE)
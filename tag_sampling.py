@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Bounded per-tag sampling for the extended training data
+Instead of keeping the first MAX_LINES rows of a tag, a full tag keeps
+sampling: each new position is admitted with probability capacity / seen
+(reservoir sampling, decided before the payload is decoded) and replaces
+either a random kept row ("reservoir") or a row of the most represented
+stratum ("stratified", strata = position grid cell x floor correctness).
+Replaced rows are tombstoned and dropped when the tag's CSV is compacted.
+"""
+
+from typing import Dict, Any, List, Optional, Set, Tuple
+import json, math, os, random
+
+SAMPLING_MODES = ("truncate", "reservoir", "stratified")
+SAMPLING_STATE_FILE = "sampling_state.json"
+
+def stratum_key(tag_x: float, tag_y: float, map_id: str, true_map_id: str, cell_size: float) -> str:
+    """'<cell x>,<cell y>,<1 if map_id is correct else 0>'"""
+    return f"{math.floor(tag_x / cell_size)},{math.floor(tag_y / cell_size)},{int(map_id == true_map_id)}"
+
+def row_stratum(line: str, cell_size: float) -> Optional[str]:
+    """Stratum of a wide CSV data line, parsing only the leading position columns"""
+    fields = line.split(",", 9)
+    try:
+        return stratum_key(float(fields[2]), float(fields[3]), fields[0], fields[8].strip(), cell_size)
+    except (ValueError, IndexError):
+        return None
+
+def scan_strata(filename: str, cell_size: float) -> List[Optional[str]]:
+    """Strata of every data row of an existing file (one pass, only for files without saved state)"""
+    with open(filename, 'r', newline='') as f:
+        f.readline()  # Header
+        return [row_stratum(line, cell_size) for line in f]
+
+class TagSample:
+    """Sampling state of one tag: the stratum of every row in its file, None for replaced rows"""
+
+    def __init__(self, capacity: int, mode: str = "stratified", row_strata: Optional[List[Optional[str]]] = None,
+                 seen: Optional[int] = None, rng: Optional[random.Random] = None):
+        if mode not in SAMPLING_MODES[1:]:
+            raise ValueError(f"Unknown sampling mode {mode!r}, expected one of {SAMPLING_MODES[1:]}")
+        self.capacity = capacity
+        self.mode = mode
+        self.rng = rng or random.Random()
+        self.index(list(row_strata or []))
+        self.seen = max(seen or 0, self.kept)
+        self.admitted = 0
+        self.skipped = 0
+
+    def index(self, row_strata: List[Optional[str]]):
+        """(Re)build the per-stratum row lists from the stratum of every row in the file"""
+        self.row_strata = row_strata
+        self.rows_by_stratum: Dict[str, List[int]] = {}
+        self.tombstones: Set[int] = set()
+        for row, stratum in enumerate(row_strata):
+            if stratum is None:
+                self.tombstones.add(row)
+            else:
+                self.rows_by_stratum.setdefault(stratum, []).append(row)
+
+    @property
+    def kept(self) -> int:
+        return len(self.row_strata) - len(self.tombstones)
+
+    def admit(self) -> bool:
+        """Count one incoming position and decide, before decoding it, whether it may enter the sample"""
+        self.seen += 1
+        if self.kept < self.capacity or self.rng.random() < self.capacity / self.seen:
+            self.admitted += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def victim_stratum(self, stratum: str) -> str:
+        if self.mode == "reservoir":
+            # Uniformly random kept row: pick a stratum weighted by its size
+            target = self.rng.randrange(self.kept)
+            for key, rows in self.rows_by_stratum.items():
+                if target < len(rows):
+                    return key
+                target -= len(rows)
+        largest = max(self.rows_by_stratum, key=lambda key: len(self.rows_by_stratum[key]))
+        # Replacing within the same stratum keeps it from growing past the largest one
+        if len(self.rows_by_stratum.get(stratum, ())) + 1 >= len(self.rows_by_stratum[largest]):
+            return stratum if stratum in self.rows_by_stratum else largest
+        return largest
+
+    def record(self, stratum: Optional[str]) -> Optional[int]:
+        """Account for a row about to be appended; returns the replaced row index, if any"""
+        stratum = stratum or "?"
+        victim = None
+        if self.kept >= self.capacity:
+            rows = self.rows_by_stratum[self.victim_stratum(stratum)]
+            position = self.rng.randrange(len(rows))
+            rows[position], rows[-1] = rows[-1], rows[position]
+            victim = rows.pop()
+            if not rows:
+                del self.rows_by_stratum[self.row_strata[victim]]
+            self.row_strata[victim] = None
+            self.tombstones.add(victim)
+        self.rows_by_stratum.setdefault(stratum, []).append(len(self.row_strata))
+        self.row_strata.append(stratum)
+        return victim
+
+    def compacted(self):
+        """Renumber rows after the tombstoned ones were removed from the file"""
+        self.index([stratum for stratum in self.row_strata if stratum is not None])
+
+    def strata_counts(self) -> Dict[str, int]:
+        return {key: len(rows) for key, rows in self.rows_by_stratum.items()}
+
+def compact_csv(filename: str, tombstones: Set[int]) -> Tuple[int, Optional[int], Optional[int]]:
+    """Rewrite a CSV without the tombstoned data rows (streaming, atomic replace)
+
+    Returns (rows kept, first kept position_timestamp, last kept position_timestamp).
+    """
+    temp_path = filename + ".compact"
+    kept = 0
+    first_timestamp = last_timestamp = None
+    with open(filename, 'r', newline='') as source, open(temp_path, 'w', newline='') as target:
+        target.write(source.readline())
+        for row, line in enumerate(source):
+            if row in tombstones:
+                continue
+            target.write(line)
+            kept += 1
+            try:
+                timestamp = int(line.split(",", 2)[1])
+            except (ValueError, IndexError):
+                continue
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            last_timestamp = timestamp
+    os.replace(temp_path, filename)
+    return kept, first_timestamp, last_timestamp
+
+def load_sampling_state(output_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(output_dir, SAMPLING_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (ValueError, OSError) as e:
+        print(f"⚠️ Could not read {path}, strata will be rescanned: {e}")
+        return {}
+
+def save_sampling_state(output_dir: str, samples: Dict[str, TagSample], file_sizes: Dict[str, int], cell_size: float):
+    """Persist seen counts and row strata of compacted tags (valid while the file size matches)"""
+    state = {}
+    for tag_mac, sample in samples.items():
+        if not sample.tombstones and tag_mac in file_sizes:
+            state[tag_mac] = {"seen": sample.seen, "bytes": file_sizes[tag_mac], "cell_size": cell_size,
+                              "strata": sample.row_strata}
+    path = os.path.join(output_dir, SAMPLING_STATE_FILE)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
@@ -8,8 +8,14 @@ import os
 import sys
 import json
 import csv
+import io
 import tempfile
+import glob
+import gzip
 import shutil
+import math
+import random
+import statistics
 from typing import Dict, Any
 from unittest.mock import patch, MagicMock
 
@@ -18,8 +24,14 @@ sys.path.append('.')
 from generate_ml_data import (
     TAG_MAC_TO_MAP_ID, MAP_IDS, calculate_distance, 
     get_all_anchor_macs, generate_csv_header, 
-    setup_csv_files, process_position_message
+    setup_csv_files, process_position_message,
+    compile_row_layout
 )
+from buffered_csv import BufferedCSVWriter, FlushPolicy, buffer_totals
+from ingestion import IngestionPipeline, extract_tag_mac, BLOCK, DROP_NEWEST
+from position_decoder import PositionMessage, decode_position, json_loads, JSON_BACKEND
+from rssi_stats import sweep_map_stats
+from sparse_output import load_wide
 
 def create_test_sample_csv():
     """Create a temporary sample CSV file for testing anchor MAC extraction"""
@@ -141,6 +153,1206 @@ def test_csv_header_generation():
     
     print(f"  ✅ Header has {len(header)} columns with correct structure")
 
+def test_row_layout():
+    """Test the precompiled row layout against the CSV header"""
+    print("🧪 Testing row layout...")
+    
+    test_anchors = {"a907dead0861", "eb20694cea84", "c32a723f0621"}
+    layout = compile_row_layout(test_anchors)
+    header = layout.header
+    
+    assert layout.width == len(header), "Layout width should match header"
+    for anchor in test_anchors:
+        offset = layout.anchor_offsets[anchor]
+        assert header[offset] == f"{anchor}_rssi", f"Wrong offset for {anchor}"
+        assert header[offset + 6] == f"{anchor}_signal_quality", f"Anchor block for {anchor} is not 7 columns"
+    for map_id in MAP_IDS:
+        assert header[layout.map_offsets[map_id]] == f"{map_id}_total_anchors", f"Wrong offset for {map_id}"
+    
+    # Unheard anchors keep the empty defaults, heard anchors are scattered in place
+    row = layout.new_row()
+    layout.set_anchor(row, "eb20694cea84", [-96.2, 1, 49.2, 36.3, MAP_IDS[1], 0.26, ""])
+    offset = layout.anchor_offsets["eb20694cea84"]
+    assert row[offset:offset + 7] == [-96.2, 1, 49.2, 36.3, MAP_IDS[1], 0.26, ""], "Anchor cells not written"
+    offset = layout.anchor_offsets["c32a723f0621"]
+    assert row[offset:offset + 7] == ["", 0, "", "", "", "", ""], "Unheard anchor should be empty"
+    assert not layout.set_anchor(row, "unknownanchor", [0] * 7), "Anchors outside the header should be skipped"
+    assert layout.new_row()[layout.anchor_offsets["eb20694cea84"]] == "", "Template must not be modified"
+    
+    print(f"  ✅ Layout maps {len(layout.anchor_offsets)} anchors onto {layout.width} columns")
+
+def test_buffered_csv_writer():
+    """Test that rows are group-committed according to the flush policy"""
+    print("🧪 Testing buffered CSV writer...")
+    
+    temp_dir = tempfile.mkdtemp()
+    csv_file_path = os.path.join(temp_dir, "buffered.csv")
+    fake_now = [0.0]
+    
+    try:
+        with open(csv_file_path, 'a', newline='') as f:
+            writer = BufferedCSVWriter(f, FlushPolicy(max_rows=3, max_bytes=1024 * 1024, max_interval=5.0),
+                                       clock=lambda: fake_now[0])
+            
+            writer.writerow(["a", 1])
+            writer.writerow(["b", 2])
+            assert os.path.getsize(csv_file_path) == 0, "Rows should stay buffered below the row limit"
+            assert buffer_totals({"t": writer})["rows_buffered"] == 2, "Expected 2 buffered rows"
+            
+            writer.writerow(["c", 3])
+            assert writer.rows_on_disk == 3 and writer.rows_buffered == 0, "Row limit should trigger a flush"
+            
+            writer.writerow(["d", 4])
+            fake_now[0] = 4.0
+            assert not writer.flush_due(), "Flush should wait for max_interval"
+            fake_now[0] = 6.0
+            assert writer.flush_due(), "Elapsed time should trigger a flush"
+            
+            writer.writerow(["e", 5])
+            writer.close()
+            assert writer.rows_on_disk == 5 and writer.rows_synced == 5, "Close should flush and sync everything"
+        
+        with open(csv_file_path, 'r') as f:
+            assert [line.split(',')[0] for line in f] == ["a", "b", "c", "d", "e"], "Rows out of order"
+            
+        # A signal-handler flush arriving while the same thread is inside flush() must not write the rows twice
+        class InterruptedFile(io.StringIO):
+            def write(self, data):
+                if handler_writer is not None and not self.getvalue():
+                    handler_writer.flush()
+                return super().write(data)
+                
+        handler_writer = None
+        target = InterruptedFile()
+        handler_writer = BufferedCSVWriter(target, FlushPolicy(max_rows=100))
+        handler_writer.writerow(["x", 1])
+        handler_writer.writerow(["y", 2])
+        handler_writer.flush()
+        assert target.getvalue().splitlines() == ["x,1", "y,2"] and handler_writer.rows_on_disk == 2, \
+            "Re-entrant flush should not duplicate rows"
+        
+        print("  ✅ Rows are flushed by count, elapsed time and on close")
+    
+    finally:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_ingestion_pipeline():
+    """Test queued ingestion keeps per-tag order and applies backpressure"""
+    print("🧪 Testing ingestion pipeline...")
+    
+    test_tags = list(TAG_MAC_TO_MAP_ID.keys())[:4]
+    payloads = []
+    for i in range(40):
+        message = create_sample_mqtt_message(test_tags[i % 4])
+        message["timestamp"] = i
+        payloads.append(json.dumps(message).encode("utf-8"))
+    
+    assert extract_tag_mac(payloads[0]) == test_tags[0], "Tag MAC should be found without decoding"
+    
+    seen = {tag: [] for tag in test_tags}
+    def handler(raw_payload):
+        message = json.loads(raw_payload)
+        seen[message["tag"]["mac"]].append(message["timestamp"])
+    
+    pipeline = IngestionPipeline(handler, workers=3, queue_size=100, policy=BLOCK)
+    pipeline.start()
+    for raw_payload in payloads:
+        pipeline.submit(raw_payload)
+    pipeline.stop(drain=True)
+    
+    assert pipeline.stats()["processed"] == 40, "All payloads should be processed"
+    for tag, timestamps in seen.items():
+        assert timestamps == sorted(timestamps), f"Messages for {tag} were reordered"
+    
+    # Without running workers a full queue rejects new payloads under drop-newest
+    pipeline = IngestionPipeline(handler, workers=1, queue_size=5, policy=DROP_NEWEST)
+    accepted = sum(1 for raw_payload in payloads[:8] if pipeline.submit(raw_payload))
+    assert accepted == 5 and pipeline.stats()["dropped_newest"] == 3, "Expected 3 dropped payloads"
+    
+    print("  ✅ Per-tag order preserved, backpressure drops counted")
+
+def test_position_decoder():
+    """Test the typed decoder against the sample MQTT message"""
+    print(f"🧪 Testing position decoder ({JSON_BACKEND} backend)...")
+    
+    test_tag_mac = list(TAG_MAC_TO_MAP_ID.keys())[0]
+    message = decode_position(json.dumps(create_sample_mqtt_message(test_tag_mac)).encode("utf-8"))
+    
+    assert message.tag_mac == test_tag_mac, "Tag MAC mismatch"
+    assert message.map_id == "682c66f08cde618ce127025e", "Map ID mismatch"
+    assert message.timestamp == 1753346052898, "Timestamp mismatch"
+    assert (message.x, message.y) == (49.48, 36.52), "Position mismatch"
+    assert message.covariance[1] == message.covariance[2] == 0.7291580951139053, "Covariance mismatch"
+    assert len(message) == 4 and message.used_count == 2, "Expected 2 used + 2 unused anchors"
+    assert message.anchor_mac[:2] == ["a907dead0861", "eb20694cea84"], "Used anchors should come first"
+    assert message.anchor_used == [1, 1, 0, 0], "Used flags mismatch"
+    assert message.anchor_x[2] is None and message.anchor_cart_d[2] == 4.35, "Unused anchor fields mismatch"
+    assert message.key() == (test_tag_mac, 1753346052898, message.map_id), "Key should match position_key"
+    
+    # Invalid UTF-8 falls back to a lenient decode instead of dropping the message
+    position_data = json_loads(b'{"tag": {"mac": "' + test_tag_mac.encode() + b'"}, "note": "\xff"}')
+    assert position_data["tag"]["mac"] == test_tag_mac and position_data["note"] == "\ufffd"
+    
+    print("  ✅ Payload decoded into typed fields and anchor arrays")
+
+def test_map_stats_sweep():
+    """Test one-pass per-map statistics against the statistics module"""
+    print("🧪 Testing one-pass map statistics...")
+    
+    rng = random.Random(42)
+    for case in range(2000):
+        # Integer RSSI must match statistics.mean/stdev exactly, float RSSI to rounding
+        integral = case % 2 == 0
+        anchors = [
+            {"map_id": rng.choice(MAP_IDS), "used": rng.randint(0, 1),
+             "rssi": rng.randint(-115, -80) if integral else round(rng.uniform(-115, -80), 2)}
+            for _ in range(rng.randint(0, 14))
+        ]
+        map_stats = sweep_map_stats(anchors, MAP_IDS)
+        
+        for map_id in MAP_IDS:
+            anchors_for_map = [a for a in anchors if a["map_id"] == map_id]
+            values = map_stats[map_id].values()
+            if not anchors_for_map:
+                assert values == [0, 0, 0, "", "", "", "", ""], "Empty map should have empty stats"
+                continue
+            
+            rssi_values = [a["rssi"] for a in anchors_for_map]
+            expected = [
+                len(anchors_for_map), sum(a["used"] for a in anchors_for_map), len(anchors_for_map),
+                statistics.mean(rssi_values), max(rssi_values), min(rssi_values),
+                statistics.stdev(rssi_values) if len(rssi_values) > 1 else 0,
+                max(rssi_values) - min(rssi_values)
+            ]
+            assert values[:3] == expected[:3], "Anchor counts mismatch"
+            if integral:
+                assert values == expected and list(map(type, values)) == list(map(type, expected)), \
+                    f"Integer stats {values} should equal {expected}"
+                continue
+            for got, want in zip(values[3:], expected[3:]):
+                assert math.isclose(got, want, rel_tol=1e-12, abs_tol=1e-12), f"Stat mismatch: {got} vs {want}"
+    
+    # Anchors without RSSI count towards the totals only
+    values = sweep_map_stats([{"map_id": MAP_IDS[0], "rssi": "", "used": 1}], MAP_IDS)[MAP_IDS[0]].values()
+    assert values == [1, 1, 1, "", "", "", "", ""], "Missing RSSI should leave stats empty"
+    
+    print("  ✅ One-pass statistics match statistics.mean/stdev")
+
+def test_sparse_output_round_trip():
+    """Test the sparse long format and its re-pivot to the wide layout"""
+    print("🧪 Testing sparse output...")
+    
+    import generate_ml_data
+    temp_dir = tempfile.mkdtemp()
+    saved = (generate_ml_data.OUTPUT_FORMAT, generate_ml_data.SPARSE_OUTPUT_DIR, generate_ml_data.csv_writers,
+             generate_ml_data.csv_files, generate_ml_data.tag_message_counts, generate_ml_data.sparse_sink)
+    
+    try:
+        generate_ml_data.OUTPUT_FORMAT = "sparse"
+        generate_ml_data.SPARSE_OUTPUT_DIR = temp_dir
+        generate_ml_data.csv_writers = {}
+        generate_ml_data.csv_files = {}
+        generate_ml_data.tag_message_counts = {}
+        
+        test_anchors = {"a907dead0861", "eb20694cea84", "c32a723f0621", "cde7899af17e", "ffffffffffff"}
+        test_tag_mac = list(TAG_MAC_TO_MAP_ID.keys())[0]
+        setup_csv_files(test_anchors)
+        for i in range(3):
+            message = create_sample_mqtt_message(test_tag_mac)
+            message["timestamp"] += i
+            process_position_message(PositionMessage.from_dict(message), test_anchors)
+        generate_ml_data.cleanup_files()
+        
+        wide = load_wide(temp_dir, test_tag_mac, sorted(test_anchors))
+        assert len(wide) == 3, f"Expected 3 positions, got {len(wide)}"
+        assert list(wide["position_timestamp"]) == [1753346052898, 1753346052899, 1753346052900], "Timestamp mismatch"
+        assert wide["eb20694cea84_rssi"].iloc[0] == -108.01, "Heard anchor RSSI mismatch"
+        assert wide["eb20694cea84_used"].iloc[0] == 1 and wide["c32a723f0621_used"].iloc[0] == 0, "Used flag mismatch"
+        assert wide["eb20694cea84_x"].iloc[0] == 58.48, "Anchor coordinates should come from the anchor table"
+        assert wide["ffffffffffff_rssi"].isna().all(), "Unheard anchor should have no RSSI"
+        
+        # A clean restart resumes numbering from the manifest without reading the files
+        import csv_manifest
+        from sparse_output import SparseSink
+        sink = SparseSink(temp_dir, MAP_IDS)
+        with patch.object(csv_manifest, "scan_csv", side_effect=AssertionError("file was rescanned")):
+            assert sink.open([test_tag_mac]) == {test_tag_mac: 3} and sink.next_seq[test_tag_mac] == 3
+        for writer in sink.writers.values():
+            writer.close()
+            
+        # After a crash that kept seq 3's anchor rows but lost its position row, seq 3 is not reused
+        with open(os.path.join(temp_dir, f"{test_tag_mac}.anchors.csv"), "a") as f:
+            f.write("3,a907dead0861,-96.24,1,0.26,\r\n")
+        sink = SparseSink(temp_dir, MAP_IDS)
+        assert sink.open([test_tag_mac]) == {test_tag_mac: 3} and sink.next_seq[test_tag_mac] == 4, \
+            "Numbering should resume after the highest seq in either file"
+        for writer in sink.writers.values():
+            writer.close()
+        
+        print("  ✅ Sparse files re-pivot to the wide layout")
+    
+    finally:
+        (generate_ml_data.OUTPUT_FORMAT, generate_ml_data.SPARSE_OUTPUT_DIR, generate_ml_data.csv_writers,
+         generate_ml_data.csv_files, generate_ml_data.tag_message_counts, generate_ml_data.sparse_sink) = saved
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_parquet_output():
+    """Test the Parquet sink of the extended generator and column-selective reads"""
+    print("🧪 Testing Parquet output...")
+    
+    import generate_ml_data_exte
+    from parquet_sink import read_tag_columns, existing_row_count
+    temp_dir = tempfile.mkdtemp()
+    saved = (generate_ml_data_exte.OUTPUT_FORMAT, generate_ml_data_exte.PARQUET_OUTPUT_DIR, generate_ml_data_exte.csv_writers,
+             generate_ml_data_exte.csv_files, generate_ml_data_exte.tag_message_counts)
+    
+    try:
+        generate_ml_data_exte.OUTPUT_FORMAT = "parquet"
+        generate_ml_data_exte.PARQUET_OUTPUT_DIR = temp_dir
+        generate_ml_data_exte.csv_writers = {}
+        generate_ml_data_exte.csv_files = {}
+        generate_ml_data_exte.tag_message_counts = {}
+        
+        test_anchors = {"a907dead0861", "eb20694cea84", "c32a723f0621", "cde7899af17e", "ffffffffffff"}
+        test_tag_mac = list(generate_ml_data_exte.TAG_MAC_TO_MAP_ID.keys())[0]
+        generate_ml_data_exte.setup_csv_files(test_anchors)
+        for i in range(3):
+            message = create_sample_mqtt_message(test_tag_mac)
+            message["timestamp"] += i
+            generate_ml_data_exte.process_position_message(PositionMessage.from_dict(message), test_anchors)
+        generate_ml_data_exte.cleanup_files()
+        
+        tag_dir = os.path.join(temp_dir, test_tag_mac)
+        assert existing_row_count(tag_dir) == 3, "Footer row count mismatch"
+        
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(glob.glob(os.path.join(tag_dir, "*.parquet"))[0])
+        assert str(schema.field("eb20694cea84_rssi").type) == "float", "RSSI should be float32"
+        assert str(schema.field("eb20694cea84_used").type) == "int8", "Used flag should be int8"
+        assert str(schema.field("map_id").type).startswith("dictionary"), "map_id should be dictionary-encoded"
+        
+        data = read_tag_columns(tag_dir, ["tag_x", "tag_y", "map_id", "true_map_id"])
+        assert list(data.columns) == ["tag_x", "tag_y", "map_id", "true_map_id"], "Only requested columns should load"
+        assert len(data) == 3 and data["tag_x"].iloc[0] == 49.48, "Position mismatch"
+        assert data["map_id"].iloc[0] == "682c66f08cde618ce127025e", "map_id mismatch"
+        
+        anchors = read_tag_columns(tag_dir, ["eb20694cea84_rssi", "ffffffffffff_rssi"])
+        assert abs(anchors["eb20694cea84_rssi"].iloc[0] - (-108.01)) < 1e-4, "Heard anchor RSSI mismatch"
+        assert anchors["ffffffffffff_rssi"].isna().all(), "Unheard anchor should be null"
+        
+        print("  ✅ Parquet files have typed columns and load column-selectively")
+    
+    finally:
+        (generate_ml_data_exte.OUTPUT_FORMAT, generate_ml_data_exte.PARQUET_OUTPUT_DIR, generate_ml_data_exte.csv_writers,
+         generate_ml_data_exte.csv_files, generate_ml_data_exte.tag_message_counts) = saved
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_csv_manifest():
+    """Test that the manifest seeds row counts without rescanning and repairs stale entries"""
+    print("🧪 Testing CSV manifest...")
+    
+    import generate_ml_data
+    import csv_manifest
+    temp_dir = tempfile.mkdtemp()
+    saved = (generate_ml_data.OUTPUT_DIR, generate_ml_data.csv_writers, generate_ml_data.csv_files,
+             generate_ml_data.tag_message_counts)
+    
+    try:
+        generate_ml_data.OUTPUT_DIR = temp_dir
+        generate_ml_data.csv_writers = {}
+        generate_ml_data.csv_files = {}
+        generate_ml_data.tag_message_counts = {}
+        
+        test_anchors = {"a907dead0861", "eb20694cea84", "c32a723f0621", "cde7899af17e"}
+        test_tag_mac = list(TAG_MAC_TO_MAP_ID.keys())[0]
+        setup_csv_files(test_anchors)
+        for i in range(4):
+            message = create_sample_mqtt_message(test_tag_mac)
+            message["timestamp"] += i
+            process_position_message(PositionMessage.from_dict(message), test_anchors)
+            if i == 1:
+                if generate_ml_data.row_batcher is not None:
+                    generate_ml_data.row_batcher.flush(force=True)  # Rows still waiting in the feature batch
+                generate_ml_data.csv_writers[test_tag_mac].flush()
+        # Only flushed rows may appear in the manifest, buffered ones are not on disk yet
+        generate_ml_data.manifest.save(generate_ml_data.csv_writers)
+        entry = csv_manifest.CSVManifest(temp_dir).load().entries[test_tag_mac]
+        assert (entry["rows"], entry["last_timestamp"]) == (2, 1753346052899), "Manifest should describe flushed rows only"
+        generate_ml_data.cleanup_files()
+        
+        tag_file = os.path.join(temp_dir, f"{test_tag_mac}.csv")
+        manifest = csv_manifest.CSVManifest(temp_dir).load()
+        entry = manifest.entries[test_tag_mac]
+        assert entry["rows"] == 4 and entry["bytes"] == os.path.getsize(tag_file), "Manifest should match the file"
+        assert (entry["first_timestamp"], entry["last_timestamp"]) == (1753346052898, 1753346052901), "Timestamp range mismatch"
+        assert csv_manifest.scan_csv(tag_file) == entry, "Rescan should agree with the maintained entry"
+        
+        # A consistent manifest seeds the counts without reading any file
+        generate_ml_data.csv_writers = {}
+        generate_ml_data.csv_files = {}
+        with patch.object(csv_manifest, "scan_csv", side_effect=AssertionError("file was rescanned")):
+            setup_csv_files(test_anchors)
+        assert generate_ml_data.tag_message_counts[test_tag_mac] == 4, "Seeded count mismatch"
+        generate_ml_data.cleanup_files()
+        
+        # Rows appended behind the manifest's back make the entry stale
+        with open(tag_file, 'a') as f:
+            f.write(open(tag_file).read().splitlines()[-1] + "\r\n")
+        manifest = csv_manifest.CSVManifest(temp_dir).load()
+        assert manifest.row_count(test_tag_mac, tag_file) is None, "Stale entry should not be trusted"
+        assert csv_manifest.rebuild_manifest(temp_dir).entries[test_tag_mac]["rows"] == 5, "Repair should recount"
+        
+        print("  ✅ Manifest seeds, tracks and repairs row counts")
+    
+    finally:
+        (generate_ml_data.OUTPUT_DIR, generate_ml_data.csv_writers, generate_ml_data.csv_files,
+         generate_ml_data.tag_message_counts) = saved
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_cross_broker_dedup():
+    """Test that a position delivered by several brokers is only written once"""
+    print("🧪 Testing cross-broker deduplication...")
+    
+    import generate_ml_data_exte
+    from recent_keys import RecentKeyIndex, position_key, raw_position_key
+    
+    index = RecentKeyIndex(capacity=2)
+    assert [index.seen(key) for key in ("a", "b", "a", "c", "b")] == [False, False, True, False, False], \
+        "Oldest key should be evicted once capacity is exceeded"
+        
+    now = [0.0]
+    index = RecentKeyIndex(capacity=100, window=10.0, clock=lambda: now[0])
+    seen = []
+    for at, key in ((0, "a"), (5, "b"), (9, "a"), (16, "b"), (18, "a"), (30, "a")):
+        now[0] = at
+        seen.append(index.seen(key))
+    assert seen == [False, False, True, False, True, False], "Keys should be forgotten once older than the window"
+    assert index.duplicates == 2 and index.expired == 3 and abs(index.duplicate_rate - 2 / 6) < 1e-9
+    
+    message = create_sample_mqtt_message("f8c6e10eb94d")
+    other_map = json.loads(json.dumps(message))
+    other_map["location"]["map_id"] = "682c66de8cde618ce1270230"
+    assert position_key(message) != position_key(other_map), "The same timestamp on another map is a different position"
+    for payload in (json.dumps(message), json.dumps(message, indent=2)):
+        assert raw_position_key(payload.encode("utf-8")) == position_key(message), "Raw key should match the decoded key"
+    message["timestamp"] = 1753346052898.5
+    assert raw_position_key(json.dumps(message).encode("utf-8")) is None, "Non-integer timestamps are left to the decoded key"
+    
+    temp_dir = tempfile.mkdtemp()
+    saved = (generate_ml_data_exte.OUTPUT_DIR, generate_ml_data_exte.csv_writers, generate_ml_data_exte.csv_files,
+             generate_ml_data_exte.tag_message_counts, generate_ml_data_exte.recent_positions,
+             generate_ml_data_exte.adv_controller)
+             
+    class NotedPositions:
+        def __init__(self):
+            self.noted = []
+            
+        def note_position(self, tag_mac):
+            self.noted.append(tag_mac)
+    
+    try:
+        generate_ml_data_exte.OUTPUT_DIR = temp_dir
+        generate_ml_data_exte.csv_writers = {}
+        generate_ml_data_exte.csv_files = {}
+        generate_ml_data_exte.tag_message_counts = {}
+        generate_ml_data_exte.recent_positions = RecentKeyIndex(100)
+        generate_ml_data_exte.adv_controller = NotedPositions()
+        
+        test_anchors = {"a907dead0861", "eb20694cea84"}
+        test_tag_mac = list(generate_ml_data_exte.TAG_MAC_TO_MAP_ID.keys())[0]
+        generate_ml_data_exte.setup_csv_files(test_anchors)
+        first = json.dumps(create_sample_mqtt_message(test_tag_mac)).encode("utf-8")
+        second_message = create_sample_mqtt_message(test_tag_mac)
+        second_message["timestamp"] += 1
+        second = json.dumps(second_message).encode("utf-8")
+        
+        # Two brokers delivering the same stream
+        for payload in (first, first, second, first, second):
+            generate_ml_data_exte.handle_payload(payload, test_anchors)
+        
+        assert generate_ml_data_exte.tag_message_counts[test_tag_mac] == 2, "Duplicates counted against MAX_LINES"
+        assert generate_ml_data_exte.recent_positions.duplicates == 3, "Expected 3 dropped duplicates"
+        assert len(generate_ml_data_exte.adv_controller.noted) == 2, "Duplicates should be dropped before admission counts them"
+        generate_ml_data_exte.adv_controller = None
+        generate_ml_data_exte.cleanup_files()
+        with open(os.path.join(temp_dir, f"{test_tag_mac}.csv")) as f:
+            assert sum(1 for _ in f) == 3, "Expected header + 2 unique rows"
+        
+        print("  ✅ Duplicate positions dropped before processing")
+    
+    finally:
+        (generate_ml_data_exte.OUTPUT_DIR, generate_ml_data_exte.csv_writers, generate_ml_data_exte.csv_files,
+         generate_ml_data_exte.tag_message_counts, generate_ml_data_exte.recent_positions,
+         generate_ml_data_exte.adv_controller) = saved
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_capture_replay():
+    """Test that a raw capture log replays into the generator like live messages"""
+    print("🧪 Testing capture and replay...")
+    
+    import generate_ml_data
+    import mqtt_capture
+    temp_dir = tempfile.mkdtemp()
+    capture_dir = os.path.join(temp_dir, "capture")
+    saved = (generate_ml_data.OUTPUT_DIR, generate_ml_data.csv_writers, generate_ml_data.csv_files,
+             generate_ml_data.tag_message_counts, generate_ml_data.get_all_anchor_macs, generate_ml_data.load_inventory,
+             generate_ml_data.recent_positions)
+    
+    try:
+        test_tag_mac = list(TAG_MAC_TO_MAP_ID.keys())[0]
+        writer = mqtt_capture.CaptureWriter(capture_dir, segment_bytes=2000)
+        for i in range(3):
+            message = create_sample_mqtt_message(test_tag_mac)
+            message["timestamp"] += i
+            writer.write("engine/1/positions", json.dumps(message).encode("utf-8"), received_at=1000.0 + i)
+        writer.write("engine/1/positions", json.dumps(message).encode("utf-8"), received_at=1002.5)  # QoS redelivery
+        writer.close()
+        assert len(glob.glob(os.path.join(capture_dir, mqtt_capture.SEGMENT_PATTERN))) > 1, "Segments should roll"
+        
+        # A crash mid-record leaves a truncated tail, which must not break reading
+        with open(os.path.join(capture_dir, "positions-99999999-999999-0000.bin.gz"), "wb") as f:
+            f.write(gzip.compress(mqtt_capture.RECORD_HEADER.pack(1003.0, 5, 100) + b"topic{")[:-4])
+        records = list(mqtt_capture.read_capture(capture_dir))
+        assert [record[0] for record in records] == [1000.0, 1001.0, 1002.0, 1002.5], "Records should come back in order"
+        
+        generate_ml_data.OUTPUT_DIR = os.path.join(temp_dir, "csv")
+        generate_ml_data.csv_writers = {}
+        generate_ml_data.csv_files = {}
+        generate_ml_data.tag_message_counts = {}
+        generate_ml_data.get_all_anchor_macs = lambda: {"a907dead0861", "eb20694cea84"}
+        generate_ml_data.load_inventory = lambda: None
+        
+        assert generate_ml_data.replay_runner(capture_dir) == 4, "Expected 4 replayed payloads"
+        with open(os.path.join(generate_ml_data.OUTPUT_DIR, f"{test_tag_mac}.csv")) as f:
+            rows = list(csv.reader(f))
+        assert [row[1] for row in rows[1:]] == ["1753346052898", "1753346052899", "1753346052900"], "Replayed rows mismatch"
+        
+        print("  ✅ Captured payloads replay into the CSVs")
+    
+    finally:
+        (generate_ml_data.OUTPUT_DIR, generate_ml_data.csv_writers, generate_ml_data.csv_files,
+         generate_ml_data.tag_message_counts, generate_ml_data.get_all_anchor_macs, generate_ml_data.load_inventory,
+         generate_ml_data.recent_positions) = saved
+        generate_ml_data.device_inventory = None
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+def test_anchor_registry():
+    """Test that the anchor registry learns, persists and re-surveys anchor positions"""
+    print("🧪 Testing anchor registry...")
+    
+    from anchor_registry import AnchorRegistry
+    temp_dir = tempfile.mkdtemp()
+    
+    try:
+        path = os.path.join(temp_dir, "anchor_registry.json")
+        registry = AnchorRegistry(path).load()
+        registry.bootstrap({"c32a723f0621": {"x": 1.0, "y": 2.0, "map_id": "682c66de8cde618ce1270230"}})
+        registry.observe("a907dead0861", 49.22, 36.26, "682c66f08cde618ce127025e", 1000)
+        registry.observe("a907dead0861", 49.22, 36.26, "682c66f08cde618ce127025e", 2000)
+        entry = registry.entries["a907dead0861"]
+        assert (entry["first_seen"], entry["last_seen"], entry["observations"]) == (1000, 2000, 2), "Sighting bookkeeping mismatch"
+        
+        registry.observe("a907dead0861", 60.0, 36.26, "682c66f08cde618ce127025e", 3000)
+        assert entry["x"] == 60.0 and entry["observations"] == 1 and registry.moved == 1, "Moved anchor should restart confidence"
+        registry.save()
+        
+        reloaded = AnchorRegistry(path).load()
+        assert reloaded.entries == registry.entries, "Registry should round-trip through the file"
+        assert reloaded.entries["c32a723f0621"]["confidence"] == 0.5, "Bootstrapped anchor confidence mismatch"
+        
+        # Repeated sightings at the stored position neither mark the registry dirty nor change its version
+        version = registry.version
+        registry.observe("a907dead0861", 60.0, 36.26, "682c66f08cde618ce127025e", 4000)
+        assert not registry.dirty and registry.version == version and entry["observations"] == 2, "Known sighting should only bump counters"
+        registry.save()
+        assert AnchorRegistry(path).load().entries["a907dead0861"]["last_seen"] == 3000, "Sightings alone should wait for the interval"
+        registry.save(final=True)
+        saved = AnchorRegistry(path).load().entries["a907dead0861"]
+        assert (saved["last_seen"], saved["confidence"]) == (4000, round(2 / 3, 4)), "Final save should write pending sightings"
+        
+        # Anchors learned after the layout was compiled get their default coordinates
+        import generate_ml_data_exte
+        saved_globals = (generate_ml_data_exte.anchor_registry, generate_ml_data_exte.ANCHOR_DATABASE, generate_ml_data_exte.row_layout)
+        try:
+            generate_ml_data_exte.anchor_registry = registry
+            generate_ml_data_exte.ANCHOR_DATABASE = registry.entries
+            generate_ml_data_exte.row_layout = None
+            anchor_macs = {"a907dead0861", "b1c2d3e4f506"}
+            layout = generate_ml_data_exte.get_row_layout(anchor_macs)
+            assert generate_ml_data_exte.get_row_layout(anchor_macs) is layout, "Layout should be reused while nothing changed"
+            registry.observe("b1c2d3e4f506", 5.0, 6.0, "682c66f08cde618ce127025e", 5000)
+            offset = generate_ml_data_exte.get_row_layout(anchor_macs).anchor_offsets["b1c2d3e4f506"]
+            assert generate_ml_data_exte.row_layout.template[offset + 2:offset + 4] == [5.0, 6.0], "New anchor should get default coordinates"
+        finally:
+            (generate_ml_data_exte.anchor_registry, generate_ml_data_exte.ANCHOR_DATABASE,
+             generate_ml_data_exte.row_layout) = saved_globals
+        
+        print("  ✅ Anchor registry tracks positions and persists them")
+    
+    finally:
+        shutil.rmtree(temp_dir)
+
+def test_device_inventory():
+    """Test the device list loader, its compiled cache and the live reconciliation"""
+    print("🧪 Testing device inventory...")
+    
+    import device_inventory
+    temp_dir = tempfile.mkdtemp()
+    
+    try:
+        cache_path = os.path.join(temp_dir, "device_inventory.json")
+        inventory = device_inventory.load_inventory(cache_path=cache_path)
+        assert len(inventory.anchors) == 28 and len(inventory.tags) == 100, "Device list sizes mismatch"
+        assert "fbd0430b8b21" in inventory.anchors, "MACs should be normalised to lowercase"
+        assert device_inventory.normalize_mac("FB:D0:43:0B:8B:21") == "fbd0430b8b21", "MAC normalisation mismatch"
+        
+        with patch.object(device_inventory, "read_device_list", side_effect=AssertionError("device list was re-read")):
+            cached = device_inventory.load_inventory(cache_path=cache_path)
+        assert cached.anchors == inventory.anchors and cached.tags == inventory.tags, "Cache should round-trip"
+        
+        inventory.note_heard("f260a59af3be", ["fbd0430b8b21", "a907dead0861"])
+        unknown, silent = inventory.reconcile()
+        assert unknown == ["a907dead0861"], "Live anchor missing from the inventory should be flagged"
+        assert len(silent) == 27 and "fbd0430b8b21" not in silent, "Heard inventory anchor should not be silent"
+        
+        print("  ✅ Inventory loads, caches and reconciles with live anchors")
+    
+    finally:
+        shutil.rmtree(temp_dir)
+
+def test_tag_sampling():
+    """Test stratified replacement above the cap and CSV compaction of replaced rows"""
+    print("🧪 Testing tag sampling...")
+    
+    import tag_sampling
+    temp_dir = tempfile.mkdtemp()
+    
+    try:
+        sample = tag_sampling.TagSample(10, "stratified", rng=random.Random(7))
+        for _ in range(10):
+            assert sample.admit(), "Rows below the capacity should always be admitted"
+            assert sample.record("0,0,1") is None, "Nothing should be replaced below the capacity"
+        for _ in range(5):
+            victim = sample.record("3,4,0")
+            assert victim is not None and victim < 10, "A row of the crowded stratum should be replaced"
+        assert sample.kept == 10 and len(sample.tombstones) == 5, "Sample should stay at its capacity"
+        assert sample.strata_counts() == {"0,0,1": 5, "3,4,0": 5}, "Strata should be evened out"
+        
+        admitted = sum(sample.admit() for _ in range(1000))
+        assert 0 < admitted < 100, f"Reservoir admission should get rarer as more is seen, admitted {admitted}"
+        
+        filename = os.path.join(temp_dir, "tag.csv")
+        with open(filename, 'w', newline='') as f:
+            f.write("map_id,position_timestamp\n")
+            for row in range(15):
+                f.write(f"m,{1000 + row}\n")
+        first_kept = min(set(range(15)) - sample.tombstones)
+        kept, first_timestamp, last_timestamp = tag_sampling.compact_csv(filename, sample.tombstones)
+        sample.compacted()
+        with open(filename, 'r') as f:
+            lines = f.read().splitlines()
+        assert kept == 10 and len(lines) == 11, "Compaction should drop the replaced rows"
+        assert first_timestamp == 1000 + first_kept and last_timestamp == 1014, "Compaction should report the kept timestamp range"
+        assert not sample.tombstones and len(sample.row_strata) == 10, "Rows should be renumbered after compaction"
+        
+        print("  ✅ Full tags keep a balanced, bounded sample and compact replaced rows")
+    
+    finally:
+        shutil.rmtree(temp_dir)
+
+def test_trigger_scheduler():
+    """Test bounded retries, failure limit and the background trigger thread"""
+    print("🧪 Testing API trigger scheduler...")
+    
+    import time
+    import requests
+    from trigger_scheduler import TriggerScheduler
+    
+    session = MagicMock()
+    session.post.side_effect = [MagicMock(status_code=500, text="busy"), MagicMock(status_code=201)]
+    scheduler = TriggerScheduler(["http://api-1", "http://api-2"], {}, {"devices": []}, attempts=2,
+                                 backoff_base=0.0, max_failures=2, session=session)
+    assert scheduler.trigger(), "Second attempt should succeed"
+    assert session.post.call_count == 2 and scheduler.consecutive_failures == 0, "Expected one retry"
+    
+    session.post.side_effect = requests.exceptions.ConnectionError("tunnel down")
+    assert not scheduler.trigger() and not scheduler.trigger(), "Unreachable API should fail the round"
+    assert session.post.call_count == 10, "Each round should try every URL a bounded number of times"
+    assert scheduler.disabled, "Scheduler should give up after max_failures rounds"
+    
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=201)
+    scheduler = TriggerScheduler(["http://api-1"], {}, {"devices": []}, interval=3600.0, session=session)
+    scheduler.start()
+    deadline = time.monotonic() + 2.0
+    while scheduler.successes == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert scheduler.successes == 1 and not scheduler.thread.is_alive(), "Background trigger should fire once and stop"
+    assert session.close.called, "Session should be closed on stop"
+    assert scheduler.stats()["latency_p50"] is not None, "Attempts should be timed"
+    
+    print("  ✅ Trigger retries are bounded and run off the MQTT thread")
+
+def test_tag_liveness():
+    """Test that tags are re-triggered before expiry, early when silent, and only while wanted"""
+    print("🧪 Testing liveness-aware re-triggering...")
+    
+    from trigger_scheduler import TagLiveness
+    
+    now = [0.0]
+    liveness = TagLiveness(["a", "b", "c"], broadcast_timeout=90.0, lead=10.0, quiet_after=30.0,
+                           batch_window=20.0, clock=lambda: now[0])
+    assert liveness.due() == ["a", "b", "c"], "Untriggered tags should be due right away"
+    liveness.note_triggered(["a", "b", "c"])
+    
+    now[0] = 5.0
+    liveness.note_seen("a")
+    liveness.note_seen("b")
+    now[0] = 30.0
+    assert liveness.due() == ["c"], "Only the silent tag should be re-triggered early"
+    liveness.note_triggered(["c"])
+    
+    now[0] = 65.0
+    assert liveness.due() == [], "Healthy tags should not be re-triggered before their lead time"
+    now[0] = 80.0
+    assert liveness.due() == ["a", "b", "c"], "Tags due within the batch window should share a request"
+    assert liveness.due(wanted=lambda tag_mac: tag_mac != "b") == ["a", "c"], "Unwanted tags should be left to time out"
+    
+    print("  ✅ Tags re-triggered just before expiry, silent tags sooner")
+
+def test_adv_rate_controller():
+    """Test that fast tags are slowed down so all tags reach the cap together"""
+    print("🧪 Testing adaptive advertising rate...")
+    
+    from adv_rate_controller import AdvRateController
+    from trigger_scheduler import TriggerScheduler
+    
+    now = [0.0]
+    controller = AdvRateController(["a", "b"], quota=100, progress=lambda tag_mac: 0, base_interval=20,
+                                   clock=lambda: now[0])
+    for _ in range(50):
+        controller.note_position("a")
+    for _ in range(5):
+        controller.note_position("b")
+    now[0] = 10.0
+    
+    trigger_payload = {"devices": ["a", "b"], "ble_settings": {"sync_interval": 10, "adv_interval": 20}, "timeout": 90}
+    bodies = controller.split(trigger_payload, ["a", "b"])
+    assert [(body["devices"], body["ble_settings"]["adv_interval"]) for body in bodies] == [(["b"], 20), (["a"], 160)], \
+        "Well-covered tag should advertise slower, the weak one at full rate"
+    assert bodies[1]["ble_settings"]["sync_interval"] == 10, "Other BLE settings should be kept"
+    assert trigger_payload["ble_settings"]["adv_interval"] == 20, "Base payload should not be modified"
+    assert abs(controller.eta_seconds() - 200.0) < 1e-6, "ETA should be set by the slowest tag"
+    assert abs(controller.target_seconds() - 200.0) < 1e-6, "ETA floor is the slowest tag at the fastest interval"
+    
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=201)
+    scheduler = TriggerScheduler(["http://api-1"], {}, trigger_payload, session=session, controller=controller)
+    assert scheduler.trigger() and session.post.call_count == 2, "Each adv_interval group should get its own request"
+    
+    print("  ✅ Per-tag adv_interval balances collection speed, ETA reported")
+
+def test_anchor_observations():
+    """Test that the compact anchor observations behave like the all_anchors dict they replace"""
+    print("🧪 Testing compact anchor observations...")
+    
+    from anchor_observations import AnchorObservations, MapCodes
+    
+    map_codes = MapCodes(MAP_IDS)
+    observations = AnchorObservations(map_codes)
+    expected = {}
+    for anchor_mac, rssi, used, map_id in [("a1", -90, 1, MAP_IDS[0]), ("a2", -95.5, 0, MAP_IDS[1]),
+                                           ("a3", "", 0, MAP_IDS[0]), ("a4", -80, 0, "other_map"),
+                                           ("a1", -92, 0, MAP_IDS[1])]:
+        anchor = {"rssi": rssi, "used": used, "x": 1.0, "y": 2.0, "map_id": map_id, "distance": 3.0, "signal_quality": ""}
+        observations.add(anchor_mac, **anchor)
+        expected[anchor_mac] = anchor
+        
+    assert observations.as_dict() == expected, "A repeated MAC should overwrite its record like a dict key"
+    assert list(observations.macs()) == list(expected), "Anchors should keep first-heard order"
+    assert map_codes.code("other_map") == len(MAP_IDS) and len(map_codes.names) == len(MAP_IDS) + 1, \
+        "Unknown map IDs should be interned once"
+    stats = observations.map_stats(MAP_IDS)
+    reference = sweep_map_stats(expected.values(), MAP_IDS)
+    for map_id in MAP_IDS:
+        assert stats[map_id].values() == reference[map_id].values(), f"Map stats should match the dict sweep for {map_id}"
+        
+    print("  ✅ Observations match the dict-based anchors")
+
+def test_feature_batch():
+    """Test that micro-batched rows match rows built one position at a time"""
+    print("🧪 Testing micro-batched feature extraction...")
+    
+    import generate_ml_data, generate_ml_data_exte
+    from batch_features import FeatureBatch, BatchedRowWriter
+    from row_layout import RowLayout
+    from anchor_observations import AnchorObservations, MapCodes
+    
+    anchor_macs = {"a1", "a2", "a3"}
+    layout = RowLayout(generate_csv_header(anchor_macs), MAP_IDS, {"a3": {"x": 1.0, "y": 2.0, "map_id": MAP_IDS[0]}})
+    now = [0.0]
+    batch = FeatureBatch(layout, MAP_IDS, capacity=3, max_delay=0.5, clock=lambda: now[0])
+    positions = [
+        {"a1": {"rssi": -90, "used": 1, "x": 3.0, "y": 4.0, "map_id": MAP_IDS[0], "distance": None, "signal_quality": "good"},
+         "a2": {"rssi": -95, "used": 0, "x": "", "y": "", "map_id": MAP_IDS[0], "distance": "", "signal_quality": ""},
+         "zz": {"rssi": -80, "used": 0, "x": "", "y": "", "map_id": MAP_IDS[0], "distance": "", "signal_quality": ""}},
+        {"a1": {"rssi": -91.5, "used": 1, "x": 0.0, "y": 0.0, "map_id": MAP_IDS[1], "distance": None, "signal_quality": "fair"},
+         "a2": {"rssi": -97, "used": 0, "x": "", "y": "", "map_id": MAP_IDS[1], "distance": "", "signal_quality": ""},
+         "a3": {"rssi": "", "used": 0, "x": "", "y": "", "map_id": MAP_IDS[0], "distance": "", "signal_quality": ""}},
+        {},
+    ]
+    expected = []
+    for index, anchors in enumerate(positions):
+        base = [MAP_IDS[0], 1000 + index, 0.0, 0.0, 0, 0, 0, 0, MAP_IDS[0]]
+        observations = AnchorObservations(MapCodes(MAP_IDS))
+        for anchor_mac, anchor in anchors.items():
+            observations.add(anchor_mac, **anchor)
+        batch.add("tag", base, observations, context=index)
+        row = layout.new_row()
+        layout.set_base(row, base)
+        for map_id, stats in sweep_map_stats(anchors.values(), MAP_IDS).items():
+            layout.set_map_stats(row, map_id, stats.values())
+        for anchor_mac, anchor in anchors.items():
+            cells = dict(anchor, distance=math.hypot(anchor["x"], anchor["y"]) if anchor["distance"] is None else anchor["distance"])
+            layout.set_anchor(row, anchor_mac, [cells[field] for field in ("rssi", "used", "x", "y", "map_id", "distance", "signal_quality")])
+        expected.append(row)
+        
+    assert batch.full and not batch.due(), "Batch should fill up before its delay expires"
+    now[0] = 0.5
+    assert batch.due(), "A waiting batch should be due after max_delay"
+    rows = batch.flush()
+    assert [context for _, _, context in rows] == [0, 1, 2], "Rows should come back in the order they were added"
+    for (_, row, _), expected_row in zip(rows, expected):
+        assert len(row) == len(expected_row), "Batched row should have the header width"
+        for cell, expected_cell in zip(row, expected_row):
+            assert type(cell) == type(expected_cell) and cell == expected_cell, f"Batched cell {cell!r} should match {expected_cell!r}"
+    assert len(batch) == 0 and batch.flush() == [], "Flush should empty the batch"
+    
+    # Rendered rows are the lines csv.writer would write for the same rows
+    for index, anchors in enumerate(positions):
+        observations = AnchorObservations(MapCodes(MAP_IDS))
+        for anchor_mac, anchor in anchors.items():
+            quoted = (index, anchor_mac) == (1, "a1")  # Needs quoting in the CSV
+            observations.add(anchor_mac, **dict(anchor, signal_quality='say "hi", ok' if quoted else anchor["signal_quality"]))
+        batch.add("tag", [MAP_IDS[0], 1000 + index, 0.0, 0.0, 0, 0, 0, 0, MAP_IDS[0]], observations)
+    lines = [line for _, line, _ in batch.flush(render=True)]
+    expected_rows = [list(row) for _, row, _ in rows]
+    expected_rows[1][layout.anchor_offsets["a1"] + 6] = 'say "hi", ok'
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(expected_rows)
+    assert "\r\n".join(lines) + "\r\n" == buffer.getvalue(), "Rendered lines should match csv.writer output"
+    
+    writer = BufferedCSVWriter(io.StringIO(), mark_column=1)
+    writer.write_rendered(lines[0], expected_rows[0][:9])
+    writer.flush()
+    assert writer.file_handle.getvalue() == lines[0] + "\r\n" and writer.last_mark_on_disk == 1000, "Rendered row should be written and marked"
+    
+    # Through both generators: batched rows equal process_position_message's scalar rows, cell for cell
+    class RowList:
+        def __init__(self):
+            self.rows, self.lines = [], []
+        def writerow(self, row):
+            self.rows.append(row)
+            
+    class LineList(RowList):
+        def write_rendered(self, line, leading):
+            self.lines.append(line)
+            
+    rng = random.Random(5)
+    tag_mac = list(TAG_MAC_TO_MAP_ID.keys())[0]
+    anchor_pool = [f"{rng.getrandbits(48):012x}" for _ in range(30)]
+    header_anchors = set(anchor_pool[:24])  # The other 6 are heard but have no columns
+    database = {mac: {"x": rng.uniform(0, 60), "y": rng.uniform(0, 60), "map_id": MAP_IDS[0]} for mac in anchor_pool[::2]}
+    messages = []
+    for index in range(240):
+        kind = index % 3  # Int, float or mixed RSSI
+        message = create_sample_mqtt_message(tag_mac)
+        message["timestamp"] += index
+        pos = message["location"]["position"]
+        heard = rng.sample(anchor_pool, rng.randint(0, 14))
+        used = rng.randint(0, len(heard))
+        anchors = []
+        for position, anchor_mac in enumerate(heard):
+            anchor = {"mac": anchor_mac, "map_id": rng.choice(MAP_IDS), "cart_d": round(rng.uniform(0, 30), 2),
+                      "rssi": rng.randint(-115, -70) if kind == 0 or (kind == 2 and rng.random() < 0.5) else round(rng.uniform(-115, -70), 2)}
+            if position < used and rng.random() < 0.8:
+                anchor.update(x=round(rng.uniform(0, 60), 2), y=round(rng.uniform(0, 60), 2), signal_quality="good")
+            if rng.random() < 0.05:
+                del anchor["rssi"]
+            anchors.append(anchor)
+        pos["used_anchors"], pos["unused_anchors"] = anchors[:used], anchors[used:]
+        messages.append(PositionMessage.from_dict(message))
+        
+    for module in (generate_ml_data, generate_ml_data_exte):
+        outputs = {}
+        for mode in ("scalar", "values", "rendered"):
+            writer = LineList() if mode == "rendered" else RowList()
+            batcher = None if mode == "scalar" else BatchedRowWriter({tag_mac: writer}, MAP_IDS, module.get_row_layout, capacity=64)
+            with patch.object(module, "csv_writers", {tag_mac: writer}), patch.object(module, "row_batcher", batcher), \
+                 patch.object(module, "tag_message_counts", {tag_mac: 10}), patch.object(module, "message_count", 0), \
+                 patch.object(module, "ANCHOR_DATABASE", database, create=True), patch("builtins.print"):
+                for message in messages:
+                    module.process_position_message(message, header_anchors)
+                if batcher is not None:
+                    batcher.flush(force=True)
+            outputs[mode] = writer
+        expected_rows = outputs["scalar"].rows
+        assert len(expected_rows) == len(outputs["values"].rows) == len(outputs["rendered"].lines) == len(messages)
+        for row, expected_row in zip(outputs["values"].rows, expected_rows):
+            assert row == expected_row and list(map(type, row)) == list(map(type, expected_row)), \
+                f"{module.__name__}: batched row should equal the scalar row"
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(expected_rows)
+        assert "\r\n".join(outputs["rendered"].lines) + "\r\n" == buffer.getvalue(), f"{module.__name__}: rendered rows should match"
+    
+    print("  ✅ Batched rows match the per-position rows")
+
+def test_pipeline_metrics():
+    """Test stage histograms, the Prometheus endpoint and the JSON dump"""
+    print("🧪 Testing pipeline metrics...")
+    
+    import threading
+    import urllib.request
+    from pipeline_metrics import PipelineMetrics, MetricsServer
+    
+    temp_dir = tempfile.mkdtemp()
+    try:
+        metrics = PipelineMetrics(json_path=os.path.join(temp_dir, "metrics.json"), json_interval=60.0)
+        for i in range(1, 1001):
+            metrics.observe("decode", i * 1e-6)  # 1 µs ... 1 ms, uniform
+        metrics.count("parse_errors", 2)
+        depth = [7]
+        metrics.register("queue_depth", lambda: depth[0], "gauge", "Payloads waiting")
+        metrics.register("broken", lambda: 1 / 0, "counter")
+        
+        summary = metrics.snapshot()["stages"]["decode"]
+        assert summary["count"] == 1000 and abs(summary["sum"] - 0.5005) < 1e-9, "Every observation should be counted"
+        for key, expected in (("p50", 500e-6), ("p95", 950e-6), ("p99", 990e-6)):
+            assert abs(summary[key] - expected) / expected < 0.1, f"{key} should be within a bucket's interpolation of {expected}"
+        assert metrics.snapshot()["stages"]["flush"]["p50"] is None, "Empty stages should report no quantiles"
+        workers = [threading.Thread(target=lambda: [metrics.observe("features", 1e-4) for _ in range(500)]) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert metrics.snapshot()["stages"]["features"]["count"] == 1000, "Per-thread shards should be merged"
+        
+        server = MetricsServer(metrics, port=0).start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+                text = response.read().decode("utf-8")
+        finally:
+            server.stop()
+        assert 'rtls_stage_seconds_bucket{stage="decode",le="+Inf"} 1000' in text, "Histogram buckets should be cumulative"
+        assert 'rtls_stage_seconds_count{stage="decode"} 1000' in text
+        assert "rtls_parse_errors_total 2" in text and "rtls_queue_depth 7.0" in text, "Counters and gauges should be exported"
+        assert "broken" not in text, "A failing readout should be skipped, not break the endpoint"
+        
+        assert not metrics.dump_due(now=metrics.last_dump + 1) and metrics.dump_due(now=metrics.last_dump + 61), \
+            "JSON dump should follow its interval"
+        with open(os.path.join(temp_dir, "metrics.json")) as f:
+            dumped = json.load(f)
+        assert dumped["counters"]["parse_errors"] == 2 and dumped["gauges"]["queue_depth"] == 7.0
+        
+        print("  ✅ Stage quantiles, /metrics and metrics.json look right")
+    finally:
+        shutil.rmtree(temp_dir)
+
+def test_tag_registry():
+    """Test the shared tag registry lookups and the tables derived from it"""
+    print("🧪 Testing tag registry...")
+    
+    from tag_registry import TAGS, TagRegistry, DOWNSTAIRS, MEZZANINE, UNKNOWN_FLOOR
+    
+    assert len(TAGS) == 60 and TAGS.floors.count(DOWNSTAIRS) == 30 and TAGS.floors.count(MEZZANINE) == 30
+    index = TAGS.index("f8c6e10eb94d")
+    assert TAGS.ids[index] == "47437" and TAGS.index_of_id("47437") == index, "Lookups should agree in both directions"
+    assert TAGS.mac_of("47437") == "f8c6e10eb94d" and TAGS.id_of("f8c6e10eb94d") == "47437"
+    assert TAGS.floor("f8c6e10eb94d") == MEZZANINE and TAGS.floor("000000000000") == UNKNOWN_FLOOR
+    assert TAGS.mac_of("nope") is None and "000000000000" not in TAGS
+    assert TAGS.floor_of_map(MAP_IDS[0]) == DOWNSTAIRS and MAP_IDS == TAGS.map_ids, "Floor codes index MAP_IDS"
+    assert TAG_MAC_TO_MAP_ID == TAGS.mac_to_map_id(), "Generators should use the registry"
+    
+    counters = TAGS.counters()
+    counters[index] += 1
+    assert len(counters) == 60 and sum(counters) == 1
+    
+    try:
+        TagRegistry([("1", "aa", DOWNSTAIRS), ("2", "aa", MEZZANINE)])
+        assert False, "A MAC listed twice should be rejected"
+    except ValueError:
+        pass
+        
+    print("  ✅ Tag registry resolves MACs, IDs and floors")
+
+def test_floor_success_offline():
+    """Test the offline floor evaluation against the live run-sampling logic"""
+    print("🧪 Testing offline floor success evaluation...")
+    
+    import numpy as np
+    import floor_success_rate
+    from floor_success_offline import sample_runs, schedule_runs, load_stream, evaluate, report
+    from spatial_grid import SpatialGrid
+    from tag_registry import TAGS, DOWNSTAIRS
+    
+    def live_sampling(tags, total_runs, tags_per_run):
+        """floor_success_rate.on_message's first-message-per-run rule, one row at a time"""
+        rows, published, runs = [], set(), 0
+        for row, tag in enumerate(tags):
+            if runs >= total_runs:
+                break
+            if tag not in published:
+                published.add(tag)
+                rows.append(row)
+                if len(published) >= tags_per_run:
+                    runs += 1
+                    published.clear()
+        return rows, runs
+        
+    rng = random.Random(7)
+    for _ in range(50):
+        tags = np.array([rng.randrange(6) for _ in range(rng.randrange(1, 120))], np.int64)
+        total_runs, tags_per_run = rng.randrange(1, 8), rng.randrange(1, 7)
+        rows, runs = sample_runs(tags, total_runs, tags_per_run)
+        assert (rows.tolist(), runs) == live_sampling(tags.tolist(), total_runs, tags_per_run), "Sampling should match the live rule"
+        scheduled, scheduler = schedule_runs(tags, np.arange(len(tags)) * 1000, total_runs, tags_per_run)
+        assert (scheduled.tolist(), scheduler.closed) == (rows.tolist(), runs), "One run at a time should match the NumPy path"
+        
+    # Tag 0 every second, nobody else: runs of 2 only close by deadline, up to `depth` of them filled at once
+    tags, timestamps = np.zeros(60, np.int64), np.arange(60) * 1000
+    rows, scheduler = schedule_runs(tags, timestamps, 3, 2, depth=1, deadline=10.0)
+    assert rows.tolist() == [0, 10, 20] and scheduler.closed_by_deadline == 3
+    rows, scheduler = schedule_runs(tags, timestamps, 3, 2, depth=3, deadline=10.0)
+    assert rows.tolist() == [0, 1, 2] and scheduler.closed_by_deadline == 3 and scheduler.finished
+        
+    temp_dir = tempfile.mkdtemp()
+    saved = {name: getattr(floor_success_rate, name) for name in (
+        "success_count", "failure_count", "downstairs_success_count", "downstairs_failure_count",
+        "mezzanine_success_count", "mezzanine_failure_count", "tag_message_counts", "failed_tags", "current_run", "start_time",
+        "run_scheduler")}
+    saved_grids = floor_success_rate.spatial_grids
+    floor_success_rate.spatial_grids = [SpatialGrid(-1.0, -1.0, 20.0, 5.0) for _ in saved_grids]
+    try:
+        # Interleaved tags: 0 (downstairs) always right, 59 (mezzanine) wrong every other row; plus an unregistered file
+        for tag_index, offset, wrong in ((0, 0, lambda k: False), (59, 1, lambda k: k % 2 == 1)):
+            true_map = TAGS.map_ids[TAGS.floors[tag_index]]
+            other_map = TAGS.map_ids[1 - TAGS.floors[tag_index]]
+            with open(os.path.join(temp_dir, f"{TAGS.macs[tag_index]}.csv"), "w") as f:
+                f.write("map_id,position_timestamp,tag_x,tag_y,cov_xx,true_map_id\n")
+                for k in range(10):
+                    f.write(f"{other_map if wrong(k) else true_map},{1000 + 2 * k + offset},{k},1.0,0.5,{true_map}\n")
+        with open(os.path.join(temp_dir, "000000000000.csv"), "w") as f:
+            f.write("map_id,position_timestamp,tag_x,tag_y,true_map_id\nx,1,0,0,y\n")
+            
+        stream = load_stream(temp_dir)
+        assert len(stream["tag"]) == 20 and (np.diff(stream["timestamp"]) >= 0).all(), "Rows should merge in time order"
+        every = evaluate(stream, every_row=True)
+        assert (every["success"], every["failure"]) == (15, 5)
+        assert every["tag_failures"][59] == 5 and every["floor_failure"].tolist() == [0, 5]
+        
+        sampled = evaluate(stream, total_runs=3, tags_per_run=2)
+        assert sampled["runs"] == 3 and sampled["tag_messages"][0] == sampled["tag_messages"][59] == 3
+        assert sampled["scheduler"].depth == floor_success_rate.RUN_PIPELINE_DEPTH, "Runs should be replayed with the live settings"
+        single = evaluate(stream, total_runs=3, tags_per_run=2, depth=1, deadline=None)
+        assert single["scheduler"] is None and single["rows"].tolist() == sampled["rows"].tolist()
+        
+        with patch.object(floor_success_rate, "create_spatial_visualization"):
+            report(stream, sampled)
+        assert floor_success_rate.success_count + floor_success_rate.failure_count == 6
+        assert floor_success_rate.run_scheduler is sampled["scheduler"]
+        assert floor_success_rate.spatial_grids[DOWNSTAIRS].totals() == (3, 0), "Scored positions should feed the heatmap"
+        
+        print("  ✅ Offline evaluation samples runs like the live script")
+        
+    finally:
+        for name, value in saved.items():
+            setattr(floor_success_rate, name, value)
+        floor_success_rate.spatial_grids = saved_grids
+        shutil.rmtree(temp_dir)
+
+def test_quality_monitor():
+    """Test the sliding-window floor accuracy monitor"""
+    print("🧪 Testing quality monitor...")
+    
+    from quality_monitor import QualityMonitor, EXCELLENT, DEGRADED, POOR, NO_DATA
+    from tag_registry import TAGS, DOWNSTAIRS, MEZZANINE
+    
+    now = [0.0]
+    monitor = QualityMonitor(TAGS, window=30.0, bucket_seconds=10.0, interval=60.0, clock=lambda: now[0])
+    downstairs_tag, mezzanine_tag = TAGS.floors.index(DOWNSTAIRS), TAGS.floors.index(MEZZANINE)
+    
+    for _ in range(9):
+        assert monitor.record(downstairs_tag, DOWNSTAIRS)
+    assert not monitor.record(downstairs_tag, MEZZANINE), "A wrong floor should be reported"
+    now[0] = 15.0
+    monitor.record(mezzanine_tag, -1)  # Map outside the registry
+    status = monitor.status()
+    assert (status["correct"], status["wrong"]) == (9, 2) and status["status"] == DEGRADED
+    assert status["confusion"] == [[9, 1, 0], [0, 0, 1]], "Confusion is true floor x predicted floor (+ unknown)"
+    assert monitor.tag_counts(downstairs_tag) == (9, 1) and monitor.worst_tags()[0][1:] == (1, 10)
+    
+    now[0] = 35.0  # First bucket [0, 10) has left the 30 s window
+    status = monitor.status()
+    assert (status["correct"], status["wrong"]) == (0, 1) and status["status"] == POOR
+    now[0] = 500.0
+    assert monitor.status()["status"] == NO_DATA and sum(monitor.totals) == 0, "Everything should have expired"
+    for _ in range(20):
+        monitor.record(mezzanine_tag, MEZZANINE)
+    assert monitor.status()["status"] == EXCELLENT and monitor.decisions == 31
+    assert "[QUALITY STATUS] EXCELLENT: 100.0% accuracy (20 correct, 0 wrong)" in monitor.status_lines()[0]
+    
+    with patch('builtins.print') as mock_print:
+        assert monitor.emit_due(now[0]) and not monitor.emit_due(now[0] + 59), "Status should only print every interval"
+    assert mock_print.call_count == 1
+    
+    print("  ✅ Windowed accuracy slides and classifies")
+
+def test_spatial_grid():
+    """Test the fixed-size heatmap accumulators behind the spatial plot"""
+    print("🧪 Testing spatial grid...")
+    
+    import numpy as np
+    import floor_success_rate
+    from spatial_grid import SpatialGrid
+    from tag_registry import TAGS, DOWNSTAIRS, MEZZANINE
+    
+    grid = SpatialGrid.around(floor_success_rate.verts_floor_1, cell_size=2.0, margin=1.0)
+    assert (grid.x_min, grid.y_min) == (11.0, 35.3) and (grid.columns, grid.rows) == (29, 6)
+    assert grid.x_max >= 67.6 and grid.y_max >= 46.6, "Bounds should cover the outline plus margin"
+    
+    grid = SpatialGrid(0.0, 0.0, 4.0, 2.0, cell_size=1.0)
+    for x, y, success in ((0.5, 0.5, True), (0.9, 0.1, False), (0.2, 0.7, False), (3.5, 1.5, True),
+                          (4.0, 1.0, True), (-0.1, 1.0, False), (float("nan"), 1.0, False)):
+        grid.add(x, y, success)
+    assert grid.success.shape == (2, 4) and grid.outside == [1, 2], "Out-of-bounds and NaN positions are only counted"
+    assert grid.totals() == (3, 4)
+    rate = grid.failure_rate()
+    assert abs(rate[0, 0] - 2 / 3) < 1e-9 and rate[1, 3] == 0.0 and rate.mask[0, 1], "Empty cells should be masked"
+    
+    # The vectorized path counts exactly like add()
+    rng = np.random.default_rng(3)
+    xs, ys = rng.uniform(-1, 5, 500), rng.uniform(-1, 3, 500)
+    success = rng.random(500) < 0.7
+    one, many = SpatialGrid(0.0, 0.0, 4.0, 2.0, 0.5), SpatialGrid(0.0, 0.0, 4.0, 2.0, 0.5)
+    for x, y, ok in zip(xs.tolist(), ys.tolist(), success.tolist()):
+        one.add(x, y, ok)
+    many.add_many(xs, ys, success)
+    assert (one.success == many.success).all() and (one.failure == many.failure).all() and one.outside == many.outside
+    many.reset()
+    assert many.totals() == (0, 0)
+    
+    # floor_success_rate counts into the grid of the tag's floor, however many positions arrive
+    saved = floor_success_rate.spatial_grids
+    floor_success_rate.spatial_grids = [SpatialGrid(0.0, 0.0, 4.0, 2.0) for _ in saved]
+    try:
+        downstairs_mac = TAGS.macs[TAGS.floors.index(DOWNSTAIRS)]
+        mezzanine_mac = TAGS.macs[TAGS.floors.index(MEZZANINE)]
+        for _ in range(1000):
+            floor_success_rate.add_position_to_tracking(downstairs_mac, 1.5, 0.5, True)
+        floor_success_rate.add_position_to_tracking(mezzanine_mac, 1.5, 0.5, False)
+        floor_success_rate.add_position_to_tracking("000000000000", 1.5, 0.5, False)
+        assert floor_success_rate.spatial_grids[DOWNSTAIRS].success[0, 1] == 1000
+        assert floor_success_rate.spatial_grids[MEZZANINE].totals() == (0, 1), "Unknown MACs are not tracked"
+    finally:
+        floor_success_rate.spatial_grids = saved
+        
+    print("  ✅ Spatial grid counts per cell in fixed memory")
+
+def test_run_scheduler():
+    """Test quorum/deadline run completion with overlapping runs"""
+    print("🧪 Testing run scheduler...")
+    
+    import floor_success_rate
+    from recent_keys import RecentKeyIndex
+    from run_scheduler import RunScheduler, QUORUM, DEADLINE
+    from spatial_grid import SpatialGrid
+    from tag_registry import TagRegistry, TAGS
+    
+    registry = TagRegistry([(f"t{index}", f"{index:012x}", index % 2) for index in range(6)])
+    now = [0.0]
+    
+    # One run at a time without a deadline is the original wait-for-N-tags rule
+    rng = random.Random(11)
+    for _ in range(30):
+        scheduler = RunScheduler(registry, total_runs=4, quorum=3, clock=lambda: now[0])
+        published, runs, expected, got = set(), 0, [], []
+        for tag in [rng.randrange(6) for _ in range(60)]:
+            if runs < 4 and tag not in published:
+                published.add(tag)
+                expected.append(tag)
+                if len(published) >= 3:
+                    runs, published = runs + 1, set()
+            if scheduler.assign(tag) is not None:
+                got.append(tag)
+            scheduler.close_due()
+        assert got == expected and scheduler.closed == runs, "Depth 1 without deadline should match the old rule"
+        
+    # A silent tag no longer stalls a run: the deadline closes it and the tag is counted as a straggler
+    scheduler = RunScheduler(registry, total_runs=3, quorum=6, deadline=30.0, depth=2, clock=lambda: now[0])
+    for tag in range(5):
+        assert scheduler.assign(tag).number == 1
+    now[0] = 10.0
+    assert scheduler.assign(0).number == 2, "A tag already in run 1 should feed the overlapping run 2"
+    assert scheduler.assign(0) is None and scheduler.discarded == 1, "No third run while depth is 2"
+    now[0] = 29.0
+    assert scheduler.close_due() == []
+    now[0] = 30.0
+    closed = scheduler.close_due()
+    assert [run.number for run in closed] == [1] and closed[0].closed_by == DEADLINE and closed[0].stragglers() == [5]
+    assert scheduler.missed[5] == 1 and scheduler.worst_stragglers() == [("t5", 1)]
+    
+    # The straggler joins the oldest open run; the run that reaches the quorum closes
+    assert scheduler.assign(5).number == 2
+    for tag in range(1, 5):
+        assert scheduler.assign(tag).number == 2
+    closed = scheduler.close_due()
+    assert [run.closed_by for run in closed] == [QUORUM] and scheduler.closed_by_quorum == 1
+    assert scheduler.assign(3).number == 3 and not scheduler.finished
+    now[0] = 100.0
+    scheduler.close_due()
+    assert scheduler.finished and scheduler.assign(0) is None, "No runs open after the last one"
+    
+    # floor_success_rate samples through the scheduler and disconnects after the last run
+    class Client:
+        disconnected = False
+        def disconnect(self):
+            self.disconnected = True
+            
+    class Message:
+        def __init__(self, tag_index, timestamp):
+            self.payload = json.dumps({
+                "tag": {"id": TAGS.ids[tag_index], "mac": TAGS.macs[tag_index]}, "timestamp": timestamp,
+                "location": {"map_id": TAGS.map_ids[TAGS.floors[tag_index]], "position": {"x": 20.0, "y": 40.0}}}).encode()
+                
+    saved = {name: getattr(floor_success_rate, name) for name in (
+        "run_scheduler", "current_run", "success_count", "failure_count", "downstairs_success_count",
+        "mezzanine_success_count", "tag_message_counts", "recent_positions", "spatial_grids")}
+    client = Client()
+    try:
+        floor_success_rate.run_scheduler = RunScheduler(TAGS, total_runs=2, quorum=2, depth=2, clock=lambda: now[0])
+        floor_success_rate.tag_message_counts = TAGS.counters()
+        floor_success_rate.recent_positions = RecentKeyIndex(100)
+        floor_success_rate.spatial_grids = [SpatialGrid(0.0, 0.0, 1.0, 1.0) for _ in saved["spatial_grids"]]
+        for timestamp, tag_index in enumerate((0, 0, 0, 1)):
+            floor_success_rate.on_message(client, None, Message(tag_index, 1000 + timestamp))
+        assert floor_success_rate.run_scheduler.discarded == 1, "Tag 0's third message has no open run"
+        assert floor_success_rate.current_run == 1 and not client.disconnected
+        floor_success_rate.on_message(client, None, Message(1, 2000))
+        assert floor_success_rate.current_run == 2 and client.disconnected
+        assert floor_success_rate.tag_message_counts[0] == floor_success_rate.tag_message_counts[1] == 2
+    finally:
+        for name, value in saved.items():
+            setattr(floor_success_rate, name, value)
+            
+    print("  ✅ Runs close on quorum or deadline and overlap")
+
 def test_csv_file_setup():
     """Test CSV file creation"""
     print("🧪 Testing CSV file setup...")
@@ -209,6 +1421,7 @@ def test_message_processing():
         orig_files = generate_ml_data.csv_files  
         orig_counts = generate_ml_data.tag_message_counts
         orig_message_count = generate_ml_data.message_count
+        orig_batcher = generate_ml_data.row_batcher
         
         try:
             # Open file for appending
@@ -220,9 +1433,10 @@ def test_message_processing():
                 generate_ml_data.csv_files = {test_tag_mac: f}
                 generate_ml_data.tag_message_counts = {test_tag_mac: 0}
                 generate_ml_data.message_count = 0
+                generate_ml_data.row_batcher = None  # Write the row right away
                 
                 # Process the message
-                process_position_message(test_message, test_anchors)
+                process_position_message(PositionMessage.from_dict(test_message), test_anchors)
                 
         finally:
             # Restore original values
@@ -230,6 +1444,7 @@ def test_message_processing():
             generate_ml_data.csv_files = orig_files
             generate_ml_data.tag_message_counts = orig_counts
             generate_ml_data.message_count = orig_message_count
+            generate_ml_data.row_batcher = orig_batcher
         
         # Check if data was written correctly
         with open(csv_file_path, 'r') as f:
@@ -261,7 +1476,7 @@ def test_tag_filtering():
     test_anchors = {"test_anchor"}
     
     with patch('generate_ml_data.message_count', 0) as mock_count:
-        process_position_message(unknown_tag_message, test_anchors)
+        process_position_message(PositionMessage.from_dict(unknown_tag_message), test_anchors)
         # Message count should not increase for unknown tags
         # (Since we're patching, we can't directly check this, but the function should return early)
     
@@ -317,11 +1532,10 @@ def run_integration_test():
             message["position"]["y"] += i * 0.3
             message["timestamp"] += i * 1000
             
-            process_position_message(message, anchor_macs)
+            process_position_message(PositionMessage.from_dict(message), anchor_macs)
         
-        # Close files properly
-        for file_handle in generate_ml_data.csv_files.values():
-            file_handle.close()
+        # Flush buffered rows and close files properly
+        generate_ml_data.cleanup_files()
         
         # Verify results
         print("  🔍 Verifying results...")
@@ -364,6 +1578,30 @@ def main():
         test_basic_functions()
         test_anchor_mac_extraction()
         test_csv_header_generation()
+        test_row_layout()
+        test_buffered_csv_writer()
+        test_ingestion_pipeline()
+        test_position_decoder()
+        test_map_stats_sweep()
+        test_sparse_output_round_trip()
+        test_parquet_output()
+        test_csv_manifest()
+        test_cross_broker_dedup()
+        test_capture_replay()
+        test_anchor_registry()
+        test_device_inventory()
+        test_tag_sampling()
+        test_trigger_scheduler()
+        test_tag_liveness()
+        test_adv_rate_controller()
+        test_anchor_observations()
+        test_feature_batch()
+        test_pipeline_metrics()
+        test_tag_registry()
+        test_floor_success_offline()
+        test_quality_monitor()
+        test_spatial_grid()
+        test_run_scheduler()
         test_csv_file_setup()
         test_message_processing()
         test_tag_filtering()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Background scheduler for the tag broadcast trigger
+The POST that makes the tags broadcast runs on its own thread, so the MQTT
+loop is never held up by a slow or unreachable API. Requests go through one
+keep-alive requests.Session; failed attempts are retried a bounded number
+of times per URL with jittered exponential backoff, and every attempt is
+timed.
+
+With a TagLiveness the scheduler triggers per tag instead of on a fixed
+interval: a tag is re-triggered shortly before its broadcast times out, or
+sooner if it has stayed silent since its last trigger, and tags that need
+no more positions are left to time out. A controller (see
+adv_rate_controller.py) can split a trigger into several requests with
+different settings per group of tags.
+"""
+
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+import collections, math, random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+
+SUCCESS_STATUS = 201
+
+def create_session(headers: Dict[str, str], verify: bool = False, pool_size: int = 4) -> requests.Session:
+    """Keep-alive session with a small connection pool; retries are handled by the scheduler"""
+    session = requests.Session()
+    session.headers.update(headers)
+    session.verify = verify
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not verify:
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # Tunneled endpoint
+    return session
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]"""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TagLiveness:
+    """Trigger and last-seen times per tag, deciding which tags to include in the next trigger"""
+
+    def __init__(self, tags: Iterable[str], broadcast_timeout: float, lead: float = 10.0,
+                 quiet_after: float = 30.0, batch_window: float = 20.0, clock: Callable[[], float] = time.monotonic):
+        self.tags = list(tags)
+        self.tag_set = set(self.tags)
+        self.broadcast_timeout = broadcast_timeout  # Seconds a tag broadcasts after one trigger
+        self.lead = lead  # Re-trigger this long before the broadcast times out
+        self.quiet_after = quiet_after  # Re-trigger a tag silent this long after its trigger (doubling per miss)
+        self.batch_window = batch_window  # Tags due within this window join the same request
+        self.clock = clock
+        self.triggered: Dict[str, float] = {}
+        self.last_seen: Dict[str, float] = {}
+        self.quiet_streak: Dict[str, int] = {}  # Consecutive triggers a tag stayed silent after
+
+    def note_seen(self, tag_mac: str):
+        """Called for every position received (hot path, no lock needed for a dict store)"""
+        if tag_mac in self.tag_set:
+            self.last_seen[tag_mac] = self.clock()
+
+    def silent_since_trigger(self, tag_mac: str) -> bool:
+        triggered = self.triggered.get(tag_mac)
+        return triggered is not None and self.last_seen.get(tag_mac, -math.inf) < triggered
+
+    def note_triggered(self, tags: Iterable[str]):
+        now = self.clock()
+        for tag_mac in tags:
+            self.quiet_streak[tag_mac] = self.quiet_streak.get(tag_mac, 0) + 1 if self.silent_since_trigger(tag_mac) else 0
+            self.triggered[tag_mac] = now
+
+    def retrigger_at(self, tag_mac: str) -> float:
+        """When the tag should be triggered next"""
+        triggered = self.triggered.get(tag_mac)
+        if triggered is None:
+            return -math.inf
+        expires_soon = triggered + self.broadcast_timeout - self.lead
+        if self.silent_since_trigger(tag_mac):
+            return min(expires_soon, triggered + self.quiet_after * 2 ** self.quiet_streak.get(tag_mac, 0))
+        return expires_soon
+
+    def due(self, wanted: Optional[Callable[[str], bool]] = None) -> List[str]:
+        """Tags to trigger now; empty until at least one wanted tag is due"""
+        now = self.clock()
+        retrigger = {tag_mac: self.retrigger_at(tag_mac) for tag_mac in self.tags if wanted is None or wanted(tag_mac)}
+        if not any(at <= now for at in retrigger.values()):
+            return []
+        return [tag_mac for tag_mac, at in retrigger.items() if at <= now + self.batch_window]
+
+    def summary(self) -> Dict[str, int]:
+        now = self.clock()
+        broadcasting = [tag_mac for tag_mac, at in list(self.triggered.items()) if now < at + self.broadcast_timeout]
+        return {
+            "broadcasting": len(broadcasting),
+            "silent": sum(1 for tag_mac in broadcasting if self.silent_since_trigger(tag_mac)),
+            "idle": len(self.tags) - len(broadcasting),
+        }
+
+class TriggerScheduler:
+    """Fires the broadcast trigger every `interval` seconds from a daemon thread
+
+    Each round tries the URLs in order, up to `attempts` times each. After
+    `max_failures` consecutive failed rounds the scheduler stops triggering
+    (None keeps trying forever). With `liveness`, rounds only carry the tags
+    it reports as due (and `wanted` accepts), checked every poll_interval.
+    With `controller`, its split(payload, devices) gives the request bodies.
+    """
+
+    def __init__(self, urls: List[str], headers: Dict[str, str], payload: Dict[str, Any],
+                 interval: float = 100.0, attempts: int = 3, timeout: Tuple[float, float] = (5.0, 30.0),
+                 backoff_base: float = 1.0, backoff_cap: float = 15.0, max_failures: Optional[int] = None,
+                 session: Optional[requests.Session] = None, rng: Optional[random.Random] = None,
+                 clock: Callable[[], float] = time.monotonic, name: str = "trigger",
+                 liveness: Optional[TagLiveness] = None, wanted: Optional[Callable[[str], bool]] = None,
+                 poll_interval: float = 1.0, controller: Optional[Any] = None):
+        self.urls = urls
+        self.payload = payload
+        self.interval = interval
+        self.attempts = attempts
+        self.timeout = timeout  # (connect, read) seconds per attempt
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_failures = max_failures
+        self.session = session or create_session(headers)
+        self.rng = rng or random.Random()
+        self.clock = clock
+        self.name = name
+        self.liveness = liveness
+        self.wanted = wanted
+        self.poll_interval = poll_interval
+        self.controller = controller
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.lock = threading.Lock()
+        self.rounds = 0
+        self.successes = 0
+        self.attempts_made = 0
+        self.devices_sent = 0  # Tags listed in successful triggers
+        self.consecutive_failures = 0
+        self.last_success: Optional[float] = None
+        self.latencies = collections.deque(maxlen=200)  # Seconds per attempt, most recent last
+
+    @property
+    def disabled(self) -> bool:
+        return self.max_failures is not None and self.consecutive_failures >= self.max_failures
+
+    def start(self):
+        """Fire the first trigger right away, then every interval (or whenever tags are due)"""
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def request_now(self):
+        """Fire the next round immediately instead of waiting out the interval"""
+        self.wake_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.liveness is None:
+                self.trigger()
+                wait = self.interval
+            else:
+                devices = self.liveness.due(self.wanted)
+                wait = self.poll_interval
+                if devices and not self.trigger(devices):
+                    wait = self.backoff_cap  # Give the API a moment before the next round
+            if self.disabled:
+                print("🛑 Too many API failures - continuing with MQTT only (tags may already be broadcasting)")
+                return
+            self.wake_event.wait(wait)
+            self.wake_event.clear()
+
+    def post(self, url: str, body: Dict[str, Any]) -> bool:
+        """One timed attempt; True on HTTP 201"""
+        started = self.clock()
+        try:
+            response = self.session.post(url, json=body, timeout=self.timeout)
+            ok = response.status_code == SUCCESS_STATUS
+            if not ok:
+                print(f"⚠️  API Response {response.status_code}: {response.text[:200]}")
+            return ok
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Request failed ({url}): {e}")
+            return False
+        finally:
+            with self.lock:
+                self.attempts_made += 1
+                self.latencies.append(self.clock() - started)
+
+    def trigger(self, devices: Optional[List[str]] = None) -> bool:
+        """One round: send every request body with bounded, jittered retries; True if all were accepted
+
+        devices replaces the payload's device list (all of them if None).
+        """
+        devices = self.payload["devices"] if devices is None else devices
+        if self.controller is not None:
+            bodies = self.controller.split(self.payload, devices)
+        else:
+            bodies = [self.payload if devices is self.payload["devices"] else dict(self.payload, devices=devices)]
+        with self.lock:
+            self.rounds += 1
+        ok = all([self.send(body) for body in bodies])  # Every group is sent even if one fails
+        with self.lock:
+            if ok:
+                self.successes += 1
+                self.consecutive_failures = 0
+                self.last_success = self.clock()
+            else:
+                self.consecutive_failures += 1
+        if not ok:
+            limit = f"/{self.max_failures}" if self.max_failures is not None else ""
+            print(f"❌ All API request attempts failed ({self.consecutive_failures}{limit} consecutive failures)")
+            print("💡 Start tunnels with: ./start_tunnels.sh")
+        return ok
+
+    def send(self, body: Dict[str, Any]) -> bool:
+        """Post one body, trying each URL up to `attempts` times"""
+        for url in self.urls:
+            for attempt in range(self.attempts):
+                if self.stop_event.is_set():
+                    return False
+                if self.post(url, body):
+                    with self.lock:
+                        self.devices_sent += len(body["devices"])
+                    if self.liveness is not None:
+                        self.liveness.note_triggered(body["devices"])
+                    print(f"✅ API Request successful - {len(body['devices'])} tags should start broadcasting")
+                    return True
+                if attempt + 1 < self.attempts:
+                    self.stop_event.wait(backoff_delay(attempt, self.backoff_base, self.backoff_cap, self.rng))
+        return False
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        """Stop the thread (an in-flight request is not interrupted) and close the session"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "rounds": self.rounds,
+                "successes": self.successes,
+                "attempts": self.attempts_made,
+                "devices_sent": self.devices_sent,
+                "consecutive_failures": self.consecutive_failures,
+                "disabled": self.disabled,
+                "seconds_since_success": None if self.last_success is None else self.clock() - self.last_success,
+            }
+        stats["latency_p50"] = latencies[len(latencies) // 2] if latencies else None
+        stats["latency_max"] = latencies[-1] if latencies else None
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        timing = (f"latency p50 {stats['latency_p50'] * 1000:.0f} ms, max {stats['latency_max'] * 1000:.0f} ms"
+                  if stats["latency_p50"] is not None else "no attempts yet")
+        since = (f"{stats['seconds_since_success']:.0f}s ago" if stats["seconds_since_success"] is not None else "never")
+        print(f"API trigger: {stats['successes']}/{stats['rounds']} rounds ok, {stats['attempts']} attempts, "
+              f"{stats['devices_sent']} tag triggers | {timing} | last success {since}{' | disabled' if stats['disabled'] else ''}")
+        if self.liveness is not None:
+            tags = self.liveness.summary()
+            print(f"   Tags: {tags['broadcasting']} broadcasting ({tags['silent']} silent since trigger), {tags['idle']} idle")
@@ -13,6 +13,9 @@ from typing import Dict, List, Tuple
 import glob
 from datetime import datetime
 
+from csv_manifest import CSVManifest
+from tag_registry import TAGS, FLOOR_NAMES
+
 # Set style for better-looking plots
 plt.style.use('seaborn-v0_8')
 sns.set_palette("husl")
@@ -21,29 +24,6 @@ sns.set_palette("husl")
 DATA_DIR = "ml_training_data_new"
 OUTPUT_DIR = "visualizations"
 
-# Tag MAC to floor mapping (from floor_success_rate.py)
-TAG_MAC_TO_FLOOR = {
-    # Downstairs tags (floor = 0)
-    'f260a59af3be': 0, 'e45428cd811f': 0, 'eaf519e486b7': 0, 'e71ebc086c12': 0,
-    'db87600e1088': 0, 'e75675d44213': 0, 'ea0efa76b1d7': 0, 'e3c858bb535e': 0,
-    'f9cf5a96910d': 0, 'e9ee05861174': 0, 'c5d89d98d531': 0, 'f17508753dd2': 0,
-    'ccd6b409ba05': 0, 'cfcba5a4aa8c': 0, 'dfe232164c0a': 0, 'ea130331a7d6': 0,
-    'fe916ad112d4': 0, 'cbafa76ff612': 0, 'd31e40a36148': 0, 'ed3dc76b5057': 0,
-    'f7fb6d248542': 0, 'e5618db03315': 0, 'c48718b206de': 0, 'ced95ba5af64': 0,
-    'e80511ee6f95': 0, 'f8e68ad462b8': 0, 'c07f2aebbfb2': 0, 'dc6fd1014985': 0,
-    'dbdfe63c5bfe': 0, 'f53d908ae87e': 0,
-    
-    # Mezzanine/upstairs tags (floor = 1)
-    'eacbbb80d2ae': 1, 'd55a17359cec': 1, 'c3fdcfc7cde7': 1, 'dd35e8065e41': 1,
-    'f1465d4b34ad': 1, 'd2433d346da0': 1, 'de8a7eb407c5': 1, 'fbde6b71de2c': 1,
-    'eed4934cb925': 1, 'c694e5297d8c': 1, 'dcb814adee27': 1, 'ee1ae8c0199b': 1,
-    'e12a0889fc9d': 1, 'ca70faad5185': 1, 'e1221fc96df8': 1, 'eabf49388a88': 1,
-    'faebae16f304': 1, 'e6a1121bd9ba': 1, 'ebc3d8c27268': 1, 'c0c28a5250d1': 1,
-    'eb7dd4251a0b': 1, 'dbd8f214e90c': 1, 'f8c6e10eb94d': 1, 'c61444ecfa21': 1,
-    'e6dee509ceb7': 1, 'e0187539099c': 1, 'cfa33b8f966f': 1, 'd1162b91f43c': 1,
-    'd908a64ff5c8': 1, 'e0179d3286a1': 1
-}
-
 def create_output_dir():
     """Create output directory for visualizations"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -52,6 +32,7 @@ def create_output_dir():
 def get_file_stats() -> pd.DataFrame:
     """Get basic statistics about all CSV files"""
     files_info = []
+    manifest = CSVManifest(DATA_DIR).load()
     csv_files = glob.glob(os.path.join(DATA_DIR, "*.csv"))
     
     for file_path in csv_files:
@@ -62,16 +43,18 @@ def get_file_stats() -> pd.DataFrame:
         size_bytes = os.path.getsize(file_path)
         size_mb = size_bytes / (1024 * 1024)
         
-        # Count lines (approximate message count)
-        try:
-            with open(file_path, 'r') as f:
-                line_count = sum(1 for _ in f) - 1  # Subtract header
-        except:
-            line_count = 0
+        # Row count from the generator's manifest, counting lines only if it is missing or stale
+        line_count = manifest.row_count(tag_mac, file_path)
+        if line_count is None:
+            try:
+                with open(file_path, 'r') as f:
+                    line_count = sum(1 for _ in f) - 1  # Subtract header
+            except:
+                line_count = 0
         
         # Get floor info
-        floor = TAG_MAC_TO_FLOOR.get(tag_mac, -1)
-        floor_name = "Downstairs" if floor == 0 else "Mezzanine" if floor == 1 else "Unknown"
+        floor = TAGS.floor(tag_mac)
+        floor_name = FLOOR_NAMES[floor] if floor >= 0 else "Unknown"
         
         files_info.append({
             'tag_mac': tag_mac,